@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Throughput and latency of phuey against the local fake bridge
+
+Runs each scenario for several device counts and writes the timings as
+JSON so runs can be compared over time:
+
+    python benchmarks/bench_bridge.py --devices 10 100 500 \\
+        --output bench_results.json
+
+Writes bypass the write scheduler so the numbers show phuey's own cost
+rather than the bridge's command budget.
+"""
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import phuey
+from phuey.cache import ConfigCache
+from phuey.fakebridge import FakeBridge, make_config
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(name, devices, samples, operations=1):
+    samples = sorted(samples)
+    mean = statistics.mean(samples)
+    return {"name": name, "devices": devices, "iterations": len(samples),
+            "mean": mean, "min": samples[0],
+            "p50": samples[len(samples) // 2],
+            "p95": samples[min(len(samples) - 1,
+                               int(len(samples) * 0.95))],
+            "ops_per_sec": operations / mean if mean else None}
+
+
+def bench_devices(devices, iterations, latency):
+    results = []
+    config = make_config(lights=devices, groups=max(1, devices // 10),
+                         sensors=max(1, devices // 20))
+    with FakeBridge(config, latency=latency) as fake:
+        address, user = fake.address, fake.user
+
+        def construct():
+            phuey.Bridge(address, user, rate_limit=False)
+        results.append(summarize("bridge_construct", devices,
+                                 timed(construct, iterations)))
+
+        directory = tempfile.mkdtemp()
+        cache = ConfigCache(directory, max_age=60)
+        phuey.Bridge(address, user, rate_limit=False, config_cache=cache)
+
+        def construct_cached():
+            phuey.Bridge(address, user, rate_limit=False, config_cache=cache)
+        results.append(summarize("bridge_construct_cached", devices,
+                                 timed(construct_cached, iterations)))
+        shutil.rmtree(directory)
+
+        bridge = phuey.Bridge(address, user, rate_limit=False)
+        lights = bridge.lights
+
+        def read_cached():
+            for light in lights:
+                light.on, light.bri
+        results.append(summarize("descriptor_get_cached", devices,
+                                 timed(read_cached, iterations),
+                                 len(lights) * 2))
+
+        def read_uncached():
+            for light in lights:
+                light.invalidate()
+                light.on
+        results.append(summarize("descriptor_get_uncached", devices,
+                                 timed(read_uncached, iterations),
+                                 len(lights)))
+
+        uris = [bridge.base_uri + "/lights/{}".format(light.light_id)
+                for light in lights]
+
+        def get_each():
+            bridge._get_many(uris)
+        results.append(summarize("get_many_keepalive", devices,
+                                 timed(get_each, iterations), len(uris)))
+
+        pipelined = phuey.Bridge(address, user, rate_limit=False,
+                                 transport="pipelined")
+
+        def get_pipelined():
+            pipelined._get_many(uris)
+        results.append(summarize("get_many_pipelined", devices,
+                                 timed(get_pipelined, iterations),
+                                 len(uris)))
+
+        memory = FakeBridge(config).transport()
+
+        def construct_in_memory():
+            phuey.Bridge("fake", user, rate_limit=False, transport=memory)
+        results.append(summarize("bridge_construct_memory", devices,
+                                 timed(construct_in_memory, iterations)))
+
+        def find():
+            bridge.find(model="LCT001", room="group 1", reachable=True)
+        results.append(summarize("find_indexed", devices,
+                                 timed(find, iterations)))
+
+        def write_each():
+            for light in lights:
+                light.bri = 100
+        results.append(summarize("descriptor_set", devices,
+                                 timed(write_each, iterations),
+                                 len(lights)))
+
+        def write_batched():
+            for light in lights:
+                with light.batch():
+                    light.on = True
+                    light.bri = 120
+                    light.alert = "none"
+        results.append(summarize("bulk_write_batched", devices,
+                                 timed(write_batched, iterations),
+                                 len(lights)))
+
+        def write_folded():
+            with phuey.Batch(*lights, groups=bridge.groups):
+                for light in lights:
+                    light.bri = 140
+        results.append(summarize("bulk_write_group_folded", devices,
+                                 timed(write_folded, iterations),
+                                 len(lights)))
+
+        def group_action():
+            for group in bridge.groups:
+                group.on = False
+        results.append(summarize("group_set", devices,
+                                 timed(group_action, iterations),
+                                 len(bridge.groups)))
+    phuey.BridgeContext.reset_all()
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--devices', '-d', type=int, nargs='+',
+                            default=[10, 100, 500])
+    arg_parser.add_argument('--iterations', '-i', type=int, default=5)
+    arg_parser.add_argument('--latency', type=float, default=0.0,
+                            help="seconds the fake bridge waits per request")
+    arg_parser.add_argument('--output', '-o', metavar="FILE",
+                            help="write results as JSON to FILE")
+    args = arg_parser.parse_args()
+    results = []
+    for devices in args.devices:
+        results.extend(bench_devices(devices, args.iterations, args.latency))
+    for result in results:
+        print("{name:<26}{devices:>6} devices {mean:>10.6f}s "
+              "{ops_per_sec:>12.1f} ops/s".format(**result))
+    if args.output:
+        document = {"phuey": phuey.__version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.time(), "latency": args.latency,
+                    "results": results}
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
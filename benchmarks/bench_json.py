@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Encode and decode cost of bridge documents for every JSON backend
+
+Compares the old path (bytes decoded to str, then json.loads) with every
+backend phuey.serializer can use, on full configs of realistic sizes and
+on the small state bodies sent with every write:
+
+    python benchmarks/bench_json.py --devices 10 100 500 --output json.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+import phuey
+from phuey import serializer
+from phuey.fakebridge import make_config
+
+STATE = {"on": True, "bri": 200, "xy": [0.4677, 0.4121],
+         "transitiontime": 4}
+
+
+def per_call(func, number):
+    best = min(timeit.repeat(func, number=number, repeat=3))
+    return best / number
+
+
+def bench_devices(devices, number):
+    config = make_config(lights=devices, groups=max(1, devices // 10),
+                         sensors=max(1, devices // 20))
+    document = json.dumps(config).encode("utf-8")
+    results = [{"name": "decode_config", "backend": "stdlib_str",
+                "devices": devices, "bytes": len(document),
+                "seconds": per_call(lambda: json.loads(
+                    document.decode("utf-8")), number)}]
+    for name, (encode, decode) in serializer.BACKENDS.items():
+        results.append({"name": "decode_config", "backend": name,
+                        "devices": devices, "bytes": len(document),
+                        "seconds": per_call(lambda: decode(document),
+                                            number)})
+        results.append({"name": "encode_state", "backend": name,
+                        "devices": devices, "bytes": len(encode(STATE)),
+                        "seconds": per_call(lambda: encode(STATE),
+                                            number * 100)})
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--devices', '-d', type=int, nargs='+',
+                            default=[10, 100, 500])
+    arg_parser.add_argument('--number', '-n', type=int, default=50)
+    arg_parser.add_argument('--output', '-o', metavar="FILE",
+                            help="write results as JSON to FILE")
+    args = arg_parser.parse_args()
+    results = []
+    for devices in args.devices:
+        results.extend(bench_devices(devices, args.number))
+    for result in results:
+        print("{name:<15}{backend:<12}{devices:>6} devices {bytes:>9} bytes "
+              "{seconds:>12.8f}s".format(**result))
+    if args.output:
+        document = {"phuey": phuey.__version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.time(), "results": results}
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Bytes per Light/Group/Sensor handle
+
+Builds COUNT handles of each kind for one bridge, the way Bridge does for
+its children, and reports the memory they hold according to tracemalloc.
+
+    python benchmarks/bench_memory.py --count 10000
+"""
+import argparse
+import gc
+import tracemalloc
+
+import phuey
+
+
+def measure(factory, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    handles = [factory(i) for i in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'lineno'))
+    del handles
+    return size / count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--count', '-n', type=int, default=10000)
+    args = arg_parser.parse_args()
+    ip, user = "192.168.1.2", "0123456789abcdef0123456789abcdef"
+    kinds = (('Light', lambda i: phuey.Light(ip, user, i)),
+             ('Group', lambda i: phuey.Group(ip, user, i)),
+             ('Sensor', lambda i: phuey.Sensor(ip, user, i)))
+    for name, factory in kinds:
+        print("{:<8}{:>10.1f} bytes/object".format(name,
+                                                   measure(factory,
+                                                           args.count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Reproducible Bridge construction and polling numbers from a replayed log
+
+Records one construction and one poll against the local fake bridge (or
+uses a log recorded from a real hub with --log), then replays it as fast
+as possible, so the timings only measure phuey itself:
+
+    python benchmarks/bench_replay.py --devices 100 500 --polls 200
+    python benchmarks/bench_replay.py --log evening.log --ip 192.168.1.2 \\
+        --user USER
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import phuey
+from phuey import replay
+from phuey.fakebridge import FakeBridge, make_config
+
+
+def record_log(devices, path):
+    config = make_config(lights=devices, groups=max(1, devices // 10),
+                         sensors=max(1, devices // 20))
+    with FakeBridge(config) as fake:
+        with replay.record(fake.address, path):
+            bridge = phuey.Bridge(fake.address, fake.user, rate_limit=False)
+            bridge.refresh()
+        address, user = fake.address, fake.user
+    phuey.BridgeContext.reset_all()
+    return address, user
+
+
+def bench_log(ip, user, path, devices, iterations, polls):
+    results = []
+    with replay.replay(ip, path, speed=None):
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            bridge = phuey.Bridge(ip, user, rate_limit=False)
+            samples.append(time.perf_counter() - start)
+        results.append({"name": "bridge_construct", "devices": devices,
+                        "mean": statistics.mean(samples),
+                        "min": min(samples), "ops_per_sec":
+                        1 / statistics.mean(samples)})
+        start = time.perf_counter()
+        for _ in range(polls):
+            bridge.refresh()
+        elapsed = time.perf_counter() - start
+        results.append({"name": "poll_refresh", "devices": devices,
+                        "mean": elapsed / polls, "min": None,
+                        "ops_per_sec": polls / elapsed})
+    phuey.BridgeContext.reset_all()
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--devices', '-d', type=int, nargs='+',
+                            default=[10, 100, 500])
+    arg_parser.add_argument('--iterations', '-i', type=int, default=20)
+    arg_parser.add_argument('--polls', '-p', type=int, default=100)
+    arg_parser.add_argument('--log', metavar="FILE",
+                            help="replay FILE instead of a fake bridge log")
+    arg_parser.add_argument('--ip', help="bridge address recorded in --log")
+    arg_parser.add_argument('--user', help="user recorded in --log")
+    arg_parser.add_argument('--output', '-o', metavar="FILE",
+                            help="write results as JSON to FILE")
+    args = arg_parser.parse_args()
+    results = []
+    if args.log:
+        results.extend(bench_log(args.ip, args.user, args.log, None,
+                                 args.iterations, args.polls))
+    else:
+        directory = tempfile.mkdtemp()
+        for devices in args.devices:
+            path = os.path.join(directory, "{}.log".format(devices))
+            ip, user = record_log(devices, path)
+            results.extend(bench_log(ip, user, path, devices,
+                                     args.iterations, args.polls))
+            os.unlink(path)
+        os.rmdir(directory)
+    for result in results:
+        print("{name:<20}{devices!s:>6} devices {mean:>10.6f}s "
+              "{ops_per_sec:>10.1f} ops/s".format(**result))
+    if args.output:
+        document = {"phuey": phuey.__version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.time(), "results": results}
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Process startup cost of the light command line entry point
+
+Starts fresh interpreters the way cron or an automation hook would and
+times them end to end, against the local fake bridge.  import_phuey_eager
+imports what phuey leaves until the first request, the difference to
+import_phuey is what --help and argument errors no longer pay for.  Runs
+use cached bytecode, as an installed package does:
+
+    python benchmarks/bench_startup.py --runs 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import phuey
+from phuey.fakebridge import FakeBridge, make_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed_run(command, runs):
+    environment = dict(os.environ, PYTHONPATH=ROOT)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    # one untimed run to write the bytecode cache
+    subprocess.run(command, env=environment, check=True,
+                   stdout=subprocess.DEVNULL)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=environment, check=True,
+                       stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {"mean": statistics.mean(samples), "min": samples[0],
+            "p50": samples[len(samples) // 2], "runs": runs}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--runs', '-r', type=int, default=10)
+    arg_parser.add_argument('--output', '-o', metavar="FILE",
+                            help="write results as JSON to FILE")
+    args = arg_parser.parse_args()
+    python = [sys.executable]
+    results = {}
+    with FakeBridge(make_config(lights=10)) as fake:
+        cli = python + ['-m', 'phuey.light_cli', '-b', fake.address,
+                        '-u', fake.user]
+        scenarios = [
+            ("interpreter", python + ['-c', 'pass']),
+            ("import_phuey", python + ['-c', 'import phuey']),
+            ("import_phuey_eager", python + [
+                '-c', 'import phuey, phuey.serializer, http.client']),
+            ("cli_help", python + ['-m', 'phuey.light_cli', '--help']),
+            ("cli_one_light", cli + ['-l', '1', '-c', 'on=true']),
+            ("cli_five_lights", cli + ['-l', '1', '-l', '2', '-l', '3',
+                                       '-l', '4', '-l', '5',
+                                       '-c', 'bri=100']),
+        ]
+        for name, command in scenarios:
+            results[name] = timed_run(command, args.runs)
+            print("{:<18}{mean:>10.4f}s mean {min:>10.4f}s min".format(
+                name, **results[name]))
+    if args.output:
+        document = {"phuey": phuey.__version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.time(), "results": results}
+        with open(args.output, 'w') as output:
+            json.dump(document, output, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
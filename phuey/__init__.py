@@ -1,28 +1,56 @@
 #!/usr/bin/env python3
-import argparse
-import json
+import collections
+import importlib
 import logging
+import random
 import sys
-from socket import timeout
+import threading
+import time
 
 __version__ = "1.0"
 __updated__ = "2016-06-01"
 
 logger = logging.getLogger()
 
-major, minor = sys.version_info[0:2]
-if (major, minor) == (2, 6) or (major, minor) == (2, 7):
-    try:
-        import httplib as http_client
-    except ImportError as ie:
-        logger.error(ie)
-        msg = "Error httplib not found in this version: {}.{}"
-        logger.critical(msg.format(major, minor))
-        raise ImportError
-elif major == 2 and minor < 6:
-    raise RuntimeError("Not supported on Python versions older than 2.6")
-elif major >= 3:
-    import http.client as http_client
+# http.client, the JSON backends and json are only needed once a request is
+# made, so they are imported on first use, see __getattr__.  Importing phuey
+# or starting phuey-light --help never pays for them.
+_LAZY_MODULES = {"http_client": "http.client", "json": "json",
+                 "serializer": "phuey.serializer"}
+
+
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        value = importlib.import_module(_LAZY_MODULES[name])
+    elif name == "_STALE_ERRORS":
+        # errors raised when a kept-alive socket was closed by the bridge
+        # while idle
+        http_client = importlib.import_module("http.client")
+        value = (http_client.BadStatusLine, http_client.CannotSendRequest,
+                 ConnectionResetError, BrokenPipeError)
+    else:
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+            __name__, name))
+    globals()[name] = value
+    return value
+
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 5
+DEFAULT_CACHE_TTL = 1.0
+# commands per second the bridge accepts before dropping or delaying them
+LIGHT_COMMANDS_PER_SECOND = 10
+GROUP_COMMANDS_PER_SECOND = 1
+# write scheduler priority lanes, lower is served first
+INTERACTIVE = 0
+BULK = 1
+# consecutive failed requests before a bridge's circuit breaker opens, and
+# seconds it stays open before letting a probe request through
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+
+# headers of every request, the bridge only speaks JSON
+_JSON_HEADERS = {"Content-type": "application/json"}
 
 
 def get_version():
@@ -30,6 +58,8 @@ def get_version():
 
 
 def get_args():
+    # argparse is only needed when run as a script, keep it off import time
+    import argparse
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument('--bridge', '-b', metavar="BRIDGEIPADDRESS")
     arg_parser.add_argument('--user', '-u', metavar="USERNAME")
@@ -45,55 +75,1097 @@ def get_args():
     return bridge_ip, user, log_level
 
 
-class HueObject:
-    def __init__(self, ip, username):
+def error_check_response(non_json_payload, log=logger):
+    """Decode a bridge response, raising AttributeError on a bridge error
+
+    non_json_payload may be bytes or str and is parsed exactly once.
+    """
+    from phuey import serializer
+    payload = serializer.loads(non_json_payload)
+    if isinstance(payload, list) and payload and 'error' in payload[0]:
+        description = payload[0]['error']['description']
+        log.error(description)
+        log.debug(payload)
+        raise AttributeError(description)
+    else:
+        return payload
+
+
+class Transport:
+    """How the objects of a bridge exchange requests with it
+
+    Subclasses implement exchange; ConnectionPool, the default, keeps
+    HTTP/1.1 connections alive.  phuey.transport has HTTPS, pipelining and
+    in-memory transports.  A transport that sets pipelining answers
+    exchange_many with one round trip for many requests.  Exceptions in
+    fatal_errors mean the bridge answered but must not be trusted; they
+    reach the caller as they are and are never retried.
+    """
+    pipelining = False
+    fatal_errors = ()
+    timeout = DEFAULT_TIMEOUT
+
+    def exchange(self, meth, url, body=None, headers=None, timeout=None):
+        """Send one request, returning (status, reason, body bytes)
+
+        The body is None for responses with an error status.  Failures to
+        reach the bridge raise.
+        """
+        raise NotImplementedError
+
+    def exchange_many(self, requests, headers=None, timeout=None):
+        """Send (meth, url, body) requests, returning results in order"""
+        return [self.exchange(meth, url, body, headers, timeout)
+                for meth, url, body in requests]
+
+    def resize(self, maxsize):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class ConnectionPool(Transport):
+    """Persistent HTTP/1.1 keep-alive connections to a single bridge
+
+    One pool exists per bridge address and is shared by every HueObject
+    talking to it, see ConnectionPool.for_bridge.  The address may carry a
+    port as "host:port", port 80 is used otherwise.  connection_factory,
+    called like HTTPConnection, replaces it for new connections, see
+    phuey.replay.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, ip, port=None, maxsize=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT):
+        self.logger = logging.getLogger(__name__ + ".ConnectionPool")
+        self.ip = ip
+        self.port = port
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.connection_factory = None
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_bridge(cls, ip, maxsize=None):
+        """Return the pool shared by all objects of the bridge at ip"""
+        with cls._pools_lock:
+            pool = cls._pools.get(ip)
+            if pool is None:
+                pool = cls._pools[ip] = cls(ip)
+        if maxsize is not None:
+            pool.resize(maxsize)
+        return pool
+
+    @classmethod
+    def close_all(cls):
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def _connect(self):
+        if self.connection_factory is not None:
+            return self.connection_factory(self.ip, self.port,
+                                           timeout=self.timeout)
+        return self._new_connection()
+
+    def _new_connection(self):
+        """A connection of the pool's own kind, ignoring the factory"""
+        from phuey import http_client
+        return http_client.HTTPConnection(self.ip, self.port,
+                                          timeout=self.timeout)
+
+    def acquire(self):
+        """Return a (connection, reused) tuple, reusing an idle one first"""
+        with self._lock:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop(), True
+            self.misses += 1
+        return self._connect(), False
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def discard(self, connection):
+        connection.close()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            extra = []
+            while len(self._idle) > maxsize:
+                extra.append(self._idle.popleft())
+        for connection in extra:
+            connection.close()
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "reconnects": self.reconnects, "idle": len(self._idle),
+                    "maxsize": self.maxsize}
+
+    def urlopen(self, meth, url, body=None, headers=None, timeout=None):
+        """Send a request, returning the (connection, response) pair
+
+        A pooled connection the bridge closed while idle is thrown away and
+        the request is sent again on a fresh one.  The caller must hand the
+        connection back with release or discard once the body is read.
+        timeout overrides the pool's socket timeout for this request.
+        """
+        from phuey import _STALE_ERRORS
+        while True:
+            connection, reused = self.acquire()
+            self._set_timeout(connection, self.timeout if timeout is None
+                              else timeout)
+            try:
+                connection.request(meth, url, body, headers or {})
+                return connection, connection.getresponse()
+            except _STALE_ERRORS:
+                connection.close()
+                if not reused:
+                    raise
+                self.reconnects += 1
+                self.logger.debug("Stale connection to %s, reconnecting",
+                                  self.ip)
+            except Exception:
+                connection.close()
+                raise
+
+    def exchange(self, meth, url, body=None, headers=None, timeout=None):
+        connection, response = self.urlopen(meth, url, body, headers,
+                                            timeout)
+        if response.status >= 400:
+            self.discard(connection)
+            return response.status, response.reason, None
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Bridge header response: %s",
+                              response.getheaders())
+        try:
+            data = response.read()
+        except Exception:
+            self.discard(connection)
+            raise
+        if response.will_close:
+            self.discard(connection)
+        else:
+            self.release(connection)
+        return response.status, response.reason, data
+
+    def _set_timeout(self, connection, timeout):
+        if getattr(connection, 'timeout', None) == timeout:
+            return
+        connection.timeout = timeout
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            sock.settimeout(timeout)
+
+
+class RateLimitError(RuntimeError):
+    """The bridge answered that it is too busy to take the request"""
+
+
+class BridgeUnavailableError(RuntimeError):
+    """The bridge's circuit breaker is open, no request was sent"""
+
+
+class _TransportError(RuntimeError):
+    """The request never got an answer: timeout, reset or similar"""
+
+
+class RetryPolicy:
+    """How often and how patiently idempotent requests are tried again
+
+    Requests with a method in methods that fail in transit or are answered
+    with a 429 or 503 are sent up to attempts times, sleeping a random time
+    between zero and backoff * 2 ** retry seconds (at most max_backoff) in
+    between.  timeout caps every attempt, the connection pool's timeout is
+    used when it is None, and deadline caps the whole request including
+    retries.
+    """
+    def __init__(self, attempts=3, backoff=0.1, max_backoff=2.0,
+                 timeout=None, deadline=None, methods=("GET", "PUT"),
+                 seed=None):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.deadline = deadline
+        self.methods = methods
+        self._random = random.Random(seed)
+
+    def delay(self, retry):
+        """Seconds to wait before retry number retry, counting from 1"""
+        cap = min(self.max_backoff, self.backoff * 2 ** (retry - 1))
+        return self._random.uniform(0, cap)
+
+
+# used by contexts that are not given a RetryPolicy of their own
+DEFAULT_RETRY = RetryPolicy()
+
+
+class CircuitBreaker:
+    """Fail fast while a bridge is down
+
+    After threshold consecutive requests that got no answer the breaker
+    opens and every request raises BridgeUnavailableError without touching
+    the network.  After reset_timeout seconds a single probe request is let
+    through; its success closes the breaker, its failure opens it again.
+    One breaker exists per bridge address, see CircuitBreaker.for_bridge.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+    def __init__(self, ip, threshold=BREAKER_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.monotonic):
+        self.logger = logging.getLogger(__name__ + ".CircuitBreaker")
+        self.ip = ip
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.failures = 0
+        self.retries = 0
+        self.trips = 0
+        self.rejected = 0
+        self._opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_bridge(cls, ip):
+        """Return the breaker shared by all objects of the bridge at ip"""
+        with cls._breakers_lock:
+            breaker = cls._breakers.get(ip)
+            if breaker is None:
+                breaker = cls._breakers[ip] = cls(ip)
+            return breaker
+
+    @classmethod
+    def reset_all(cls):
+        with cls._breakers_lock:
+            cls._breakers.clear()
+
+    def allow(self):
+        """Raise BridgeUnavailableError unless a request may be sent now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if (self.state == self.OPEN and
+                    self.clock() - self._opened >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise BridgeUnavailableError(
+            "Bridge {} is unavailable, not sending".format(self.ip))
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self.logger.info("Bridge %s is back", self.ip)
+                self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive += 1
+            self._probing = False
+            if (self.state == self.HALF_OPEN or
+                    (self.state == self.CLOSED and
+                     self.consecutive >= self.threshold)):
+                self.logger.warning("Bridge %s failed %d times, failing fast "
+                                    "for %ss", self.ip, self.consecutive,
+                                    self.reset_timeout)
+                self.state = self.OPEN
+                self.trips += 1
+                self._opened = self.clock()
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "consecutive": self.consecutive,
+                    "failures": self.failures, "retries": self.retries,
+                    "trips": self.trips, "rejected": self.rejected}
+
+
+class TokenBucket:
+    """Token bucket allowing rate events per second in bursts of capacity"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self):
+        """Seconds until a token is available, 0 when one is"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _Write:
+    def __init__(self, send, url, payload, priority):
+        self.send = send
+        self.url = url
+        self.payload = payload
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.callbacks = []
+
+    def run(self):
+        try:
+            self.result = self.send(self.url, self.payload, "PUT")
+            for callback in self.callbacks:
+                callback(self.payload)
+        except Exception as ee:
+            self.error = ee
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class WriteScheduler:
+    """Paces state writes to one bridge within its command budget
+
+    Writes to light state and group action URIs each draw from their own
+    token bucket.  Queued writes are served interactive lane first, and a
+    write to a state_uri that is still queued is merged into the pending
+    one (last write wins per attribute) instead of being sent twice.
+    Callers block until their write went out and get its response; the
+    sent callback of each is called with the merged payload that went out.
+    """
+    _schedulers = {}
+    _schedulers_lock = threading.Lock()
+    # seconds an idle worker thread lingers before exiting
+    idle_timeout = 1.0
+
+    def __init__(self, ip, light_rate=LIGHT_COMMANDS_PER_SECOND,
+                 group_rate=GROUP_COMMANDS_PER_SECOND):
+        self.logger = logging.getLogger(__name__ + ".WriteScheduler")
         self.ip = ip
-        self.create_user_url = "/api"
-        self.base_uri = self.create_user_url + "/" + username
-        self.user = username
-        self.logger = logging.getLogger(__name__ + ".HueObject")
-        self.device_type = 'phuey'
+        self.buckets = {'lights': TokenBucket(light_rate, 1),
+                        'groups': TokenBucket(group_rate, 1)}
+        self._lanes = (collections.deque(), collections.deque())
+        self._queued = {}
+        self._cond = threading.Condition()
+        self._worker = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @classmethod
+    def for_bridge(cls, ip):
+        """Return the scheduler shared by all objects of the bridge at ip"""
+        with cls._schedulers_lock:
+            scheduler = cls._schedulers.get(ip)
+            if scheduler is None:
+                scheduler = cls._schedulers[ip] = cls(ip)
+            return scheduler
+
+    @classmethod
+    def reset_all(cls):
+        with cls._schedulers_lock:
+            cls._schedulers.clear()
+
+    @staticmethod
+    def budget(url):
+        """Name of the bucket a PUT to url draws from, None if unlimited"""
+        if '/lights/' in url and url.endswith('/state'):
+            return 'lights'
+        if '/groups/' in url and url.endswith('/action'):
+            return 'groups'
+        return None
+
+    def try_acquire(self, budget):
+        """Take a token from the named bucket without queueing, if one is free
+
+        For callers pacing themselves, e.g. real-time effects that would
+        rather skip a command than send it late.
+        """
+        with self._cond:
+            bucket = self.buckets[budget]
+            if bucket.delay() > 0:
+                return False
+            bucket.consume()
+            return True
+
+    @property
+    def depth(self):
+        return len(self._lanes[INTERACTIVE]) + len(self._lanes[BULK])
+
+    def submit(self, send, url, payload, priority=INTERACTIVE, sent=None):
+        """Queue send(url, payload, "PUT") and block until it ran
+
+        sent, if given, is called once with the payload actually sent after
+        the PUT succeeded, before any caller merged into it returns.
+        """
+        with self._cond:
+            self.submitted += 1
+            entry = self._queued.get(url)
+            if entry is not None:
+                self.coalesced += 1
+                entry.payload.update(payload)
+                if priority < entry.priority:
+                    self._lanes[entry.priority].remove(entry)
+                    self._lanes[priority].append(entry)
+                    entry.priority = priority
+            else:
+                entry = _Write(send, url, dict(payload), priority)
+                self._queued[url] = entry
+                self._lanes[priority].append(entry)
+                self.max_depth = max(self.max_depth, self.depth)
+            if sent is not None and sent not in entry.callbacks:
+                entry.callbacks.append(sent)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run,
+                                                name="phuey-scheduler",
+                                                daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return entry.wait()
+
+    def _next(self):
+        """Pop the first sendable write, or return the seconds to wait"""
+        wait = None
+        for lane in self._lanes:
+            for entry in lane:
+                bucket = self.buckets[self.budget(entry.url)]
+                delay = bucket.delay()
+                if delay <= 0:
+                    bucket.consume()
+                    lane.remove(entry)
+                    del self._queued[entry.url]
+                    return entry, None
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                entry, wait = self._next()
+                while entry is None:
+                    if wait is None and not self._cond.wait(self.idle_timeout):
+                        if not self.depth:
+                            self._worker = None
+                            return
+                    elif wait is not None:
+                        self._cond.wait(wait)
+                    entry, wait = self._next()
+                waited = time.monotonic() - entry.queued_at
+                self.sent += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            self.logger.debug("Sending %s after %.3fs in queue", entry.url,
+                              waited)
+            entry.run()
+
+    def stats(self):
+        with self._cond:
+            return {"depth": self.depth, "max_depth": self.max_depth,
+                    "submitted": self.submitted, "coalesced": self.coalesced,
+                    "sent": self.sent, "wait_total": self.wait_total,
+                    "wait_max": self.wait_max,
+                    "wait_avg": self.wait_total / self.sent if self.sent
+                    else 0.0}
+
+
+def _uri_template(url):
+    """Collapse user and item ids so requests group by endpoint"""
+    parts = url.split("/")
+    if len(parts) > 2:
+        parts[2] = "<user>"
+    if len(parts) > 4:
+        parts[4] = "<id>"
+    return "/".join(parts)
+
+
+def _prometheus_labels(labels):
+    return ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\")
+                                     .replace('"', '\\"')
+                                     .replace("\n", "\\n"))
+                    for key, value in labels)
+
+
+class Instrumentation:
+    """Request hooks and per-endpoint metrics for every bridge request
+
+    Metrics are only collected while enabled and hooks only run while
+    registered; with neither, _send skips this class entirely.  Pre hooks
+    are called as hook(bridge, method, url, payload) and post hooks as
+    hook(bridge, method, url, status, error, elapsed), where error is the
+    bridge's error description or the exception type that was raised.
+    """
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__ + ".Instrumentation")
+        self.enabled = False
+        self.pre_hooks = []
+        self.post_hooks = []
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.enabled or bool(self.pre_hooks) or bool(self.post_hooks)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def add_pre_hook(self, hook):
+        self.pre_hooks.append(hook)
+
+    def add_post_hook(self, hook):
+        self.post_hooks.append(hook)
+
+    def remove_hook(self, hook):
+        for hooks in (self.pre_hooks, self.post_hooks):
+            if hook in hooks:
+                hooks.remove(hook)
+
+    def before(self, bridge, meth, url, payload):
+        for hook in self.pre_hooks:
+            try:
+                hook(bridge, meth, url, payload)
+            except Exception as ee:
+                self.logger.error("Pre request hook %r failed: %s", hook, ee)
+
+    def after(self, bridge, meth, url, status, error, elapsed):
+        if self.enabled:
+            key = (bridge, meth, _uri_template(url), status, error)
+            with self._lock:
+                stat = self._stats.get(key)
+                if stat is None:
+                    stat = self._stats[key] = [0, 0.0, 0.0,
+                                               [0] * len(self.buckets)]
+                stat[0] += 1
+                stat[1] += elapsed
+                stat[2] = max(stat[2], elapsed)
+                for i, bound in enumerate(self.buckets):
+                    if elapsed <= bound:
+                        stat[3][i] += 1
+                        break
+        for hook in self.post_hooks:
+            try:
+                hook(bridge, meth, url, status, error, elapsed)
+            except Exception as ee:
+                self.logger.error("Post request hook %r failed: %s", hook, ee)
+
+    def snapshot(self):
+        """Return the collected metrics as a list of dicts, one per series"""
+        with self._lock:
+            items = [(key, (stat[0], stat[1], stat[2], list(stat[3])))
+                     for key, stat in self._stats.items()]
+        series = []
+        for (bridge, meth, endpoint, status, error), stat in items:
+            count, total, slowest, counts = stat
+            cumulative, running = {}, 0
+            for bound, hits in zip(self.buckets, counts):
+                running += hits
+                cumulative[bound] = running
+            series.append({"bridge": bridge, "method": meth,
+                           "endpoint": endpoint, "status": status,
+                           "error": error, "count": count, "sum": total,
+                           "max": slowest, "buckets": cumulative})
+        return series
+
+    def to_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = ["# HELP phuey_requests_total Requests sent to Hue bridges",
+                 "# TYPE phuey_requests_total counter"]
+        series = self.snapshot()
+        for entry in series:
+            lines.append("phuey_requests_total{{{}}} {}".format(
+                _prometheus_labels(self._labels(entry)), entry["count"]))
+        lines.extend(["# HELP phuey_request_duration_seconds Bridge request "
+                      "latency",
+                      "# TYPE phuey_request_duration_seconds histogram"])
+        for entry in series:
+            labels = self._labels(entry)
+            for bound, count in sorted(entry["buckets"].items()):
+                lines.append("phuey_request_duration_seconds_bucket{{{}}} {}"
+                             .format(_prometheus_labels(
+                                 labels + [("le", repr(float(bound)))]),
+                                 count))
+            lines.append("phuey_request_duration_seconds_bucket{{{}}} {}"
+                         .format(_prometheus_labels(labels + [("le", "+Inf")]),
+                                 entry["count"]))
+            text = _prometheus_labels(labels)
+            lines.append("phuey_request_duration_seconds_sum{{{}}} {}".format(
+                text, entry["sum"]))
+            lines.append("phuey_request_duration_seconds_count{{{}}} {}"
+                         .format(text, entry["count"]))
+        lines.extend(self._breaker_lines())
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _breaker_lines():
+        with CircuitBreaker._breakers_lock:
+            stats = [(ip, breaker.stats()) for ip, breaker in
+                     sorted(CircuitBreaker._breakers.items())]
+        lines = []
+        for name, key, kind, text in (
+                ("phuey_retries_total", "retries", "counter",
+                 "Requests sent again after a transient failure"),
+                ("phuey_breaker_trips_total", "trips", "counter",
+                 "Times a bridge's circuit breaker opened"),
+                ("phuey_breaker_rejected_total", "rejected", "counter",
+                 "Requests failed fast by an open circuit breaker"),
+                ("phuey_breaker_open", "state", "gauge",
+                 "1 while a bridge's circuit breaker is not closed")):
+            lines.extend(["# HELP {} {}".format(name, text),
+                          "# TYPE {} {}".format(name, kind)])
+            for ip, stat in stats:
+                value = stat[key]
+                if key == "state":
+                    value = int(value != CircuitBreaker.CLOSED)
+                lines.append("{}{{{}}} {}".format(
+                    name, _prometheus_labels([("bridge", ip)]), value))
+        return lines
+
+    @staticmethod
+    def _labels(entry):
+        return [("bridge", entry["bridge"]), ("method", entry["method"]),
+                ("endpoint", entry["endpoint"]),
+                ("status", "" if entry["status"] is None else entry["status"]),
+                ("error", entry["error"] or "")]
+
+
+# request instrumentation shared by every bridge, see Instrumentation
+instrumentation = Instrumentation()
+
+
+# one changed field of a bridge item, as yielded by Bridge.watch
+Change = collections.namedtuple('Change', 'kind item_id field old new item')
+
+# outcome of one operation sent by Bridge.bulk or Bridge.sync, error is
+# the exception raised when ok is false
+BulkResult = collections.namedtuple('BulkResult',
+                                    'op item_id ok response error')
+
+
+def _diff_item(kind, item_id, item, old, new):
+    """Yield a Change for every field that differs between two snapshots
+
+    Nested blocks such as state, action or config are compared key by key
+    and reported as "state.on" style fields.
+    """
+    for field, value in new.items():
+        before = old.get(field)
+        if before == value:
+            continue
+        if isinstance(value, dict) and isinstance(before, dict):
+            for key, subvalue in value.items():
+                if before.get(key) != subvalue:
+                    yield Change(kind, item_id, field + "." + key,
+                                 before.get(key), subvalue, item)
+            for key in before:
+                if key not in value:
+                    yield Change(kind, item_id, field + "." + key,
+                                 before[key], None, item)
+        else:
+            yield Change(kind, item_id, field, before, value, item)
+    for field in old:
+        if field not in new:
+            yield Change(kind, item_id, field, old[field], None, item)
+
+
+class BridgeContext:
+    """Everything the objects of one bridge and user have in common
+
+    Handles keep a reference to their context instead of their own copies
+    of the address, user, URIs, transport and write scheduler.  Objects
+    created on their own share one context per (ip, user), a Bridge makes
+    a fresh one for its children so its options stay local.  transport is
+    the shared ConnectionPool of ip unless another is given.  generation
+    counts the changes to the objects' snapshots that Bridge.find indexes.
+    """
+    __slots__ = ('ip', 'user', 'base_uri', 'cache_ttl', 'transport',
+                 'scheduler', 'retry', 'breaker', 'generation')
+    _contexts = {}
+    _contexts_lock = threading.Lock()
+
+    def __init__(self, ip, user, cache_ttl=None, rate_limit=True,
+                 retry=None, transport=None):
+        self.ip = ip
+        self.user = user
+        if user is None:
+            self.base_uri = HueObject.create_user_url
+        else:
+            self.base_uri = HueObject.create_user_url + "/" + user
+        self.cache_ttl = DEFAULT_CACHE_TTL if cache_ttl is None else cache_ttl
+        if transport is None:
+            transport = ConnectionPool.for_bridge(ip)
+        self.transport = transport
+        if rate_limit:
+            self.scheduler = WriteScheduler.for_bridge(ip)
+        else:
+            self.scheduler = None
+        self.retry = DEFAULT_RETRY if retry is None else retry
+        self.breaker = CircuitBreaker.for_bridge(ip)
+        self.generation = 0
+
+    @classmethod
+    def for_bridge(cls, ip, user):
+        """Return the context shared by standalone objects of ip and user"""
+        with cls._contexts_lock:
+            context = cls._contexts.get((ip, user))
+            if context is None:
+                context = cls._contexts[(ip, user)] = cls(ip, user)
+            return context
+
+    @property
+    def pool(self):
+        return self.transport
+
+    @classmethod
+    def reset_all(cls):
+        """Forget shared contexts, pools, schedulers and circuit breakers"""
+        with cls._contexts_lock:
+            cls._contexts.clear()
+        ConnectionPool.close_all()
+        WriteScheduler.reset_all()
+        CircuitBreaker.reset_all()
+
+
+# marks a HueObject without its own cache_ttl, using its context's instead
+_INHERIT = object()
+
+
+class HueObject:
+    __slots__ = ('_ctx', '_cache', '_cache_time', '_pending', '_ttl',
+                 'priority')
+    logger = logging.getLogger(__name__ + ".HueObject")
+    create_user_url = "/api"
+    device_type = 'phuey'
+    # key of the snapshot holding the attributes written through state_uri
+    state_key = 'state'
+
+    def __init__(self, ip, username, context=None):
+        if context is None:
+            context = BridgeContext.for_bridge(ip, username)
+        self._ctx = context
+        self._cache = None
+        self._cache_time = 0
+        self._pending = None
+        self._ttl = _INHERIT
+        # WriteScheduler lane used for this object's state writes
+        self.priority = INTERACTIVE
+
+    @property
+    def ip(self):
+        return self._ctx.ip
+
+    @property
+    def user(self):
+        return self._ctx.user
+
+    @property
+    def base_uri(self):
+        return self._ctx.base_uri
+
+    @property
+    def transport(self):
+        return self._ctx.transport
+
+    @property
+    def pool(self):
+        return self._ctx.transport
+
+    @property
+    def scheduler(self):
+        return self._ctx.scheduler
+
+    @property
+    def cache_ttl(self):
+        """Seconds a snapshot stays valid, None keeps it until invalidated"""
+        if self._ttl is _INHERIT:
+            return self._ctx.cache_ttl
+        return self._ttl
+
+    @cache_ttl.setter
+    def cache_ttl(self, ttl):
+        self._ttl = ttl
 
     def _req(self, url, payload=None, meth="GET"):
-        self.logger.debug("HTTP {} on {}".format(meth, url, payload))
-        connection = http_client.HTTPConnection(self.ip, 80, timeout=5)
+        if (meth == "PUT" and self.scheduler is not None and
+                self.scheduler.budget(url) is not None):
+            return self.scheduler.submit(self._send, url, payload,
+                                         self.priority)
+        return self._send(url, payload, meth)
+
+    def _send(self, url, payload=None, meth="GET"):
+        """Send a request under the context's RetryPolicy and CircuitBreaker
+        """
+        retry = self._ctx.retry
+        breaker = self._ctx.breaker
+        attempts = retry.attempts if meth in retry.methods else 1
+        expires = None
+        if retry.deadline is not None:
+            expires = time.monotonic() + retry.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.allow()
+            timeout = retry.timeout
+            if expires is not None:
+                remaining = max(0.001, expires - time.monotonic())
+                timeout = min(timeout or self.transport.timeout, remaining)
+            try:
+                result = self._send_once(url, payload, meth, timeout)
+            except ConnectionRefusedError:
+                breaker.record_failure()
+                raise
+            except (_TransportError, RateLimitError) as ee:
+                # a busy bridge still answers, only silence counts as down
+                if isinstance(ee, _TransportError):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                delay = retry.delay(attempt)
+                if attempt >= attempts or (expires is not None and
+                                           time.monotonic() + delay >=
+                                           expires):
+                    raise
+            except Exception:
+                breaker.record_success()
+                raise
+            else:
+                breaker.record_success()
+                return result
+            breaker.record_retry()
+            self.logger.info("Retrying %s %s in %.3fs", meth, url, delay)
+            time.sleep(delay)
+
+    def _send_once(self, url, payload, meth, timeout=None):
+        instrumented = instrumentation.active
+        if instrumented:
+            instrumentation.before(self.ip, meth, url, payload)
+            start = time.perf_counter()
+        status = error = None
+        try:
+            status, reason, resp_payload = self._exchange(url, payload, meth,
+                                                          timeout)
+            if status >= 400:
+                self.logger.error(reason)
+                if status in (429, 503):
+                    raise RateLimitError(reason)
+                raise RuntimeError(reason)
+            return self.error_check_response(resp_payload)
+        except AttributeError as ae:
+            error = str(ae)
+            raise
+        except Exception as ee:
+            error = type(ee).__name__
+            raise
+        finally:
+            if instrumented:
+                instrumentation.after(self.ip, meth, url, status, error,
+                                      time.perf_counter() - start)
+
+    def _exchange(self, url, payload, meth, timeout=None):
+        """Send one request, returning (status, reason, body bytes)
+
+        The body is only read for successful responses.
+        """
+        self.logger.debug("HTTP %s on %s", meth, url)
         body = None
         if payload:
-            body = json.dumps(payload).encode()
-            self.logger.debug("Body: {}".format(payload))
-        ct = {"Content-type": "application/json"}
+            from phuey import serializer
+            body = serializer.dumps(payload)
+            self.logger.debug("Body: %s", payload)
         try:
-            connection.request(meth, url, body, ct)
-            response = connection.getresponse()
+            status, reason, resp_payload = self.transport.exchange(
+                meth, url, body, _JSON_HEADERS, timeout)
         except ConnectionRefusedError:
             self.logger.critical("Connection refused from bridge!")
             raise ConnectionRefusedError("Ensure IP address is correct")
         except Exception as ee:
             self.logger.error(ee)
-            raise RuntimeError(ee)
+            if isinstance(ee, self.transport.fatal_errors):
+                raise
+            raise _TransportError(ee)
+        self.logger.debug("status: %s", status)
+        self.logger.debug("Bridge response: %s", resp_payload)
+        return status, reason, resp_payload
+
+    def _get_many(self, urls):
+        """GET several URLs, in one round trip if the transport pipelines
+
+        Returns the decoded documents in order.  Pipelined requests pass
+        the circuit breaker once and are not retried; otherwise each URL
+        is fetched with _req.
+        """
+        if not self.transport.pipelining or len(urls) < 2:
+            return [self._req(url) for url in urls]
+        breaker = self._ctx.breaker
+        breaker.allow()
+        instrumented = instrumentation.active
+        if instrumented:
+            for url in urls:
+                instrumentation.before(self.ip, "GET", url, None)
+            start = time.perf_counter()
+        try:
+            results = self.transport.exchange_many(
+                [("GET", url, None) for url in urls], _JSON_HEADERS,
+                self._ctx.retry.timeout)
+        except Exception as ee:
+            fatal = isinstance(ee, self.transport.fatal_errors)
+            if fatal:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if instrumented:
+                for url in urls:
+                    instrumentation.after(self.ip, "GET", url, None,
+                                          type(ee).__name__,
+                                          time.perf_counter() - start)
+            self.logger.error(ee)
+            if fatal or isinstance(ee, ConnectionRefusedError):
+                raise
+            raise _TransportError(ee)
+        breaker.record_success()
+        if instrumented:
+            elapsed = time.perf_counter() - start
+            for url, (status, reason, data) in zip(urls, results):
+                instrumentation.after(self.ip, "GET", url, status, None,
+                                      elapsed)
+        documents = []
+        for status, reason, data in results:
+            if status >= 400:
+                self.logger.error(reason)
+                if status in (429, 503):
+                    raise RateLimitError(reason)
+                raise RuntimeError(reason)
+            documents.append(self.error_check_response(data))
+        return documents
+
+    def refresh(self):
+        """Fetch the object from the bridge and replace the cached snapshot"""
+        snapshot = self._req(self.name_uri)
+        self._seed(snapshot)
+        return snapshot
+
+    def _seed(self, snapshot):
+        """Use data the bridge already returned as the cached snapshot"""
+        self._cache = snapshot
+        self._cache_time = time.monotonic()
+        self._ctx.generation += 1
+
+    def invalidate(self):
+        """Drop the cached snapshot so the next read fetches it again"""
+        self._cache = None
+
+    def _snapshot(self):
+        if self._cache is None:
+            return self.refresh()
+        ttl = self.cache_ttl
+        if ttl is not None and time.monotonic() - self._cache_time >= ttl:
+            return self.refresh()
+        return self._cache
+
+    def _update_cache(self, values, key=None):
+        """Apply values written to the bridge to the cached snapshot"""
+        if self._cache is None:
+            return
+        if key is None:
+            self._cache.update(values)
         else:
-            self.logger.debug(response)
-            self.logger.debug(type(response))
-            self.logger.debug("status: {}".format(response.status))
-            if response.status >= 400:
-                self.logger.error(response.reason)
-                raise RuntimeError(response.reason)
-            self.logger.debug("Bridge header response: {}".format(
-                                                      response.getheaders()))
-            resp_payload = response.read().decode("utf-8")
-            self.logger.debug("Bridge response: {}".format(resp_payload))
-            payload = self.error_check_response(resp_payload)
-            return payload
+            self._cache.setdefault(key, {}).update(values)
+        if key is None or 'reachable' in values:
+            # names, models, members and reachability are indexed
+            self._ctx.generation += 1
+
+    def _put_state(self, values):
+        """PUT values to state_uri, or queue them while a batch is open"""
+        if self._pending is not None:
+            self._pending.update(values)
+            return
+        scheduler = self.scheduler
+        if (scheduler is not None and
+                scheduler.budget(self.state_uri) is not None):
+            # writes merged in the queue go out as one payload, apply all
+            # of it rather than just the values given here
+            scheduler.submit(self._send, self.state_uri, values,
+                             self.priority, self._state_sent)
+            return
+        self._req(self.state_uri, values, "PUT")
+        self._update_cache(values, self.state_key)
+
+    def _state_sent(self, payload):
+        self._update_cache(payload, self.state_key)
+
+    def batch(self):
+        """Context manager merging state assignments into a single PUT
+
+            with light.batch():
+                light.on = True
+                light.bri = 200
+        """
+        return Batch(self)
 
     def error_check_response(self, non_json_payload):
-        payload = json.loads(non_json_payload)
-        if isinstance(payload, list) and 'error' in payload[0]:
-            description = payload[0]['error']['description']
-            self.logger.error(description)
-            self.logger.debug(payload)
-            raise AttributeError(description)
-        else:
-            return payload
+        return error_check_response(non_json_payload, self.logger)
 
     def __str__(self):
         if isinstance(self, Light):
@@ -102,21 +1174,17 @@ class HueObject:
             self.logger.debug(type(self))
             return "name: {} with {} light(s)".format(self.name,
                                                       len(self.lights))
-        elif isinstance(self, Scene):
-            return "Scenes: {}".format(self.all)
         elif isinstance(self, Group):
             return "Group id: {}".format(self.group_id)
-        elif isinstance(self, Sensor):
-            return "Sensor id: {}".format(self.sensor_id)
-        elif isinstance(self, Schedule):
-            return "Sensor id: {}".format(self.Schedule_id)
+        elif isinstance(self, BridgeResource):
+            return "{} id: {}".format(type(self).__name__, self.item_id)
 
     def __repr__(self):
         if isinstance(self, Light):
             return "Light id: {} name: {} currently on: {}".format(
                                self.light_id, str(self.name), self.on)
-        elif isinstance(self, Scene):
-            return "Scenes: {}".format(self.all)
+        elif isinstance(self, BridgeResource):
+            return "{} id: {}".format(type(self).__name__, self.item_id)
         else:
             msg = "HueObject can't coerce the repr method for your object"
             self.logger.error(msg)
@@ -130,37 +1198,33 @@ class HueDescriptor:
         self.__name__ = name
 
     def __get__(self, inst, cls):
-        self.logger.debug("calling get on {} of {} type".format(inst, cls))
-        if isinstance(inst, Light):
-            return inst._req(inst.name_uri)[self.__name__]
-        return inst._req(inst.state_uri)['state'][self.__name__]
+        if inst is None:
+            return self
+        self.logger.debug("calling get on %s of %s type", self.__name__, cls)
+        snapshot = inst._snapshot()
+        if self.__name__ == 'state':
+            return snapshot[inst.state_key]
+        if self.__name__ in snapshot:
+            return snapshot[self.__name__]
+        return snapshot[inst.state_key][self.__name__]
 
     def __set__(self, inst, val):
-        dbg_msg = "calling set on: {} from: {} to: {} ".format(self.__name__,
-                                                               self.name, val)
-        self.logger.debug(dbg_msg)
+        self.logger.debug("calling set on: %s from: %s to: %s", self.__name__,
+                          self.name, val)
         if val is None:
             val = "none"
-        if self.__name__ is 'state':
+        if self.__name__ == 'state':
             self.logger.debug("__name__ is state!")
-            for key, value in val.items():
-                inst.__dict__[key] = value
-            inst._req(inst.state_uri, val, "PUT")
+            inst._put_state(val)
             return
-        if self.__name__ is not 'light_id':
-            if isinstance(inst, Light) and self.__name__ == "name":
-                self.logger.debug("{} {}".format(val, type(val)))
-                inst._req(inst.name_uri, {"name": val}, "PUT")
-
-            elif isinstance(inst, Light) and self.__name__ != "name":
-                if val is not None:
-                    inst._req(inst.state_uri, {self.__name__: val}, "PUT")
-
-            elif isinstance(inst, Group):
-                if val is not None and isinstance(val, dict):
-                    if len(val.keys()) > 1:
-                        inst._req(inst.state_uri, val, "PUT")
-                inst._req(inst.state_uri, {self.__name__: val}, "PUT")
+        if self.__name__ != 'light_id':
+            if self.__name__ in ("name", "lights"):
+                self.logger.debug("%s %s", val, type(val))
+                inst._req(inst.name_uri, {self.__name__: val}, "PUT")
+                inst._update_cache({self.__name__: val})
+
+            elif isinstance(inst, (Light, Group)):
+                inst._put_state({self.__name__: val})
             else:
                 self.logger.debug("How the fuck did I get here?")
                 self.logger.debug("type of {} is {}".format(inst, type(inst)))
@@ -169,16 +1233,122 @@ class HueDescriptor:
 
         else:
             self.logger.debug("{} {} {}".format(self.__name__, self.name, val))
-            return
-        inst.__dict__[self.__name__] = val
-        self.logger.debug(inst.__dict__.keys())
 
     def __str__(self):
         return self.name
 
 
+class ColorDescriptor:
+    """Color set and read in RGB or Kelvin, converted to the bridge's xy/ct
+
+        light.rgb = (255, 120, 0)
+        light.kelvin = 2700
+
+    RGB is clamped to the object's gamut: the one of a light's modelid,
+    or the narrowest of a group's members.  White lights only take the
+    brightness of the color.  Reading gives None when the
+    state has no xy (or ct), as for lights without color.
+    """
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __get__(self, inst, cls):
+        if inst is None:
+            return self
+        from phuey import color
+        state = inst._snapshot()[inst.state_key]
+        if self.__name__ == 'rgb':
+            if 'xy' not in state:
+                return None
+            return color.xy_to_rgb([state['xy']], [state.get('bri', 254)])[0]
+        if 'ct' not in state:
+            return None
+        return int(color.ct_to_kelvin([state['ct']])[0])
+
+    def __set__(self, inst, val):
+        from phuey import color
+        if self.__name__ == 'rgb' and isinstance(inst, Light):
+            modelid = inst._snapshot().get('modelid')
+            inst._put_state(color.rgb_states([modelid], [val])[0])
+        elif self.__name__ == 'rgb':
+            points, brightness = color.rgb_to_xy([val], inst.gamut)
+            (x, y), level = points[0], brightness[0]
+            inst._put_state({"xy": [float(x), float(y)], "bri": int(level)})
+        else:
+            inst._put_state({"ct": int(color.kelvin_to_ct([val])[0])})
+
+
+class Batch:
+    """Collect state assignments on lights and groups and flush them at once
+
+    Every object sends its merged pending state in one PUT when the block
+    exits.  Lights left with identical pending states that together make up
+    one of the given groups are folded into a single group action instead.
+    Folding goes by the groups' downloaded membership, see Group.members,
+    so it never reads from the bridge.  Nothing is sent if the block raises.
+    """
+    def __init__(self, *objects, groups=()):
+        self.logger = logging.getLogger(__name__ + ".Batch")
+        self.objects = objects
+        self.groups = groups
+        self.requests = 0
+        self._opened = []
+
+    def __enter__(self):
+        for obj in self.objects:
+            if obj._pending is None:
+                obj._pending = {}
+                self._opened.append(obj)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pending = []
+        for obj in self._opened:
+            if obj._pending:
+                pending.append((obj, obj._pending))
+            obj._pending = None
+        self._opened = []
+        if exc_type is None:
+            self.flush(pending)
+        return False
+
+    def flush(self, pending):
+        from phuey import planner
+        # light ids are only unique per bridge, fold each bridge's lights
+        # into that bridge's groups alone
+        by_bridge = {}
+        for obj, values in pending:
+            if isinstance(obj, Light):
+                by_bridge.setdefault((obj.ip, obj.user), {})[
+                    str(obj.light_id)] = (obj, values)
+        unfolded = set()
+        for bridge, lights in by_bridge.items():
+            groups = [group for group in self.groups
+                      if (group.ip, group.user) == bridge]
+            steps = planner.plan(dict((light_id, values) for light_id,
+                                      (obj, values) in lights.items()), groups)
+            for group, values, members in steps.group_steps:
+                self.logger.debug("Folding lights %s into group %s",
+                                  members, group.group_id)
+                group._put_state(values)
+                self.requests += 1
+                for member in members:
+                    light = lights[member][0]
+                    light._update_cache(values, light.state_key)
+            unfolded.update(bridge + (light_id,)
+                            for light_id, values in steps.light_steps)
+        for obj, values in pending:
+            if isinstance(obj, Light) and (obj.ip, obj.user,
+                                           str(obj.light_id)) not in unfolded:
+                continue
+            obj._put_state(values)
+            self.requests += 1
+
+
 class Light(HueObject):
     """Any light supported by the Phillips Hue hub"""
+    __slots__ = ('light_id',)
+    logger = logging.getLogger(__name__ + ".Light")
     on = HueDescriptor('on', None)
     xy = HueDescriptor('xy', None)
     ct = HueDescriptor('ct', None)
@@ -191,13 +1361,26 @@ class Light(HueObject):
     transitiontime = HueDescriptor('transitiontime', None)
     name = HueDescriptor('name', None)
     modelid = HueDescriptor('modelid', None)
+    rgb = ColorDescriptor('rgb')
+    kelvin = ColorDescriptor('kelvin')
 
-    def __init__(self, ip, username, light_id):
-        self.logger = logging.getLogger(__name__ + ".Light")
-        super().__init__(ip, username)
+    def __init__(self, ip, username, light_id, context=None):
+        super().__init__(ip, username, context)
         self.light_id = light_id
-        self.name_uri = self.base_uri + "/lights/" + str(self.light_id)
-        self.state_uri = self.name_uri + "/state"
+
+    @property
+    def name_uri(self):
+        return self.base_uri + "/lights/" + str(self.light_id)
+
+    @property
+    def state_uri(self):
+        return self.name_uri + "/state"
+
+    @property
+    def gamut(self):
+        """Color gamut of the light's model, None for white lights"""
+        from phuey import color
+        return color.gamut_for_model(self._snapshot().get('modelid'))
 
     def __gt__(self, other):
         return self.light_id > other.light_id
@@ -206,10 +1389,21 @@ class Light(HueObject):
         return self.light_id < other.light_id
 
     def __eq__(self, other):
-        return not self.light_id < other and not other.light_id < self.light_id
+        # ordering goes by light id alone, identity by bridge and user too
+        if not isinstance(other, Light):
+            return NotImplemented
+        return ((self.ip, self.user, self.light_id) ==
+                (other.ip, other.user, other.light_id))
+
+    def __hash__(self):
+        return hash((self.ip, self.user, self.light_id))
 
 
 class Group(HueObject):
+    __slots__ = ('group_id', '_find_light', '_gamut')
+    logger = logging.getLogger(__name__ + ".Group")
+    state_key = 'action'
+    lights = HueDescriptor('lights', None)
     on = HueDescriptor('on', None)
     xy = HueDescriptor('xy', None)
     ct = HueDescriptor('ct', None)
@@ -220,11 +1414,15 @@ class Group(HueObject):
     alert = HueDescriptor('alert', None)
     effect = HueDescriptor('effect', None)
     transitiontime = HueDescriptor('transitiontime', None)
+    rgb = ColorDescriptor('rgb')
+    kelvin = ColorDescriptor('kelvin')
 
-    def __init__(self, ip, user, group_id=None, attributes=None):
-        super().__init__(ip, user)
-        self.logger = logging.getLogger(__name__ + ".Group")
-        self.create_uri = self.base_uri + "/groups"
+    def __init__(self, ip, user, group_id=None, attributes=None,
+                 context=None):
+        super().__init__(ip, user, context)
+        # set by the Bridge owning the group to look up its cached lights
+        self._find_light = None
+        self._gamut = None
         if group_id is not None:
             self.group_id = str(group_id)
         elif not group_id and attributes:
@@ -233,9 +1431,58 @@ class Group(HueObject):
         else:
             ve_msg = "Need either attributes or group id to create group"
             raise ValueError(ve_msg)
-        self.logger.debug(self.__dict__)
-        self.name_uri = self.create_uri + "/" + self.group_id
-        self.state_uri = self.name_uri + "/action"
+        self.logger.debug("Group id: %s", self.group_id)
+
+    @property
+    def create_uri(self):
+        return self.base_uri + "/groups"
+
+    @property
+    def name_uri(self):
+        return self.create_uri + "/" + self.group_id
+
+    @property
+    def state_uri(self):
+        return self.name_uri + "/action"
+
+    @property
+    def members(self):
+        """Ids of the group's lights as last downloaded, never fetched
+
+        Empty when the group was never loaded; read lights for fresh ones.
+        """
+        if self._cache is None:
+            return ()
+        return tuple(str(m) for m in self._cache.get('lights', ()))
+
+    @property
+    def gamut(self):
+        """Narrowest color gamut of the group's lights
+
+        Groups carry no model.  A Bridge's groups take their members'
+        models from the lights it already holds, standalone groups read
+        the bridge's lights once.  The result is kept while the members
+        stay the same.
+        """
+        from phuey import color
+        if self._cache is None:
+            self.refresh()
+        members = self.members
+        if self._gamut is not None and self._gamut[0] == members:
+            return self._gamut[1]
+        if self._find_light is not None:
+            models = []
+            for member in members:
+                light = self._find_light(member)
+                if light is not None and light._cache is not None:
+                    models.append(light._cache.get('modelid'))
+        else:
+            lights = self._req(self.base_uri + "/lights")
+            models = [lights[m].get('modelid') for m in members
+                      if m in lights]
+        gamut = color.narrowest_gamut(models)
+        self._gamut = (members, gamut)
+        return gamut
 
     def remove(self):
         if self.group_id != "0":
@@ -254,69 +1501,145 @@ class Group(HueObject):
             self.logger.error("Can't delete group 0!")
 
 
-class Scene(HueObject):
-    def __init__(self, ip, user, scene_id=None):
-        super().__init__(ip, user)
-        self.scene_id = scene_id
-        self.logger = logging.getLogger(__name__ + ".Scene")
-        self.create_uri = self.base_uri + "/scenes"
+class BridgeResource(HueObject):
+    """An item of one of the bridge's collections, backed by its config
 
-    def __len__(self):
-        return len(self.__dict__)
+    Subclasses name their collection and the slot holding their id.
+    Items read their attributes from the cached snapshot like lights do,
+    and can be created, updated and removed one at a time or in bulk with
+    Bridge.bulk and Bridge.sync.
+    """
+    __slots__ = ()
+    collection = None
+    id_attr = None
+    name = HueDescriptor('name', None)
 
-    def __getitem__(self, key):
-        return self.__dict__[key]
+    def __init__(self, ip, user, item_id=None, context=None):
+        super().__init__(ip, user, context)
+        setattr(self, self.id_attr, item_id)
 
+    @property
+    def item_id(self):
+        return getattr(self, self.id_attr)
 
-class Rule(HueObject):
-    def __init__(self, ip, user, rule_id=None):
-        super().__init__(ip, user)
-        self.rule_id = rule_id
-        self.logger = logging.getLogger(__name__ + ".Rule")
-        self.create_uri = self.base_uri + "/rules"
+    @property
+    def create_uri(self):
+        return self.base_uri + "/" + self.collection
 
-    def __len__(self):
-        return len(self.__dict__)
+    @property
+    def name_uri(self):
+        return self.create_uri + "/" + str(self.item_id)
 
-    def __getitem__(self, key):
-        return self.__dict__[key]
+    @classmethod
+    def create(cls, ip, user, attributes, context=None):
+        """Create the item on the bridge and return its handle"""
+        item = cls(ip, user, None, context)
+        response = item._req(item.create_uri, attributes, "POST")
+        setattr(item, cls.id_attr, response[0]['success']['id'])
+        item._seed(dict(attributes))
+        return item
 
+    def update(self, attributes):
+        """Change top level attributes and update the cached snapshot"""
+        response = self._req(self.name_uri, attributes, "PUT")
+        self._update_cache(attributes)
+        return response
 
-class Sensor(HueObject):
-    def __init__(self, ip, user, sensor_id=None):
-        super().__init__(ip, user)
-        self.sensor_id = sensor_id
-        self.logger = logging.getLogger(__name__ + ".Sensor")
-        self.create_uri = self.base_uri + "/sensors"
+    def remove(self):
+        response = self._req(self.name_uri, None, "DELETE")
+        self.logger.info("%s", response[0]['success'])
+        self.invalidate()
+        return response
 
     def __len__(self):
-        return len(self.__dict__)
+        return len(self._snapshot())
 
     def __getitem__(self, key):
-        return self.__dict__[key]
+        snapshot = self._snapshot()
+        if key in snapshot:
+            return snapshot[key]
+        return snapshot[self.state_key][key]
 
 
-class Schedule(HueObject):
-    def __init__(self, ip, user, schedule_id=None):
-        super().__init__(ip, user)
-        self.sensor_id = schedule_id
-        self.logger = logging.getLogger(__name__ + ".Schedule")
-        self.create_uri = self.base_uri + "/schedules"
+class Scene(BridgeResource):
+    __slots__ = ('scene_id',)
+    logger = logging.getLogger(__name__ + ".Scene")
+    collection = 'scenes'
+    id_attr = 'scene_id'
+    lights = HueDescriptor('lights', None)
 
-    def __len__(self):
-        return len(self.__dict__)
+    def __init__(self, ip, user, scene_id=None, context=None):
+        super().__init__(ip, user, scene_id, context)
 
-    def __getitem__(self, key):
-        return self.__dict__[key]
+
+class Rule(BridgeResource):
+    __slots__ = ('rule_id',)
+    logger = logging.getLogger(__name__ + ".Rule")
+    collection = 'rules'
+    id_attr = 'rule_id'
+
+    def __init__(self, ip, user, rule_id=None, context=None):
+        super().__init__(ip, user, rule_id, context)
+
+
+class Sensor(BridgeResource):
+    __slots__ = ('sensor_id',)
+    logger = logging.getLogger(__name__ + ".Sensor")
+    collection = 'sensors'
+    id_attr = 'sensor_id'
+    modelid = HueDescriptor('modelid', None)
+
+    def __init__(self, ip, user, sensor_id=None, context=None):
+        super().__init__(ip, user, sensor_id, context)
+
+    @property
+    def state_uri(self):
+        return self.name_uri + "/state"
+
+
+class Schedule(BridgeResource):
+    __slots__ = ('schedule_id',)
+    logger = logging.getLogger(__name__ + ".Schedule")
+    collection = 'schedules'
+    id_attr = 'schedule_id'
+
+    def __init__(self, ip, user, schedule_id=None, context=None):
+        super().__init__(ip, user, schedule_id, context)
 
 
 class Bridge(HueObject):
-    def __init__(self, ip, user=None):
-        super().__init__(ip, user)
-        self.logger = logging.getLogger(__name__ + ".Bridge")
+    logger = logging.getLogger(__name__ + ".Bridge")
+    # collections of the full config, in the order they are built
+    kinds = ('lights', 'scenes', 'groups', 'sensors', 'rules', 'schedules')
+    _resource_classes = {'scenes': Scene, 'sensors': Sensor, 'rules': Rule,
+                         'schedules': Schedule}
+
+    def __init__(self, ip, user=None, pool_size=None, cache_ttl=None,
+                 rate_limit=True, config_cache=None, retry=None,
+                 transport=None):
+        if isinstance(transport, str):
+            from phuey.transport import create_transport
+            transport = create_transport(transport, ip)
+        super().__init__(ip, user, BridgeContext(ip, user, cache_ttl,
+                                                 rate_limit, retry,
+                                                 transport))
+        if pool_size is not None:
+            self.transport.resize(pool_size)
         if user is None:
-            self.user = self._authorize()
-        bridge_dict = self._req(self.base_uri)
+            user = self._authorize()
+            self._ctx = BridgeContext(ip, user, cache_ttl, rate_limit, retry,
+                                      transport)
+        self.config_cache = config_cache
+        self.revalidation = None
+        bridge_dict, age = None, None
+        if config_cache is not None:
+            bridge_dict, age = config_cache.lookup(ip, user)
+        if bridge_dict is None:
+            bridge_dict = self._req(self.base_uri)
+            self._store(bridge_dict)
+        else:
+            self.logger.debug("Starting from a config cached %.1fs ago", age)
+        self._seed(bridge_dict)
         self.name = bridge_dict['config']['name']
         self.lights = [] or self._iter_bridge_items(bridge_dict, 'lights')
         self.scenes = [] or self._iter_bridge_items(bridge_dict, 'scenes')
@@ -325,30 +1648,300 @@ class Bridge(HueObject):
         self.rules = [] or self._iter_bridge_items(bridge_dict, 'rules')
         self.schedules = [] or self._iter_bridge_items(bridge_dict,
                                                        'schedules')
+        self._build_indexes()
+        if age is not None and config_cache.needs_revalidation(age):
+            self.revalidation = threading.Thread(target=self._revalidate,
+                                                 name="phuey-revalidate",
+                                                 daemon=True)
+            self.revalidation.start()
 
     def __len__(self):
         return len(self.lights)
 
+    @property
+    def name_uri(self):
+        return self.base_uri
+
     def _iter_bridge_items(self, bridge_dict, items):
         results = []
         for key, value in bridge_dict[items].items():
-            self.logger.debug("Key: {} Value: {}".format(key, value))
-            if items == 'lights':
-                bridge_item = Light(self.ip, self.user, int(key))
-            elif items == 'groups':
-                bridge_item = Group(self.ip, self.user, int(key))
-            elif items == 'scenes':
-                bridge_item = Scene(self.ip, self.user)
-            elif items == 'rules':
-                bridge_item = Rule(self.ip, self.user, int(key))
-            elif items == 'sensors':
-                bridge_item = Sensor(self.ip, self.user, int(key))
-            elif items == 'schedules':
-                bridge_item = Scene(self.ip, self.user)
-            self.logger.debug("Created: {}".format(bridge_item))
+            self.logger.debug("Key: %s Value: %s", key, value)
+            bridge_item = self._make_item(items, key, value)
+            self.logger.debug("Created: %s", bridge_item)
             results.append(bridge_item)
         return results
 
+    def _make_item(self, items, key, value):
+        ctx = self._ctx
+        if items == 'lights':
+            bridge_item = Light(self.ip, self.user, int(key), ctx)
+        elif items == 'groups':
+            bridge_item = Group(self.ip, self.user, int(key), context=ctx)
+            bridge_item._find_light = self._cached_light
+        else:
+            bridge_item = self._resource_classes[items](self.ip, self.user,
+                                                        str(key), ctx)
+        bridge_item._seed(value)
+        return bridge_item
+
+    @staticmethod
+    def _item_id(bridge_item):
+        if isinstance(bridge_item, BridgeResource):
+            return str(bridge_item.item_id)
+        for attr in ('light_id', 'group_id'):
+            if hasattr(bridge_item, attr):
+                return str(getattr(bridge_item, attr))
+
+    def refresh(self):
+        """Download the full config again and update every child in place"""
+        bridge_dict = super().refresh()
+        self._reconcile(bridge_dict, self.kinds)
+        self._store(bridge_dict)
+        return bridge_dict
+
+    def _store(self, bridge_dict):
+        if self.config_cache is None:
+            return
+        try:
+            self.config_cache.store(self.ip, self.user, bridge_dict)
+        except OSError as oe:
+            self.logger.warning("Could not save the bridge config: %s", oe)
+
+    def _revalidate(self):
+        """Replace a config served from the cache with the live one"""
+        try:
+            self.refresh()
+        except (RuntimeError, AttributeError, OSError) as ee:
+            self.logger.warning("Revalidating the cached config failed: %s",
+                                ee)
+
+    def _reconcile(self, bridge_dict, kinds=('lights', 'groups', 'sensors')):
+        """Reseed children from bridge_dict, returning the list of Changes
+
+        Existing objects are kept and given their new snapshot, items the
+        bridge no longer reports are dropped and new ones are created.
+        """
+        self.name = bridge_dict['config']['name']
+        changes = []
+        for kind in kinds:
+            current = getattr(self, kind)
+            by_id = dict((self._item_id(item), item) for item in current)
+            new_items = bridge_dict.get(kind, {})
+            for key, value in new_items.items():
+                item = by_id.get(key)
+                if item is None:
+                    item = self._make_item(kind, key, value)
+                    current.append(item)
+                    changes.append(Change(kind, key, None, None, value, item))
+                    continue
+                if item._cache is not None and item._cache != value:
+                    changes.extend(_diff_item(kind, key, item, item._cache,
+                                              value))
+                item._seed(value)
+            for key, item in by_id.items():
+                if key not in new_items:
+                    current[:] = [i for i in current if i is not item]
+                    changes.append(Change(kind, key, None, item._cache, None,
+                                          item))
+        self._build_indexes()
+        return changes
+
+    def bulk(self, kind, operations):
+        """Apply many create, update and delete operations to a collection
+
+        operations holds ("create", None, attributes), ("update", id,
+        attributes) and ("delete", id, None) tuples.  They are sent one
+        after the other over the bridge's kept-alive connection, and a
+        failed one does not stop the rest: the BulkResult of each tells
+        what happened, with the new id as item_id for creations.  The
+        bridge's item lists and snapshots follow every operation that
+        succeeded.
+        """
+        if kind not in self.kinds:
+            raise ValueError("Unknown kind: {}".format(kind))
+        items = getattr(self, kind)
+        by_id = dict((self._item_id(item), item) for item in items)
+        results = []
+        for op, item_id, attributes in operations:
+            try:
+                if op == "create":
+                    response = self._req(self.base_uri + "/" + kind,
+                                         attributes, "POST")
+                    item_id = str(response[0]['success']['id'])
+                    item = self._make_item(kind, item_id, dict(attributes))
+                    items.append(item)
+                    by_id[item_id] = item
+                elif op == "update":
+                    item = by_id[str(item_id)]
+                    response = item._req(item.name_uri, attributes, "PUT")
+                    item._update_cache(attributes)
+                elif op == "delete":
+                    item = by_id[str(item_id)]
+                    response = item._req(item.name_uri, None, "DELETE")
+                    del by_id[str(item_id)]
+                    items[:] = [i for i in items if i is not item]
+                else:
+                    raise ValueError("Unknown operation: {}".format(op))
+            except (AttributeError, RuntimeError, KeyError,
+                    ValueError) as ee:
+                self.logger.error("Bulk %s of %s %s failed: %s", op, kind,
+                                  item_id, ee)
+                results.append(BulkResult(op, item_id, False, None, ee))
+            else:
+                results.append(BulkResult(op, item_id, True, response, None))
+        self._build_indexes()
+        return results
+
+    def sync(self, kind, desired, key='name', prune=False):
+        """Make a collection match desired, sending only what differs
+
+        desired is a list of attribute dicts, matched to existing items by
+        their key attribute.  Missing items are created, items whose
+        attributes differ are updated with just the differing ones and,
+        with prune, items that are not desired are deleted.  Items are
+        compared with the config last downloaded.  Returns the BulkResults
+        of the operations sent.
+        """
+        current = {}
+        for item in getattr(self, kind):
+            data = item._cache or {}
+            if key in data:
+                current.setdefault(data[key], item)
+        operations = []
+        wanted = set()
+        for attributes in desired:
+            wanted.add(attributes[key])
+            item = current.get(attributes[key])
+            if item is None:
+                operations.append(("create", None, attributes))
+                continue
+            data = item._cache or {}
+            changed = dict((field, value) for field, value in
+                           attributes.items() if data.get(field) != value)
+            if changed:
+                operations.append(("update", self._item_id(item), changed))
+        if prune:
+            operations.extend(("delete", self._item_id(item), None)
+                              for name, item in current.items()
+                              if name not in wanted)
+        return self.bulk(kind, operations)
+
+    def _build_indexes(self):
+        """Index lights, groups and sensors by the config already cached
+
+        Rebuilt whenever the bridge config is reconciled, and by find once
+        a child's snapshot changed, so lookups never ask the bridge.
+        Filters hold id() of the items they select.
+        """
+        generation = self._ctx.generation
+        by_id, by_name, by_model, by_group = {}, {}, {}, {}
+        reachable = {'lights': set(), 'sensors': set()}
+        for kind in ('lights', 'groups', 'sensors'):
+            for item in getattr(self, kind):
+                data = item._cache or {}
+                by_id[(kind, self._item_id(item))] = item
+                if 'name' in data:
+                    by_name.setdefault((kind, data['name']), []).append(item)
+                if 'modelid' in data:
+                    by_model.setdefault((kind, data['modelid']),
+                                        []).append(item)
+                if kind in reachable:
+                    block = data.get('state' if kind == 'lights' else
+                                     'config', {})
+                    if block.get('reachable', True):
+                        reachable[kind].add(id(item))
+        by_room = {}
+        for group in self.groups:
+            data = group._cache or {}
+            members = set(id(by_id[('lights', str(light_id))]) for light_id
+                          in data.get('lights', [])
+                          if ('lights', str(light_id)) in by_id)
+            by_group[group.group_id] = members
+            if 'name' in data:
+                by_room.setdefault(data['name'], set()).update(members)
+        self._by_id = by_id
+        self._by_name = by_name
+        self._by_model = by_model
+        self._by_room = by_room
+        self._by_group = by_group
+        self._reachable = reachable
+        self._indexed = generation
+
+    def light(self, light_id):
+        return self._by_id[('lights', str(light_id))]
+
+    def _cached_light(self, light_id):
+        return self._by_id.get(('lights', str(light_id)))
+
+    def group(self, group_id):
+        return self._by_id[('groups', str(group_id))]
+
+    def sensor(self, sensor_id):
+        return self._by_id[('sensors', str(sensor_id))]
+
+    def find(self, kind='lights', name=None, model=None, room=None,
+             group=None, reachable=None):
+        """Return the items of kind matching every criterion given
+
+        name and model match exactly, room is the name of a group (a room,
+        zone or any other) and group its id; both only select lights.
+        reachable selects lights or sensors the bridge can or cannot reach.
+
+            bridge.find(model="LCT007", room="Kitchen", reachable=True)
+        """
+        if kind not in ('lights', 'groups', 'sensors'):
+            raise ValueError("Unknown kind: {}".format(kind))
+        if (room is not None or group is not None) and kind != 'lights':
+            raise ValueError("room and group only select lights")
+        if reachable is not None and kind == 'groups':
+            raise ValueError("Groups have no reachability")
+        if self._indexed != self._ctx.generation:
+            self._build_indexes()
+        lists = []
+        if name is not None:
+            lists.append(self._by_name.get((kind, name), []))
+        if model is not None:
+            lists.append(self._by_model.get((kind, model), []))
+        candidates = min(lists, key=len) if lists else getattr(self, kind)
+        keep, drop = [], []
+        for selected in lists:
+            if selected is not candidates:
+                keep.append(set(id(item) for item in selected))
+        if room is not None:
+            keep.append(self._by_room.get(room, set()))
+        if group is not None:
+            keep.append(self._by_group.get(str(group), set()))
+        if reachable is True:
+            keep.append(self._reachable[kind])
+        elif reachable is False:
+            drop.append(self._reachable[kind])
+        return [item for item in candidates
+                if all(id(item) in ids for ids in keep) and
+                not any(id(item) in ids for ids in drop)]
+
+    def watch(self, interval=1.0, max_interval=None, backoff=1.5,
+              kinds=('lights', 'groups', 'sensors')):
+        """Poll the bridge forever, yielding a Change per changed field
+
+        Each cycle costs a single GET of the full config.  The wait between
+        polls grows by backoff while nothing changes, up to max_interval
+        (default ten times interval), and drops back to interval as soon
+        as something does.  Items are updated in place, never rebuilt.
+        """
+        if max_interval is None:
+            max_interval = interval * 10
+        delay = interval
+        while True:
+            time.sleep(delay)
+            bridge_dict = HueObject.refresh(self)
+            changes = self._reconcile(bridge_dict, kinds)
+            if changes:
+                delay = interval
+            else:
+                delay = min(delay * backoff, max_interval)
+            for change in changes:
+                yield change
+
 #     def find_new_lights(self, dev_id=None):
 #         add_light_url = self.base_uri + "/lights"
 #         if isinstance(dev_id, list):
@@ -369,7 +1962,7 @@ class Bridge(HueObject):
     def _authorize(self):
         auth_payload = {'devicetype': self.device_type}
         token = self._req(self.create_user_url, auth_payload, "POST")[0]
-        self.user = token['success']['username']
+        return token['success']['username']
 
 if __name__ == "__main__":
     bridge_ip, user, log_level = get_args()
@@ -0,0 +1,276 @@
+"""asyncio client for the Philips Hue bridge
+
+AsyncBridge, AsyncLight and AsyncGroup mirror Bridge, Light and Group but
+every request is a coroutine, so many state changes and reads can be
+awaited together with asyncio.gather.  Each AsyncBridge caps the number of
+requests in flight to its hub with a semaphore.
+
+    async def main():
+        async with AsyncBridge(ip, user) as bridge:
+            await asyncio.gather(*(l.set(on=True, bri=200)
+                                   for l in bridge.lights))
+
+The transport is pluggable: any object with a coroutine
+request(meth, url, body) returning (status, reason, body_bytes) and a
+coroutine close() will do.  StreamTransport, built on asyncio streams, is
+used by default.
+"""
+import asyncio
+import logging
+import time
+
+from phuey import (DEFAULT_CACHE_TTL, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT,
+                   RateLimitError, error_check_response, serializer)
+
+DEFAULT_CONCURRENCY = 8
+
+logger = logging.getLogger(__name__)
+
+
+class StreamTransport:
+    """Minimal HTTP/1.1 keep-alive client on top of asyncio streams"""
+    def __init__(self, ip, port=80, timeout=DEFAULT_TIMEOUT,
+                 maxsize=DEFAULT_POOL_SIZE):
+        self.logger = logging.getLogger(__name__ + ".StreamTransport")
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = []
+
+    async def request(self, meth, url, body=None):
+        while True:
+            reused = bool(self._idle)
+            if reused:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.ip, self.port),
+                    self.timeout)
+            try:
+                status, reason, data, keep_alive = await asyncio.wait_for(
+                    self._roundtrip(reader, writer, meth, url, body),
+                    self.timeout)
+            except (ConnectionResetError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+                self.logger.debug("Stale connection to %s, reconnecting",
+                                  self.ip)
+                continue
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive and len(self._idle) < self.maxsize:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, reason, data
+
+    async def _roundtrip(self, reader, writer, meth, url, body):
+        body = body or b""
+        head = ("{} {} HTTP/1.1\r\nHost: {}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n\r\n").format(meth, url, self.ip,
+                                                     len(body))
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Bridge closed the connection")
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        version, status = parts[0], int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (version != "HTTP/1.0" or
+                                                connection == "keep-alive")
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n",
+                                                            b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return status, reason, data, keep_alive
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+
+
+class AsyncBridge:
+    def __init__(self, ip, user, transport=None,
+                 concurrency=DEFAULT_CONCURRENCY, cache_ttl=None):
+        self.logger = logging.getLogger(__name__ + ".AsyncBridge")
+        self.ip = ip
+        self.user = user
+        self.base_uri = "/api/" + user
+        self.transport = transport or StreamTransport(ip)
+        self.cache_ttl = DEFAULT_CACHE_TTL if cache_ttl is None else cache_ttl
+        self.name = None
+        self.lights = []
+        self.groups = []
+        self.concurrency = concurrency
+        # made on the first request, inside the running loop: before
+        # Python 3.10 a semaphore binds to the loop current at creation
+        self._semaphore = None
+
+    def __len__(self):
+        return len(self.lights)
+
+    def __str__(self):
+        return "name: {} with {} light(s)".format(self.name, len(self.lights))
+
+    async def __aenter__(self):
+        return await self.load()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def load(self):
+        """Download the full config and build the seeded lights and groups"""
+        bridge_dict = await self._req(self.base_uri)
+        self.name = bridge_dict['config']['name']
+        self.lights = [AsyncLight(self, int(key), value) for key, value in
+                       bridge_dict['lights'].items()]
+        self.groups = [AsyncGroup(self, int(key), value) for key, value in
+                       bridge_dict['groups'].items()]
+        return self
+
+    async def close(self):
+        await self.transport.close()
+
+    def light(self, light_id):
+        return AsyncLight(self, light_id)
+
+    def group(self, group_id):
+        return AsyncGroup(self, group_id)
+
+    async def set_many(self, targets, return_exceptions=False):
+        """Apply {object: state} concurrently, one PUT per object"""
+        return await asyncio.gather(*(obj.set(**values) for obj, values in
+                                      targets.items()),
+                                    return_exceptions=return_exceptions)
+
+    async def _req(self, url, payload=None, meth="GET"):
+        self.logger.debug("HTTP %s on %s", meth, url)
+        body = None
+        if payload:
+            body = serializer.dumps(payload)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                status, reason, data = await self.transport.request(meth, url,
+                                                                    body)
+            except ConnectionRefusedError:
+                self.logger.critical("Connection refused from bridge!")
+                raise ConnectionRefusedError("Ensure IP address is correct")
+            except Exception as ee:
+                self.logger.error(ee)
+                raise RuntimeError(ee)
+        if status >= 400:
+            self.logger.error(reason)
+            if status in (429, 503):
+                raise RateLimitError(reason)
+            raise RuntimeError(reason)
+        return error_check_response(data, self.logger)
+
+
+class AsyncHueObject:
+    state_key = 'state'
+    collection = None
+
+    def __init__(self, bridge, item_id, snapshot=None):
+        self.bridge = bridge
+        self.cache_ttl = bridge.cache_ttl
+        self.name_uri = "{}/{}/{}".format(bridge.base_uri, self.collection,
+                                          item_id)
+        self._cache = None
+        self._cache_time = 0
+        if snapshot is not None:
+            self._seed(snapshot)
+
+    def _seed(self, snapshot):
+        self._cache = snapshot
+        self._cache_time = time.monotonic()
+
+    async def refresh(self):
+        snapshot = await self.bridge._req(self.name_uri)
+        self._seed(snapshot)
+        return snapshot
+
+    def invalidate(self):
+        self._cache = None
+
+    async def snapshot(self):
+        ttl = self.cache_ttl
+        if self._cache is None or (ttl is not None and
+                                   time.monotonic() - self._cache_time >= ttl):
+            return await self.refresh()
+        return self._cache
+
+    async def get(self, attribute):
+        snapshot = await self.snapshot()
+        if attribute == 'state':
+            return snapshot[self.state_key]
+        if attribute in snapshot:
+            return snapshot[attribute]
+        return snapshot[self.state_key][attribute]
+
+    async def set(self, **values):
+        """Write attributes, state ones merged into a single PUT"""
+        attributes = dict((key, values.pop(key)) for key in ('name', 'lights')
+                          if key in values)
+        if attributes:
+            await self.bridge._req(self.name_uri, attributes, "PUT")
+            if self._cache is not None:
+                self._cache.update(attributes)
+        if values:
+            await self.bridge._req(self.state_uri, values, "PUT")
+            if self._cache is not None:
+                self._cache.setdefault(self.state_key, {}).update(values)
+
+
+class AsyncLight(AsyncHueObject):
+    collection = 'lights'
+
+    def __init__(self, bridge, light_id, snapshot=None):
+        self.light_id = light_id
+        super().__init__(bridge, light_id, snapshot)
+        self.state_uri = self.name_uri + "/state"
+
+    def __str__(self):
+        return "Light id: {}".format(self.light_id)
+
+
+class AsyncGroup(AsyncHueObject):
+    state_key = 'action'
+    collection = 'groups'
+
+    def __init__(self, bridge, group_id, snapshot=None):
+        self.group_id = str(group_id)
+        super().__init__(bridge, self.group_id, snapshot)
+        self.state_uri = self.name_uri + "/action"
+
+    def __str__(self):
+        return "Group id: {}".format(self.group_id)
@@ -0,0 +1,135 @@
+"""On-disk cache of full bridge configs for fast startup
+
+A Bridge given a ConfigCache builds its lights, groups and sensors from
+the last config saved for its ip and user instead of waiting for the
+bridge, then fetches the live config in a background thread and
+reconciles the objects in place (stale-while-revalidate):
+
+    bridge = Bridge(ip, user, config_cache=ConfigCache())
+    bridge.revalidation.join()  # only when up to date data is required
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+# seconds a saved config is served without checking the bridge at all
+DEFAULT_MAX_AGE = 0
+# seconds after which a saved config is too old to serve even while
+# revalidating
+DEFAULT_MAX_STALE = 24 * 60 * 60
+
+# config fields that change on every request without anything happening
+_VOLATILE_CONFIG = ("UTC", "localtime", "whitelist")
+
+logger = logging.getLogger(__name__)
+
+
+def default_directory():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "phuey")
+
+
+def fingerprint(bridge_dict):
+    """Digest of a config that ignores the bridge's clock and whitelist
+
+    Two configs with the same fingerprint describe the same devices and
+    states, so a revalidated config matching the saved one needs no write.
+    """
+    config = dict((key, value) for key, value in
+                  bridge_dict.get("config", {}).items()
+                  if key not in _VOLATILE_CONFIG)
+    stable = dict(bridge_dict, config=config)
+    encoded = json.dumps(stable, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class ConfigCache:
+    """Bridge configs saved as one JSON file per bridge ip and user
+
+    A config younger than max_age seconds is served as is; one younger than
+    max_stale is served and revalidated in the background; anything older
+    is ignored and the bridge is asked directly.  Files are written
+    atomically and readable by the owner only, as configs hold usernames.
+    """
+    def __init__(self, directory=None, max_age=DEFAULT_MAX_AGE,
+                 max_stale=DEFAULT_MAX_STALE, clock=time.time):
+        self.logger = logging.getLogger(__name__ + ".ConfigCache")
+        self.directory = directory or default_directory()
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.clock = clock
+
+    def path(self, ip, user):
+        key = hashlib.sha1("{}/{}".format(ip, user).encode("utf-8"))
+        return os.path.join(self.directory, key.hexdigest() + ".json")
+
+    def _read(self, ip, user):
+        try:
+            with open(self.path(ip, user)) as cached:
+                entry = json.load(cached)
+                saved = os.fstat(cached.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as ee:
+            self.logger.warning("Ignoring unreadable config cache: %s", ee)
+            return None
+        if entry.get("ip") != ip or entry.get("user") != user:
+            return None
+        entry["saved"] = saved
+        return entry
+
+    def lookup(self, ip, user):
+        """Return (config, age in seconds), or (None, None) if unusable"""
+        entry = self._read(ip, user)
+        if entry is None:
+            return None, None
+        age = max(0.0, self.clock() - entry["saved"])
+        if self.max_stale is not None and age > self.max_stale:
+            self.logger.debug("Cached config of %s is %.0fs old", ip, age)
+            return None, None
+        return entry["config"], age
+
+    def needs_revalidation(self, age):
+        return age >= self.max_age
+
+    def store(self, ip, user, bridge_dict):
+        """Save bridge_dict, skipping the write when nothing changed
+
+        Returns True when the file was rewritten; otherwise only its
+        modification time, the saved config's age, is bumped.
+        """
+        digest = fingerprint(bridge_dict)
+        entry = self._read(ip, user)
+        now = self.clock()
+        if entry is None or entry.get("fingerprint") != digest:
+            self._write(ip, user, {"ip": ip, "user": user,
+                                   "fingerprint": digest,
+                                   "config": bridge_dict})
+            written = True
+        else:
+            written = False
+        # the file's mtime records when the config was last confirmed
+        os.utime(self.path(ip, user), (now, now))
+        return written
+
+    def _write(self, ip, user, entry):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                             suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w") as output:
+                json.dump(entry, output)
+            os.replace(temporary, self.path(ip, user))
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def clear(self, ip, user):
+        try:
+            os.unlink(self.path(ip, user))
+        except FileNotFoundError:
+            pass
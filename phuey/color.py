@@ -0,0 +1,277 @@
+"""Color space conversions for Hue lights
+
+Converts whole arrays of RGB, HSV and Kelvin colors to the bridge's xy,
+ct and hue/sat values at once, with NumPy when it is installed and plain
+Python otherwise, and clamps xy into the gamut of each light model:
+
+    xy, bri = rgb_to_xy([(255, 0, 0), (0, 0, 255)], gamut_for_model("LCT001"))
+
+RGB components are 0-255, xy follows CIE 1931 and bri is the bridge's
+0-254 brightness.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# red, green and blue corners of the gamuts Hue lights support
+GAMUT_A = ((0.704, 0.296), (0.2151, 0.7106), (0.138, 0.08))
+GAMUT_B = ((0.675, 0.322), (0.409, 0.518), (0.167, 0.04))
+GAMUT_C = ((0.692, 0.308), (0.17, 0.7), (0.153, 0.048))
+
+MODEL_GAMUTS = {}
+for _gamut, _models in ((GAMUT_A, ("LST001", "LLC005", "LLC006", "LLC007",
+                                   "LLC010", "LLC011", "LLC012", "LLC013",
+                                   "LLC014")),
+                        (GAMUT_B, ("LCT001", "LCT002", "LCT003", "LCT007",
+                                   "LLM001")),
+                        (GAMUT_C, ("LCT010", "LCT011", "LCT012", "LCT014",
+                                   "LCT015", "LCT016", "LLC020", "LST002"))):
+    for _model in _models:
+        MODEL_GAMUTS[_model] = _gamut
+
+# dimmable and white ambiance models, which take no xy
+WHITE_MODELS = frozenset(("LWB004", "LWB006", "LWB007", "LWB010", "LWB014",
+                          "LWL001", "LTW001", "LTW004", "LTW010", "LTW011",
+                          "LTW012", "LTW013", "LTW014", "LTW015"))
+
+# CIE xy of the D65 white point, returned for black
+WHITE_POINT = (0.3227, 0.329)
+
+# color temperature range of Hue white ambiance lights, in mired
+MIN_CT = 153
+MAX_CT = 500
+
+# wide gamut RGB D65 to XYZ, as recommended for Hue lights
+_RGB_TO_XYZ = ((0.664511, 0.154324, 0.162028),
+               (0.283881, 0.668433, 0.047685),
+               (0.000088, 0.072310, 0.986039))
+_XYZ_TO_RGB = ((1.656492, -0.354851, -0.255038),
+               (-0.707196, 1.655397, 0.036152),
+               (0.051713, -0.121364, 1.011530))
+
+
+def gamut_for_model(modelid):
+    """Gamut triangle of a light model, None for unknown or white lights"""
+    return MODEL_GAMUTS.get(modelid)
+
+
+def has_color(modelid):
+    """False for models known to only show white, True otherwise"""
+    return modelid not in WHITE_MODELS
+
+
+def _area(gamut):
+    red, green, blue = gamut
+    return abs(_cross(red, green, blue)) / 2
+
+
+def narrowest_gamut(modelids):
+    """Smallest gamut of the given models, None when none has one
+
+    Colors clamped to it are within reach of every member of a group
+    with lights of these models, or very close to it.
+    """
+    gamuts = set(gamut_for_model(modelid) for modelid in modelids)
+    gamuts.discard(None)
+    if not gamuts:
+        return None
+    return min(gamuts, key=_area)
+
+
+def _gamma(c):
+    return ((c + 0.055) / 1.055) ** 2.4 if c > 0.04045 else c / 12.92
+
+
+def _inverse_gamma(c):
+    return 1.055 * c ** (1 / 2.4) - 0.055 if c > 0.0031308 else 12.92 * c
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _closest_on_segment(p, a, b):
+    ax, ay = b[0] - a[0], b[1] - a[1]
+    t = ((p[0] - a[0]) * ax + (p[1] - a[1]) * ay) / (ax * ax + ay * ay)
+    t = min(1.0, max(0.0, t))
+    return a[0] + t * ax, a[1] + t * ay
+
+
+def clamp_xy(point, gamut):
+    """Move one xy point to the closest point inside the gamut triangle"""
+    if gamut is None:
+        return point
+    red, green, blue = gamut
+    d1 = _cross(red, green, point)
+    d2 = _cross(green, blue, point)
+    d3 = _cross(blue, red, point)
+    negative = d1 < 0 or d2 < 0 or d3 < 0
+    positive = d1 > 0 or d2 > 0 or d3 > 0
+    if not (negative and positive):
+        return point
+    candidates = [_closest_on_segment(point, a, b) for a, b in
+                  ((red, green), (green, blue), (blue, red))]
+    return min(candidates, key=lambda c: (c[0] - point[0]) ** 2 +
+               (c[1] - point[1]) ** 2)
+
+
+def _clamp_array(xy, gamut):
+    """Vectorized clamp_xy over an (n, 2) NumPy array"""
+    corners = numpy.array(gamut, dtype=float)
+    edges = [(corners[i], corners[(i + 1) % 3]) for i in range(3)]
+    crosses = numpy.stack([(b[0] - a[0]) * (xy[:, 1] - a[1]) -
+                           (b[1] - a[1]) * (xy[:, 0] - a[0])
+                           for a, b in edges], axis=1)
+    outside = (crosses < 0).any(axis=1) & (crosses > 0).any(axis=1)
+    if not outside.any():
+        return xy
+    points = xy[outside]
+    best, best_distance = None, None
+    for a, b in edges:
+        direction = b - a
+        t = ((points - a) @ direction) / (direction @ direction)
+        closest = a + numpy.clip(t, 0, 1)[:, None] * direction
+        distance = ((closest - points) ** 2).sum(axis=1)
+        if best is None:
+            best, best_distance = closest, distance
+        else:
+            nearer = distance < best_distance
+            best[nearer] = closest[nearer]
+            best_distance = numpy.minimum(best_distance, distance)
+    result = xy.copy()
+    result[outside] = best
+    return result
+
+
+def rgb_to_xy(colors, gamut=None):
+    """Convert (r, g, b) colors to xy and bri
+
+    Returns a pair: the xy points and the brightness of every color, as
+    NumPy arrays or lists of tuples and ints.  Points outside gamut are
+    moved onto its edge.
+    """
+    if numpy is not None:
+        rgb = numpy.asarray(colors, dtype=float).reshape(-1, 3) / 255.0
+        linear = numpy.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4,
+                             rgb / 12.92)
+        xyz = linear @ numpy.array(_RGB_TO_XYZ).T
+        total = xyz.sum(axis=1)
+        black = total == 0
+        safe = numpy.where(black, 1, total)
+        xy = numpy.stack([xyz[:, 0] / safe, xyz[:, 1] / safe], axis=1)
+        xy[black] = WHITE_POINT
+        if gamut is not None:
+            xy = _clamp_array(xy, gamut)
+        bri = numpy.rint(numpy.clip(xyz[:, 1], 0, 1) * 254).astype(int)
+        return numpy.round(xy, 4), bri
+    points, brightness = [], []
+    for r, g, b in colors:
+        linear = [_gamma(c / 255.0) for c in (r, g, b)]
+        x, y, z = (sum(m * c for m, c in zip(row, linear))
+                   for row in _RGB_TO_XYZ)
+        total = x + y + z
+        point = WHITE_POINT if total == 0 else (x / total, y / total)
+        point = clamp_xy(point, gamut)
+        points.append((round(point[0], 4), round(point[1], 4)))
+        brightness.append(int(round(min(1.0, max(0.0, y)) * 254)))
+    return points, brightness
+
+
+def xy_to_rgb(points, bri=254):
+    """Convert xy points (and a brightness or list of them) back to RGB
+
+    Returns a list of (r, g, b) tuples of ints.
+    """
+    if numpy is not None:
+        xy = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        level = numpy.broadcast_to(numpy.asarray(bri, dtype=float),
+                                   (len(xy),)) / 254.0
+        x, y = xy[:, 0], xy[:, 1]
+        black = y == 0
+        scale = level / numpy.where(black, 1, y)
+        xyz = numpy.stack([scale * x, level, scale * (1 - x - y)], axis=1)
+        rgb = xyz @ numpy.array(_XYZ_TO_RGB).T
+        peak = rgb.max(axis=1, initial=0)
+        rgb = rgb / numpy.where(peak > 1, peak, 1)[:, None]
+        rgb = numpy.maximum(rgb, 0)
+        rgb = numpy.where(rgb > 0.0031308, 1.055 * rgb ** (1 / 2.4) - 0.055,
+                          12.92 * rgb)
+        colors = numpy.rint(numpy.maximum(rgb, 0) * 255).astype(int)
+        colors[black] = 0
+        return [tuple(color) for color in colors.tolist()]
+    if isinstance(bri, (int, float)):
+        bri = [bri] * len(points)
+    colors = []
+    for (x, y), level in zip(points, bri):
+        if y == 0:
+            colors.append((0, 0, 0))
+            continue
+        big_y = level / 254.0
+        big_x = big_y / y * x
+        big_z = big_y / y * (1 - x - y)
+        rgb = [sum(m * c for m, c in zip(row, (big_x, big_y, big_z)))
+               for row in _XYZ_TO_RGB]
+        peak = max(rgb)
+        if peak > 1:
+            rgb = [c / peak for c in rgb]
+        colors.append(tuple(int(round(max(0.0, _inverse_gamma(max(0.0, c))) *
+                                      255)) for c in rgb))
+    return colors
+
+
+def kelvin_to_ct(kelvins):
+    """Convert color temperatures in Kelvin to mired, within the Hue range"""
+    if numpy is not None:
+        mired = numpy.rint(1e6 / numpy.asarray(kelvins, dtype=float))
+        return numpy.clip(mired, MIN_CT, MAX_CT).astype(int)
+    return [min(MAX_CT, max(MIN_CT, int(round(1e6 / k)))) for k in kelvins]
+
+
+def ct_to_kelvin(cts):
+    """Convert color temperatures in mired to Kelvin"""
+    if numpy is not None:
+        return numpy.rint(1e6 / numpy.asarray(cts, dtype=float)).astype(int)
+    return [int(round(1e6 / ct)) for ct in cts]
+
+
+def hsv_to_hue_sat(colors):
+    """Convert (h, s, v) colors, h in degrees and s, v in 0-1, to states
+
+    Returns a list of {"hue", "sat", "bri"} dicts ready to send.
+    """
+    if numpy is not None:
+        hsv = numpy.asarray(colors, dtype=float).reshape(-1, 3)
+        hue = numpy.rint((hsv[:, 0] % 360) / 360.0 * 65535).astype(int)
+        sat = numpy.rint(numpy.clip(hsv[:, 1], 0, 1) * 254).astype(int)
+        bri = numpy.rint(numpy.clip(hsv[:, 2], 0, 1) * 254).astype(int)
+        return [{"hue": h, "sat": s, "bri": b} for h, s, b in
+                zip(hue.tolist(), sat.tolist(), bri.tolist())]
+    return [{"hue": int(round((h % 360) / 360.0 * 65535)),
+             "sat": int(round(min(1.0, max(0.0, s)) * 254)),
+             "bri": int(round(min(1.0, max(0.0, v)) * 254))}
+            for h, s, v in colors]
+
+
+def rgb_states(modelids, colors):
+    """State dicts setting each light to its color, clamped per model
+
+    modelids and colors are parallel sequences; lights of the same gamut
+    are converted together in one vectorized call.  White lights only get
+    the color's brightness, the bridge rejects xy for them.
+    """
+    modelids, colors = list(modelids), list(colors)
+    states = [None] * len(colors)
+    by_gamut = {}
+    for index, modelid in enumerate(modelids):
+        by_gamut.setdefault(gamut_for_model(modelid), []).append(index)
+    for gamut, indexes in by_gamut.items():
+        points, brightness = rgb_to_xy([colors[i] for i in indexes], gamut)
+        if numpy is not None:
+            points, brightness = points.tolist(), brightness.tolist()
+        for i, point, level in zip(indexes, points, brightness):
+            if has_color(modelids[i]):
+                states[i] = {"xy": [point[0], point[1]], "bri": level}
+            else:
+                states[i] = {"bri": level}
+    return states
@@ -0,0 +1,290 @@
+"""A local daemon sharing one bridge session between many processes
+
+The daemon owns the Bridge, its connection pool, write scheduler and state
+cache; scripts, hooks and cron jobs talk to it over a Unix socket instead
+of each opening their own session, so every write goes through one rate
+limiter and reads are answered from one cache:
+
+    phuey-daemon -b 192.168.1.2 -u USER --socket /run/user/1000/phuey.sock
+
+    with DaemonClient(path) as client:
+        client.set("light", 1, on=True, bri=200)
+        client.get("light", 1, "bri")
+
+The protocol is one JSON object per line each way.  A request names an op
+(get, set, list, refresh or stats) and, where it applies, a kind (light
+or group), an id, a field and a state; the reply is {"ok": true,
+"result": ...} or {"ok": false, "error": "..."}.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+
+from phuey import ColorDescriptor, HueDescriptor
+
+# cached state younger than this answers reads without asking the bridge
+DEFAULT_DAEMON_CACHE_TTL = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+def default_socket_path():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "phuey.sock")
+    return "/tmp/phuey-{}.sock".format(os.getuid())
+
+
+class _Handler(StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = self.server.daemon.handle_line(line)
+            try:
+                data = json.dumps(reply)
+            except (TypeError, ValueError) as ee:
+                data = json.dumps({"ok": False, "error": str(ee)})
+            self.wfile.write(data.encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class CommandDaemon:
+    """Serve Light and Group operations of one Bridge over a Unix socket
+
+    Writes from every client are queued on the bridge's WriteScheduler, so
+    they are paced and coalesced together, and block the asking client
+    until sent.  requests counts the operations served by op.
+    """
+    OPS = ("get", "set", "list", "refresh", "stats")
+
+    def __init__(self, bridge, path=None):
+        self.logger = logging.getLogger(__name__ + ".CommandDaemon")
+        self.bridge = bridge
+        self.path = path or default_socket_path()
+        self.requests = dict((op, 0) for op in self.OPS)
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _bind(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise RuntimeError("A daemon already listens on {}".format(
+                    self.path))
+            finally:
+                probe.close()
+        old_umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixStreamServer(self.path, _Handler)
+        finally:
+            os.umask(old_umask)
+        server.daemon_threads = True
+        server.daemon = self
+        return server
+
+    def start(self):
+        self._server = self._bind()
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,), name="phuey-daemon",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server = self._bind()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.path)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def handle_line(self, line):
+        try:
+            request = json.loads(line.decode("utf-8"))
+            result = self.dispatch(request)
+        except (ValueError, KeyError, TypeError, RuntimeError,
+                AttributeError, OSError) as ee:
+            with self._lock:
+                self.errors += 1
+            self.logger.debug("Request %r failed: %s", line, ee)
+            return {"ok": False, "error": "{}: {}".format(
+                type(ee).__name__, ee)}
+        return {"ok": True, "result": result}
+
+    def _item(self, request):
+        kind = request.get("kind", "light")
+        if kind == "light":
+            items, attr = self.bridge.lights, "light_id"
+        elif kind == "group":
+            items, attr = self.bridge.groups, "group_id"
+        else:
+            raise ValueError("Unknown kind: {}".format(kind))
+        wanted = str(request["id"])
+        for item in items:
+            if str(getattr(item, attr)) == wanted:
+                return item
+        raise KeyError("No {} {}".format(kind, wanted))
+
+    def dispatch(self, request):
+        """Run one decoded request and return its result"""
+        op = request.get("op")
+        if op not in self.OPS:
+            raise ValueError("Unknown op: {}".format(op))
+        with self._lock:
+            self.requests[op] += 1
+        if op == "list":
+            kind = request.get("kind", "light")
+            if kind == "light":
+                return dict((str(light.light_id), light.name)
+                            for light in self.bridge.lights)
+            return dict((group.group_id, group._snapshot().get("name"))
+                        for group in self.bridge.groups)
+        if op == "refresh":
+            self.bridge.refresh()
+            return len(self.bridge.lights)
+        if op == "stats":
+            return {"requests": dict(self.requests), "errors": self.errors,
+                    "pool": self.bridge.pool.stats(),
+                    "breaker": self.bridge._ctx.breaker.stats(),
+                    "scheduler": (self.bridge.scheduler.stats() if
+                                  self.bridge.scheduler else None)}
+        item = self._item(request)
+        if op == "get":
+            field = request.get("field")
+            if field is None:
+                return item._snapshot()
+            if not isinstance(getattr(type(item), field, None),
+                              (HueDescriptor, ColorDescriptor)):
+                raise AttributeError("No field {}".format(field))
+            return getattr(item, field)
+        state = request["state"]
+        if not isinstance(state, dict) or not state:
+            raise ValueError("set needs a non-empty state object")
+        item._put_state(state)
+        return item._snapshot().get(item.state_key)
+
+
+class DaemonClient:
+    """Blocking client of a CommandDaemon; failed requests raise RuntimeError
+    """
+    def __init__(self, path=None, timeout=10):
+        self.logger = logging.getLogger(__name__ + ".DaemonClient")
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._sock, self._file = sock, sock.makefile("rb")
+        return self._sock
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def request(self, op, **fields):
+        fields["op"] = op
+        sock = self._connect()
+        sock.sendall(json.dumps(fields).encode("utf-8") + b"\n")
+        line = self._file.readline()
+        if not line:
+            self.close()
+            raise RuntimeError("Daemon closed the connection")
+        reply = json.loads(line.decode("utf-8"))
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    def get(self, kind, item_id, field=None):
+        return self.request("get", kind=kind, id=item_id, field=field)
+
+    def set(self, kind, item_id, **state):
+        return self.request("set", kind=kind, id=item_id, state=state)
+
+    def list(self, kind="light"):
+        return self.request("list", kind=kind)
+
+    def refresh(self):
+        return self.request("refresh")
+
+    def stats(self):
+        return self.request("stats")
+
+
+def main(argv=None):
+    import argparse
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    arg_parser.add_argument('--bridge', '-b', metavar="BRIDGEIPADDRESS",
+                            required=True)
+    arg_parser.add_argument('--user', '-u', metavar="USERNAME",
+                            required=True)
+    arg_parser.add_argument('--socket', '-s', metavar="PATH",
+                            default=default_socket_path())
+    arg_parser.add_argument('--cache-ttl', type=float,
+                            default=DEFAULT_DAEMON_CACHE_TTL)
+    arg_parser.add_argument('--verbose', '-v', action="store_true",
+                            default=False)
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else
+                        logging.INFO, stream=sys.stdout)
+    from phuey import Bridge
+    bridge = Bridge(args.bridge, args.user, cache_ttl=args.cache_ttl)
+    daemon = CommandDaemon(bridge, args.socket)
+    logger.info("Serving %s on %s", bridge.name, daemon.path)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
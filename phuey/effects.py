@@ -0,0 +1,273 @@
+"""Precomputed light effects streamed to many lights within the bridge budget
+
+A Timeline holds the xy color and brightness of every light for every
+frame, computed up front as NumPy arrays, or as array.array columns when
+NumPy is not installed.  EffectEngine.play emits the frames in real time:
+only lights whose value changed are sent, lights sharing a value that make
+up a whole group are folded into one group action, and commands that do
+not fit the bridge's command budget are skipped rather than queued.
+
+    timeline = Timeline.color_loop(bridge.lights, duration=10, fps=2)
+    report = EffectEngine(bridge).play(timeline, groups=bridge.groups)
+"""
+import logging
+import math
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from phuey import (GROUP_COMMANDS_PER_SECOND, LIGHT_COMMANDS_PER_SECOND,
+                   TokenBucket)
+
+# CIE xy of the D65 white point, the center of color loops
+WHITE_POINT = (0.3227, 0.329)
+
+logger = logging.getLogger(__name__)
+
+
+class Timeline:
+    """Color and brightness of N lights over a number of frames
+
+    x, y and bri are (frames, lights) NumPy arrays, or flat frame-major
+    array('d') columns without NumPy.  A NaN x leaves a light's color alone
+    and only sends its brightness.
+    """
+    def __init__(self, lights, fps, x, y, bri):
+        self.lights = list(lights)
+        self.fps = fps
+        self.x = x
+        self.y = y
+        self.bri = bri
+        width = len(self.lights) or 1
+        self.frames = len(bri) if numpy is not None and \
+            isinstance(bri, numpy.ndarray) else len(bri) // width
+
+    def __len__(self):
+        return self.frames
+
+    @staticmethod
+    def _frame_count(duration, fps):
+        return max(1, int(round(duration * fps)))
+
+    @classmethod
+    def from_function(cls, lights, duration, fps, func):
+        """Build a timeline from func(seconds, light_index) -> (x, y, bri)"""
+        lights = list(lights)
+        frames = cls._frame_count(duration, fps)
+        x, y, bri = array('d'), array('d'), array('d')
+        for frame in range(frames):
+            seconds = frame / float(fps)
+            for index in range(len(lights)):
+                fx, fy, fbri = func(seconds, index)
+                x.append(fx)
+                y.append(fy)
+                bri.append(fbri)
+        if numpy is not None:
+            shape = (frames, len(lights))
+            x, y, bri = (numpy.frombuffer(column, dtype=numpy.float64)
+                         .reshape(shape) for column in (x, y, bri))
+        return cls(lights, fps, x, y, bri)
+
+    @classmethod
+    def fade(cls, lights, duration, fps, start, end, xy=None):
+        """Linear brightness ramp from start to end, at a fixed color"""
+        lights = list(lights)
+        frames = cls._frame_count(duration, fps)
+        cx, cy = xy if xy is not None else (float('nan'), float('nan'))
+        if numpy is not None:
+            shape = (frames, len(lights))
+            ramp = numpy.linspace(start, end, frames)[:, None]
+            return cls(lights, fps, numpy.full(shape, cx),
+                       numpy.full(shape, cy),
+                       numpy.broadcast_to(ramp, shape).copy())
+        step = (end - start) / float(max(1, frames - 1))
+        bri = array('d', (start + step * frame for frame in range(frames)
+                          for _ in lights))
+        return cls(lights, fps, array('d', [cx]) * len(bri),
+                   array('d', [cy]) * len(bri), bri)
+
+    @classmethod
+    def color_loop(cls, lights, duration, fps, bri=254, radius=0.15,
+                   period=None, center=WHITE_POINT, spread=True):
+        """Walk every light around a circle in the xy plane
+
+        One lap takes period seconds (the whole duration by default); with
+        spread the lights start evenly offset around the circle.
+        """
+        lights = list(lights)
+        frames = cls._frame_count(duration, fps)
+        period = period or duration
+        count = len(lights) or 1
+        if numpy is not None:
+            seconds = numpy.arange(frames)[:, None] / float(fps)
+            offsets = numpy.arange(len(lights))[None, :] / float(count)
+            angle = 2 * math.pi * (seconds / period +
+                                   (offsets if spread else 0))
+            shape = (frames, len(lights))
+            return cls(lights, fps,
+                       numpy.broadcast_to(center[0] + radius *
+                                          numpy.cos(angle), shape).copy(),
+                       numpy.broadcast_to(center[1] + radius *
+                                          numpy.sin(angle), shape).copy(),
+                       numpy.full(shape, float(bri)))
+
+        def point(seconds, index):
+            offset = index / float(count) if spread else 0
+            angle = 2 * math.pi * (seconds / period + offset)
+            return (center[0] + radius * math.cos(angle),
+                    center[1] + radius * math.sin(angle), bri)
+        return cls.from_function(lights, duration, fps, point)
+
+    def frame(self, index):
+        """Rounded (x, y, bri) tuples of every light in one frame
+
+        x and y are None for lights whose color is left alone.
+        """
+        if numpy is not None and isinstance(self.bri, numpy.ndarray):
+            xs = numpy.round(self.x[index], 4).tolist()
+            ys = numpy.round(self.y[index], 4).tolist()
+            bris = numpy.rint(self.bri[index]).astype(int).tolist()
+        else:
+            width = len(self.lights)
+            begin, end = index * width, (index + 1) * width
+            xs = [round(v, 4) for v in self.x[begin:end]]
+            ys = [round(v, 4) for v in self.y[begin:end]]
+            bris = [int(round(v)) for v in self.bri[begin:end]]
+        return [(None, None, max(0, min(254, b))) if math.isnan(x) else
+                (x, y, max(0, min(254, b))) for x, y, b in zip(xs, ys, bris)]
+
+
+class EffectReport:
+    """What happened while playing a timeline"""
+    def __init__(self, frames):
+        self.frames = frames
+        self.played = 0
+        self.dropped = 0
+        self.late = 0
+        self.light_commands = 0
+        self.group_commands = 0
+        self.skipped_commands = 0
+        self.errors = 0
+
+    def __str__(self):
+        return ("{} of {} frames played, {} dropped, {} late; {} light and "
+                "{} group commands, {} skipped over budget, {} errors").format(
+            self.played, self.frames, self.dropped, self.late,
+            self.light_commands, self.group_commands, self.skipped_commands,
+            self.errors)
+
+
+class EffectEngine:
+    """Play Timelines on a bridge in real time
+
+    Commands draw from the bridge's WriteScheduler budget when it has one,
+    otherwise from the engine's own buckets.  A frame due more than one
+    frame period ago is dropped; one sent later than late_tolerance is
+    counted as late.
+    """
+    def __init__(self, bridge=None, scheduler=None, late_tolerance=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.logger = logging.getLogger(__name__ + ".EffectEngine")
+        if scheduler is None and bridge is not None:
+            scheduler = bridge.scheduler
+        self.scheduler = scheduler
+        self.buckets = {'lights': TokenBucket(LIGHT_COMMANDS_PER_SECOND, 1),
+                        'groups': TokenBucket(GROUP_COMMANDS_PER_SECOND, 1)}
+        self.late_tolerance = late_tolerance
+        self.clock = clock
+        self.sleep = sleep
+
+    def _acquire(self, budget):
+        if self.scheduler is not None:
+            return self.scheduler.try_acquire(budget)
+        bucket = self.buckets[budget]
+        if bucket.delay() > 0:
+            return False
+        bucket.consume()
+        return True
+
+    def _send(self, obj, payload, report):
+        try:
+            obj._send(obj.state_uri, payload, "PUT")
+        except (RuntimeError, AttributeError) as ee:
+            self.logger.error("Effect command to %s failed: %s", obj, ee)
+            report.errors += 1
+            return False
+        obj._update_cache(payload, obj.state_key)
+        return True
+
+    @staticmethod
+    def _payload(value, transition):
+        x, y, bri = value
+        payload = {"bri": bri, "transitiontime": transition}
+        if x is not None:
+            payload["xy"] = [x, y]
+        return payload
+
+    def _group_members(self, timeline, groups):
+        positions = dict((str(light.light_id), index)
+                         for index, light in enumerate(timeline.lights))
+        folds = []
+        for group in groups:
+            # downloaded membership, reading group.lights could fetch
+            members = list(group.members)
+            if members and all(m in positions for m in members):
+                folds.append((group, [positions[m] for m in members]))
+        folds.sort(key=lambda fold: len(fold[1]), reverse=True)
+        return folds
+
+    def play(self, timeline, groups=()):
+        """Emit every frame of timeline, returning an EffectReport"""
+        report = EffectReport(timeline.frames)
+        period = 1.0 / timeline.fps
+        tolerance = period / 2 if self.late_tolerance is None \
+            else self.late_tolerance
+        transition = int(round(period * 10))
+        folds = self._group_members(timeline, groups)
+        last = [None] * len(timeline.lights)
+        start = self.clock()
+        for index in range(timeline.frames):
+            deadline = start + index * period
+            now = self.clock()
+            if now < deadline:
+                self.sleep(deadline - now)
+            elif now - deadline > period:
+                report.dropped += 1
+                continue
+            elif now - deadline > tolerance:
+                report.late += 1
+            values = timeline.frame(index)
+            pending = dict((i, value) for i, value in enumerate(values)
+                           if value != last[i])
+            for group, members in folds:
+                if not all(m in pending for m in members):
+                    continue
+                value = pending[members[0]]
+                if any(pending[m] != value for m in members):
+                    continue
+                if not self._acquire('groups'):
+                    continue
+                payload = self._payload(value, transition)
+                if self._send(group, payload, report):
+                    report.group_commands += 1
+                    for m in members:
+                        light = timeline.lights[m]
+                        light._update_cache(payload, light.state_key)
+                        last[m] = value
+                for m in members:
+                    del pending[m]
+            for i, value in sorted(pending.items()):
+                if not self._acquire('lights'):
+                    report.skipped_commands += 1
+                    continue
+                if self._send(timeline.lights[i],
+                              self._payload(value, transition), report):
+                    report.light_commands += 1
+                    last[i] = value
+            report.played += 1
+        self.logger.debug("%s", report)
+        return report
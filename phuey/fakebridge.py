@@ -0,0 +1,283 @@
+"""A local fake Hue bridge for tests and benchmarks
+
+FakeBridge serves a bridge config over a real HTTP/1.1 socket using only
+the standard library, so phuey can be exercised end to end without a hub:
+
+    with FakeBridge(make_config(lights=50)) as fake:
+        bridge = phuey.Bridge(fake.address, fake.user)
+
+Latency, failed requests and the bridge's command budget can be simulated
+with the latency, error_rate and rate_limit arguments.  Without starting
+the server, transport() answers the same API in memory:
+
+    fake = FakeBridge(make_config(lights=50))
+    bridge = phuey.Bridge("fake", fake.user, transport=fake.transport())
+"""
+import copy
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from phuey import (GROUP_COMMANDS_PER_SECOND, LIGHT_COMMANDS_PER_SECOND,
+                   TokenBucket)
+
+DEFAULT_USER = "phuey"
+
+logger = logging.getLogger(__name__)
+
+_PATH = re.compile(r"^/api(?:/(?P<user>[^/]+))?"
+                   r"(?:/(?P<kind>[^/]+))?(?:/(?P<item>[^/]+))?"
+                   r"(?:/(?P<sub>[^/]+))?/?$")
+
+
+def make_config(lights=10, groups=1, sensors=1, name="Fake bridge",
+                user=DEFAULT_USER):
+    """Build a full-config document with the given number of devices
+
+    Lights alternate between color and dimmable models and are spread over
+    the groups round robin.
+    """
+    config = {"lights": {}, "groups": {}, "sensors": {}, "scenes": {},
+              "rules": {}, "schedules": {}, "resourcelinks": {},
+              "config": {"name": name, "modelid": "BSB002",
+                         "apiversion": "1.13.0", "swversion": "01033370",
+                         "bridgeid": "001788FFFE000000",
+                         "UTC": "2016-06-01T00:00:00",
+                         "whitelist": {user: {"name": "phuey"}}}}
+    for i in range(1, lights + 1):
+        color = i % 2
+        state = {"on": False, "bri": 254, "alert": "none", "reachable": True}
+        if color:
+            state.update({"hue": 14673, "sat": 156, "effect": "none",
+                          "xy": [0.4677, 0.4121], "ct": 382,
+                          "colormode": "xy"})
+        config["lights"][str(i)] = {
+            "state": state, "name": "light {}".format(i),
+            "type": "Extended color light" if color else "Dimmable light",
+            "modelid": "LCT001" if color else "LWB004",
+            "manufacturername": "Philips",
+            "uniqueid": "00:17:88:01:00:00:{:02x}:{:02x}-0b".format(i // 256,
+                                                                    i % 256),
+            "swversion": "5.23.1.13452"}
+    for g in range(1, groups + 1):
+        members = [key for key in sorted(config["lights"], key=int)
+                   if int(key) % groups == g % groups]
+        config["groups"][str(g)] = {
+            "name": "group {}".format(g), "lights": members,
+            "type": "Room", "class": "Living room",
+            "state": {"all_on": False, "any_on": False}, "recycle": False,
+            "action": {"on": False, "bri": 254, "alert": "none"}}
+    for s in range(1, sensors + 1):
+        config["sensors"][str(s)] = {
+            "state": {"presence": False, "lastupdated": "none"},
+            "config": {"on": True, "reachable": True},
+            "name": "sensor {}".format(s), "type": "ZLLPresence",
+            "modelid": "SML001", "manufacturername": "Philips",
+            "swversion": "6.1.0.18912"}
+    return config
+
+
+def _error(kind, address, description):
+    return [{"error": {"type": kind, "address": address,
+                       "description": description}}]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt, *args)
+
+    def do_GET(self):
+        self.server.fake.handle(self, "GET")
+
+    def do_PUT(self):
+        self.server.fake.handle(self, "PUT")
+
+    def do_POST(self):
+        self.server.fake.handle(self, "POST")
+
+    def do_DELETE(self):
+        self.server.fake.handle(self, "DELETE")
+
+
+class FakeBridge:
+    """Threaded HTTP server answering the Hue REST API from a config dict
+
+    latency is added to every response in seconds, error_rate is the share
+    of requests answered with a 503, and rate_limit, if true, makes state
+    writes beyond the bridge's command budget fail with a 503 as well.
+    requests counts what was served by method.  The HTTP server is only
+    bound by start, and serves HTTPS with an ssl_context holding the
+    certificate, as newer bridges do.
+    """
+    def __init__(self, config=None, user=DEFAULT_USER, host="127.0.0.1",
+                 port=0, latency=0.0, error_rate=0.0, rate_limit=False,
+                 seed=None, ssl_context=None):
+        self.logger = logging.getLogger(__name__ + ".FakeBridge")
+        self.config = copy.deepcopy(config) if config else make_config()
+        self.user = user
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.ssl_context = ssl_context
+        self.requests = {"GET": 0, "PUT": 0, "POST": 0, "DELETE": 0}
+        self.rejected = 0
+        self.buckets = {'lights': TokenBucket(LIGHT_COMMANDS_PER_SECOND),
+                        'groups': TokenBucket(GROUP_COMMANDS_PER_SECOND)}
+        self._group_zero_document = {"name": "Lightset 0",
+                                     "type": "LightGroup",
+                                     "action": {"on": False}}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._bind_address = (host, port)
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self):
+        """host:port to pass as a Bridge ip"""
+        if self._server is None:
+            raise RuntimeError("The fake bridge is not started")
+        host, port = self._server.server_address[:2]
+        return "{}:{}".format(host, port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def start(self):
+        self._server = ThreadingHTTPServer(self._bind_address, _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        if self.ssl_context is not None:
+            self._server.socket = self.ssl_context.wrap_socket(
+                self._server.socket, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,), name="phuey-fakebridge",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def transport(self):
+        """A phuey.transport.MemoryTransport answering from this fake"""
+        from phuey.transport import MemoryTransport
+        return MemoryTransport(self.respond)
+
+    def handle(self, request, meth):
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        status, data = self.respond(meth, request.path, body)
+        self._respond(request, status, data)
+
+    def respond(self, meth, path, body):
+        """Return (status, body bytes) for a request, updating the config"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests[meth] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 503, b""
+            try:
+                payload = json.loads(body.decode("utf-8")) if body else None
+            except ValueError:
+                status, result = 200, _error(2, path,
+                                             "body contains invalid json")
+            else:
+                status, result = self.dispatch(meth, path, payload)
+        if result is None:
+            return status, b""
+        return status, json.dumps(result).encode("utf-8")
+
+    def _respond(self, request, status, data):
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def dispatch(self, meth, path, payload):
+        """Return (status, document) for a request, updating the config"""
+        match = _PATH.match(path)
+        if match is None:
+            return 404, None
+        user, kind, item, sub = match.group("user", "kind", "item", "sub")
+        if user is None:
+            if meth == "POST":
+                return 200, [{"success": {"username": self.user}}]
+            return 200, _error(4, "/", "method, {}, not available for "
+                                       "resource, /".format(meth))
+        if user != self.user:
+            return 200, _error(1, "/", "unauthorized user")
+        address = "/" + "/".join(p for p in (kind, item, sub) if p)
+        if kind is None:
+            return 200, self.config
+        if kind not in self.config:
+            return 200, _error(3, address, "resource, {}, not "
+                                           "available".format(address))
+        collection = self.config[kind]
+        if kind == 'groups' and item == "0":
+            collection = dict(collection, **{"0": self._group_zero})
+        if item is None:
+            if meth == "POST":
+                new_id = str(max([int(k) for k in collection
+                                  if k.isdigit()] or [0]) + 1)
+                collection[new_id] = dict(payload or {})
+                return 200, [{"success": {"id": new_id}}]
+            return 200, collection
+        if item not in collection:
+            return 200, _error(3, address, "resource, {}, not "
+                                           "available".format(address))
+        if meth == "GET":
+            document = collection[item]
+            return 200, document[sub] if sub else document
+        if meth == "DELETE":
+            del collection[item]
+            return 200, [{"success": "{} deleted".format(address)}]
+        if meth != "PUT" or not isinstance(payload, dict):
+            return 200, _error(5, address, "invalid/missing parameters in "
+                                           "body")
+        if sub in ('state', 'action'):
+            if self.rate_limit and kind in self.buckets:
+                bucket = self.buckets[kind]
+                if bucket.delay() > 0:
+                    self.rejected += 1
+                    return 503, None
+                bucket.consume()
+            self._apply_state(kind, collection[item], sub, payload)
+        else:
+            collection[item].update(payload)
+        return 200, [{"success": {"{}/{}".format(address, key): value}}
+                     for key, value in payload.items()]
+
+    @property
+    def _group_zero(self):
+        """The implicit group of all lights the bridge does not list"""
+        self._group_zero_document["lights"] = sorted(self.config['lights'],
+                                                     key=int)
+        return self._group_zero_document
+
+    def _apply_state(self, kind, document, sub, payload):
+        document.setdefault(sub, {}).update(payload)
+        if kind == 'groups':
+            for light_id in document.get('lights', []):
+                if light_id in self.config['lights']:
+                    self.config['lights'][light_id]['state'].update(payload)
@@ -0,0 +1,114 @@
+"""Load many bridges at once and look devices up across all of them"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from phuey import Bridge
+
+logger = logging.getLogger(__name__)
+
+
+class BridgeFleet:
+    """A set of bridges loaded in parallel behind one indexed inventory
+
+    bridges is an iterable of (ip, user) pairs.  Each Bridge is built on a
+    thread pool; a bridge that fails to load is recorded in errors and left
+    out of the inventory without holding up the others.  transports maps
+    addresses to the transport, or its name, of that bridge; extra keyword
+    arguments are passed on to every Bridge.
+
+        fleet = BridgeFleet([("192.168.1.2", user), ("192.168.2.2", user)])
+        for light in fleet.lights_named("kitchen white"):
+            light.on = True
+    """
+    def __init__(self, bridges, max_workers=None, transports=None,
+                 **bridge_kwargs):
+        self.logger = logging.getLogger(__name__ + ".BridgeFleet")
+        self.max_workers = max_workers
+        self.transports = dict(transports or {})
+        self.bridge_kwargs = bridge_kwargs
+        self.credentials = list(bridges)
+        self.bridges = {}
+        self.errors = {}
+        self.load()
+
+    def __len__(self):
+        return len(self.bridges)
+
+    def __iter__(self):
+        return iter(self.bridges.values())
+
+    def __str__(self):
+        return "Fleet of {} bridge(s) with {} light(s), {} failed".format(
+            len(self.bridges), len(self.lights), len(self.errors))
+
+    def _load_bridge(self, ip, user):
+        kwargs = dict(self.bridge_kwargs)
+        if ip in self.transports:
+            kwargs["transport"] = self.transports[ip]
+        return Bridge(ip, user, **kwargs)
+
+    def load(self, ips=None):
+        """(Re)load the given bridge addresses, all of them by default"""
+        wanted = [(ip, user) for ip, user in self.credentials
+                  if ips is None or ip in ips]
+        if not wanted:
+            return
+        workers = self.max_workers or len(wanted)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(ip, executor.submit(self._load_bridge, ip, user))
+                       for ip, user in wanted]
+            for ip, future in futures:
+                try:
+                    self.bridges[ip] = future.result()
+                except Exception as ee:
+                    self.logger.error("Bridge %s failed to load: %s", ip, ee)
+                    self.bridges.pop(ip, None)
+                    self.errors[ip] = ee
+                else:
+                    self.errors.pop(ip, None)
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self.lights, self.groups, self.sensors = [], [], []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_model = {}
+        for ip, bridge in self.bridges.items():
+            for kind, items, id_attr in (('lights', bridge.lights, 'light_id'),
+                                         ('groups', bridge.groups, 'group_id'),
+                                         ('sensors', bridge.sensors,
+                                          'sensor_id')):
+                getattr(self, kind).extend(items)
+                for item in items:
+                    data = item._cache or {}
+                    self._by_id[(ip, kind, str(getattr(item, id_attr)))] = item
+                    if 'name' in data:
+                        self._by_name.setdefault((kind, data['name']),
+                                                 []).append(item)
+                    if 'modelid' in data:
+                        self._by_model.setdefault((kind, data['modelid']),
+                                                  []).append(item)
+
+    def light(self, ip, light_id):
+        return self._by_id[(ip, 'lights', str(light_id))]
+
+    def group(self, ip, group_id):
+        return self._by_id[(ip, 'groups', str(group_id))]
+
+    def sensor(self, ip, sensor_id):
+        return self._by_id[(ip, 'sensors', str(sensor_id))]
+
+    def lights_named(self, name):
+        return list(self._by_name.get(('lights', name), []))
+
+    def groups_named(self, name):
+        return list(self._by_name.get(('groups', name), []))
+
+    def sensors_named(self, name):
+        return list(self._by_name.get(('sensors', name), []))
+
+    def lights_by_model(self, modelid):
+        return list(self._by_model.get(('lights', modelid), []))
+
+    def sensors_by_model(self, modelid):
+        return list(self._by_model.get(('sensors', modelid), []))
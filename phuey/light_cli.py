@@ -1,12 +1,16 @@
-from sys import stdout
-import argparse
-import json
-import logging
+"""Set the state of one or more lights from the command line
 
-from .phuey import Bridge, Light
+    phuey-light -b 192.168.1.2 -u USER -l 1 -c on=true,bri=200 \\
+        -l 2 -c on=false
 
-
-logger = logging.getLogger()
+Each -l is paired with the -c that follows it; a single -c applies to
+every light.  With --socket the commands go through a running
+phuey-daemon instead of straight to the bridge.  This runs from cron and
+automation hooks many times a day, so argparse is imported only to parse
+the arguments, phuey itself imports http.client and the JSON backend only
+once a request is made, and logging is configured only with --verbose.
+"""
+import sys
 
 
 def command_interpreter(command):
@@ -20,29 +24,92 @@ def command_interpreter(command):
             v = False
         elif v.isdigit() is True:
             v = int(v)
-        python_dict[k] = v 
-    return json.dumps(python_dict)
+        python_dict[k] = v
+    return python_dict
 
-if __name__ == "__main__":
-    arg_parser = argparse.ArgumentParser()
+
+def pair_commands(lights, commands):
+    """Match light ids with their commands, as a list of (id, state)"""
+    if len(commands) == 1:
+        commands = commands * len(lights)
+    if len(lights) != len(commands):
+        raise ValueError("Give one command per light, or one for all")
+    return [(light_id, command_interpreter(command))
+            for light_id, command in zip(lights, commands)]
+
+
+def get_args(argv=None):
+    import argparse
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
     arg_parser.add_argument('--bridge', '-b', metavar="BRIDGEIPADDRESS")
     arg_parser.add_argument('--user', '-u', metavar="USERNAME")
-    arg_parser.add_argument('--light', '-l', metavar="LIGHTID")
-    arg_parser.add_argument('--command', '-c', metavar="COMMAND")
-    args = arg_parser.parse_args()
-    bridge_ip = args.bridge
-    user = args.user
-    lid = args.light
-    command = command_interpreter(args.command)
+    arg_parser.add_argument('--socket', '-s', metavar="PATH",
+                            help="send through the phuey daemon at PATH")
+    arg_parser.add_argument('--light', '-l', metavar="LIGHTID",
+                            action="append", required=True)
+    arg_parser.add_argument('--command', '-c', metavar="COMMAND",
+                            action="append", required=True)
+    arg_parser.add_argument('--verbose', '-v', action="store_true",
+                            default=False)
+    args = arg_parser.parse_args(argv)
+    if args.socket is None and (args.bridge is None or args.user is None):
+        arg_parser.error("--bridge and --user are required without --socket")
+    return arg_parser, args
+
+
+def setup_logging():
+    import logging
+    logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler(stdout)
+    ch = logging.StreamHandler(sys.stdout)
     ch.setLevel(logging.DEBUG)
-    fmt = '%(name)s - %(asctime)s - %(module)s-%(funcName)s/%(lineno)d - %(message)s'
-    formatter = logging.Formatter(fmt)
-    ch.setFormatter(formatter)
+    fmt = ('%(name)s - %(asctime)s - %(module)s-%(funcName)s/%(lineno)d - '
+           '%(message)s')
+    ch.setFormatter(logging.Formatter(fmt))
     logger.addHandler(ch)
 
 
-    light = Light(bridge_ip, user, lid, 'my light')
-    logger.debug(command)
-    light.state = json.loads(command)
+def main(argv=None):
+    arg_parser, args = get_args(argv)
+    try:
+        pairs = pair_commands(args.light, args.command)
+    except ValueError as ve:
+        arg_parser.error(ve)
+    if args.verbose:
+        setup_logging()
+    if args.socket is not None:
+        return send_to_daemon(args.socket, pairs)
+    # the package is already imported, being our parent, but it leaves
+    # http.client and the JSON backend until the first request
+    from phuey import Light
+    failures = 0
+    for light_id, state in pairs:
+        light = Light(args.bridge, args.user, light_id)
+        try:
+            light.state = state
+        except (RuntimeError, AttributeError, OSError) as ee:
+            print("light {}: {}".format(light_id, ee), file=sys.stderr)
+            failures += 1
+    return 1 if failures else 0
+
+
+def send_to_daemon(path, pairs):
+    from phuey.daemon import DaemonClient
+    failures = 0
+    try:
+        with DaemonClient(path) as client:
+            for light_id, state in pairs:
+                try:
+                    client.set("light", light_id, **state)
+                except RuntimeError as ee:
+                    print("light {}: {}".format(light_id, ee),
+                          file=sys.stderr)
+                    failures += 1
+    except OSError as oe:
+        print("daemon at {}: {}".format(path, oe), file=sys.stderr)
+        return 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""Reach a desired state across many lights with as few requests as possible
+
+Lights sharing a target state are covered by group actions where the
+bridge already has a group made of exactly such lights; the rest get one
+light PUT each, or share a temporary group when that is cheaper:
+
+    planner = CommandPlanner(bridge)
+    plan = planner.apply({1: {"on": True}, 2: {"on": True}, 3: {"bri": 5}})
+    print(plan.saved, "requests saved")
+"""
+import json
+import logging
+
+from phuey import Group
+
+# creating, using and deleting a temporary group costs three requests, so
+# it only pays off from four lights on
+MIN_TEMPORARY_GROUP = 4
+
+logger = logging.getLogger(__name__)
+
+
+def _state_key(state):
+    return json.dumps(state, sort_keys=True)
+
+
+class Plan:
+    """Group and light PUTs that together reach a desired state
+
+    group_steps holds (group, state, member ids), light_steps holds
+    (light, state) and temporary holds (member ids, state) for groups
+    created just for this plan.  requests counts every call the plan makes,
+    baseline the calls one PUT per light would have made.
+    """
+    def __init__(self, baseline):
+        self.logger = logging.getLogger(__name__ + ".Plan")
+        self.baseline = baseline
+        self.group_steps = []
+        self.light_steps = []
+        self.temporary = []
+        self.sent = 0
+        self.errors = []
+
+    @property
+    def requests(self):
+        return (len(self.group_steps) + len(self.light_steps) +
+                3 * len(self.temporary))
+
+    @property
+    def saved(self):
+        return self.baseline - self.requests
+
+    def __str__(self):
+        return ("{} group, {} light and {} temporary group step(s): {} "
+                "request(s) instead of {}").format(
+            len(self.group_steps), len(self.light_steps),
+            len(self.temporary), self.requests, self.baseline)
+
+    def execute(self, lights, context=None):
+        """Send the plan; lights maps light ids to Light objects
+
+        Failures are collected in errors instead of stopping the plan.
+        """
+        for group, state, members in self.group_steps:
+            if self._put(group, state):
+                self._mark(lights, members, state)
+        for light, state in self.light_steps:
+            self._put(light, state)
+        for members, state in self.temporary:
+            some_light = lights[members[0]]
+            try:
+                group = Group(some_light.ip, some_light.user,
+                              attributes={"lights": list(members),
+                                          "name": "phuey temporary"},
+                              context=context or some_light._ctx)
+            except (RuntimeError, AttributeError) as ee:
+                self.errors.append((members, ee))
+                continue
+            self.sent += 1
+            if self._put(group, state):
+                self._mark(lights, members, state)
+            try:
+                group.remove()
+            except (RuntimeError, KeyError, TypeError) as ee:
+                self.errors.append((group, ee))
+            else:
+                self.sent += 1
+        return self
+
+    def _put(self, obj, state):
+        try:
+            obj._put_state(state)
+        except (RuntimeError, AttributeError) as ee:
+            self.logger.error("Plan step on %s failed: %s", obj, ee)
+            self.errors.append((obj, ee))
+            return False
+        self.sent += 1
+        return True
+
+    @staticmethod
+    def _mark(lights, members, state):
+        for member in members:
+            light = lights[member]
+            light._update_cache(state, light.state_key)
+
+
+def plan(desired, groups=(), temporary=False,
+         min_temporary=MIN_TEMPORARY_GROUP):
+    """Compute a Plan reaching desired, a {light id: state} mapping
+
+    A group is used only when every one of its lights wants the same
+    state, and only when it replaces at least two light PUTs.  Group
+    membership comes from what the bridge already downloaded, planning
+    never sends a request of its own.
+    """
+    targets = dict((str(light_id), state) for light_id, state in
+                   desired.items() if state)
+    result = Plan(len(targets))
+    by_state = {}
+    for light_id, state in targets.items():
+        by_state.setdefault(_state_key(state), []).append(light_id)
+    memberships = [(group, frozenset(group.members)) for group in groups]
+    for key, light_ids in sorted(by_state.items(), key=lambda i: -len(i[1])):
+        state = targets[light_ids[0]]
+        wanted = frozenset(light_ids)
+        candidates = [(group, members) for group, members in memberships
+                      if members and members <= wanted]
+        uncovered = set(wanted)
+        while candidates:
+            group, members = max(candidates,
+                                 key=lambda c: len(c[1] & uncovered))
+            if len(members & uncovered) < 2:
+                break
+            result.group_steps.append((group, state, sorted(members, key=int)))
+            uncovered -= members
+            candidates.remove((group, members))
+        remaining = sorted(uncovered, key=int)
+        if temporary and len(remaining) >= min_temporary:
+            result.temporary.append((remaining, state))
+        else:
+            result.light_steps.extend((light_id, state)
+                                      for light_id in remaining)
+    return result
+
+
+class CommandPlanner:
+    """Plans and applies desired states on the lights of one Bridge
+
+    The bridge's own groups plus group 0, which holds every light, are
+    candidates for group actions.
+    """
+    def __init__(self, bridge, temporary=False,
+                 min_temporary=MIN_TEMPORARY_GROUP):
+        self.logger = logging.getLogger(__name__ + ".CommandPlanner")
+        self.bridge = bridge
+        self.temporary = temporary
+        self.min_temporary = min_temporary
+
+    def _groups(self):
+        everything = Group(self.bridge.ip, self.bridge.user, 0,
+                           context=self.bridge._ctx)
+        everything._seed({"lights": [str(light.light_id) for light in
+                                     self.bridge.lights], "action": {}})
+        return [everything] + list(self.bridge.groups)
+
+    def plan(self, desired):
+        lights = dict((str(light.light_id), light)
+                      for light in self.bridge.lights)
+        unknown = [light_id for light_id in desired
+                   if str(light_id) not in lights]
+        if unknown:
+            raise KeyError("Unknown light(s): {}".format(unknown))
+        result = plan(desired, self._groups(), self.temporary,
+                      self.min_temporary)
+        result.light_steps = [(lights[light_id], state) for light_id, state
+                              in result.light_steps]
+        return result
+
+    def apply(self, desired):
+        """Plan desired, send it and return the executed Plan"""
+        result = self.plan(desired)
+        self.logger.debug("%s", result)
+        lights = dict((str(light.light_id), light)
+                      for light in self.bridge.lights)
+        return result.execute(lights, self.bridge._ctx)
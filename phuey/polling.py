@@ -0,0 +1,332 @@
+"""Poll sensors and lights of many bridges from worker processes
+
+SensorPoller spreads the bridges over worker processes that poll them at
+a fixed interval and write normalized values into a StateTable, a table
+of floats in shared memory.  Other processes attach to the table by name
+and read the latest values without building Bridge objects or making any
+HTTP request:
+
+    with SensorPoller([(ip, user) for ip in ips], interval=0.5) as poller:
+        share(poller.table.name)
+
+    table = StateTable.attach(name)
+    motion = table.read(table.find(ip, "sensors", "12"))["presence"]
+
+Each row holds one light or sensor with the columns in COLUMNS; values a
+device does not report are NaN.  Rows are written under a sequence lock,
+so read() never returns a half written row.
+"""
+import json
+import logging
+import math
+import multiprocessing
+import os
+import struct
+import time
+from datetime import datetime, timezone
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from phuey import BridgeContext, HueObject
+from phuey.transport import create_transport
+from phuey.fleet import BridgeFleet
+
+# version is odd while a row is being written, updated is the time.time()
+# of the last write, lastupdated the bridge's own timestamp of the sensor
+# event, temperature is in degrees Celsius and booleans are 0.0 or 1.0
+COLUMNS = ("version", "updated", "lastupdated", "reachable", "on", "bri",
+           "presence", "temperature", "lux", "dark", "daylight",
+           "buttonevent", "battery")
+DEFAULT_INTERVAL = 1.0
+
+_MAGIC = b"PHUEYTBL"
+_HEADER = struct.Struct("<8sIII")
+_NAN = float("nan")
+
+logger = logging.getLogger(__name__)
+
+
+def _number(value):
+    if value is None:
+        return _NAN
+    return float(value)
+
+
+def _timestamp(value):
+    try:
+        moment = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+    except (TypeError, ValueError):
+        return _NAN
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+def normalize(kind, item):
+    """Map a light or sensor document to {column: float}"""
+    state = item.get("state", {})
+    config = item.get("config", {})
+    if kind == "lights":
+        return {"reachable": _number(state.get("reachable")),
+                "on": _number(state.get("on")),
+                "bri": _number(state.get("bri"))}
+    level = state.get("lightlevel")
+    temperature = state.get("temperature")
+    return {"reachable": _number(config.get("reachable")),
+            "on": _number(config.get("on")),
+            "battery": _number(config.get("battery")),
+            "lastupdated": _timestamp(state.get("lastupdated")),
+            "presence": _number(state.get("presence")),
+            "temperature": _NAN if temperature is None else
+            temperature / 100.0,
+            "lux": _NAN if level is None else
+            10 ** ((level - 1) / 10000.0),
+            "dark": _number(state.get("dark")),
+            "daylight": _number(state.get("daylight")),
+            "buttonevent": _number(state.get("buttonevent"))}
+
+
+class StateTable:
+    """A rows x COLUMNS table of floats in a named shared memory block
+
+    The block starts with a header and the JSON list of rows, each an
+    [ip, kind, item id, name] list, followed by the table itself.  The
+    process that creates the table owns the block and unlinks it.
+    """
+    def __init__(self, shm, owner=False):
+        self.logger = logging.getLogger(__name__ + ".StateTable")
+        self.shm = shm
+        self.owner = owner
+        magic, rows, cols, index_size = _HEADER.unpack_from(shm.buf)
+        if magic != _MAGIC:
+            raise ValueError("{} is not a phuey state table".format(shm.name))
+        start = _HEADER.size
+        index = json.loads(bytes(shm.buf[start:start + index_size]))
+        self.rows = [tuple(row) for row in index["rows"]]
+        self.columns = tuple(index["columns"])
+        self._positions = dict((name, i) for i, name in
+                               enumerate(self.columns))
+        self._by_key = dict(((ip, kind, item_id), i) for i, (ip, kind,
+                            item_id, name) in enumerate(self.rows))
+        self._offset = self._table_offset(index_size)
+        self._width = cols
+        self._flat = shm.buf[self._offset:self._offset +
+                             max(1, rows) * cols * 8].cast('d')
+
+    @staticmethod
+    def _table_offset(index_size):
+        return (_HEADER.size + index_size + 7) // 8 * 8
+
+    @classmethod
+    def create(cls, rows, name=None, columns=COLUMNS):
+        """Allocate a table for rows of (ip, kind, item id, name)"""
+        index = json.dumps({"rows": [list(row) for row in rows],
+                            "columns": list(columns)}).encode("utf-8")
+        size = (cls._table_offset(len(index)) +
+                max(1, len(rows)) * len(columns) * 8)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, len(rows), len(columns),
+                          len(index))
+        shm.buf[_HEADER.size:_HEADER.size + len(index)] = index
+        table = cls(shm, owner=True)
+        for row in range(len(rows)):
+            for column in range(len(columns)):
+                table._flat[row * len(columns) + column] = \
+                    0.0 if column == 0 else _NAN
+        return table
+
+    @classmethod
+    def attach(cls, name):
+        """Open a table another process created, read and write"""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # before Python 3.13 every process attaching registers the
+            # block, and its resource tracker would unlink it on exit
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return len(self.rows)
+
+    def find(self, ip, kind, item_id):
+        """Row number of a bridge's light or sensor"""
+        return self._by_key[(ip, kind, str(item_id))]
+
+    def write(self, row, values):
+        flat, base = self._flat, row * self._width
+        flat[base] += 1
+        for column, value in values.items():
+            flat[base + self._positions[column]] = value
+        flat[base + 1] = time.time()
+        flat[base] += 1
+
+    def read(self, row, retries=1000):
+        """Return a consistent {column: value} copy of one row"""
+        begin = row * self._width
+        end = begin + self._width
+        for _ in range(retries):
+            version = self._flat[begin]
+            if version % 2:
+                time.sleep(0)
+                continue
+            values = self._flat[begin:end].tolist()
+            if self._flat[begin] == version:
+                return dict(zip(self.columns, values))
+        raise RuntimeError("Row {} kept changing while read".format(row))
+
+    def array(self):
+        """The whole table without copying, as a NumPy array if installed
+
+        The view must be dropped before the table is closed.
+        """
+        rows = max(1, len(self.rows))
+        if numpy is not None:
+            return numpy.ndarray((rows, self._width), dtype=numpy.float64,
+                                 buffer=self.shm.buf, offset=self._offset)
+        return self._flat.cast('B').cast('d', shape=[rows, self._width])
+
+    def close(self):
+        self._flat.release()
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            # attaching processes may have unregistered the shared name
+            resource_tracker.register(self.shm._name, "shared_memory")
+            self.shm.unlink()
+
+
+def _poll_worker(name, bridges, kinds, interval, stop, transport="http"):
+    """Worker process body: poll bridges until stop is set
+
+    bridges holds (ip, user, {kind: [(item id, row)]}) tuples.
+    """
+    # a forked worker must not share the parent's pooled connections
+    BridgeContext.reset_all()
+    table = StateTable.attach(name)
+    clients = []
+    for ip, user, rows in bridges:
+        context = BridgeContext(ip, user, rate_limit=False,
+                                transport=create_transport(transport, ip))
+        clients.append((HueObject(ip, user, context), rows))
+    deadline = time.monotonic()
+    try:
+        while not stop.is_set():
+            for client, rows in clients:
+                try:
+                    collections = client._get_many(
+                        [client.base_uri + "/" + kind for kind in kinds])
+                except (RuntimeError, AttributeError, OSError) as ee:
+                    logger.warning("Polling %s failed: %s", client.ip, ee)
+                    continue
+                for kind, documents in zip(kinds, collections):
+                    for item_id, row in rows.get(kind, ()):
+                        document = documents.get(item_id)
+                        if document is not None:
+                            table.write(row, normalize(kind, document))
+            deadline += interval
+            stop.wait(max(0.0, deadline - time.monotonic()))
+    finally:
+        table.close()
+
+
+class SensorPoller:
+    """Poll many bridges from worker processes into a shared StateTable
+
+    bridges is an iterable of (ip, user) pairs, spread round robin over
+    processes workers (one per bridge up to the CPU count by default).
+    The inventory is loaded once at start; devices added later are not
+    polled until the poller is started again.  Bridges that fail to load
+    are left out and recorded in errors.  transport names the
+    phuey.transport each worker polls through, "pipelined" fetches all
+    kinds of a bridge in one round trip.
+    """
+    def __init__(self, bridges, interval=DEFAULT_INTERVAL, processes=None,
+                 kinds=("sensors", "lights"), name=None, transport="http"):
+        self.logger = logging.getLogger(__name__ + ".SensorPoller")
+        self.credentials = list(bridges)
+        self.interval = interval
+        self.processes = processes
+        self.kinds = tuple(kinds)
+        self.name = name
+        self.transport = transport
+        self.table = None
+        self.errors = {}
+        self.workers = []
+        self._context = multiprocessing.get_context()
+        self._stop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _inventory(self):
+        fleet = BridgeFleet(self.credentials, rate_limit=False)
+        self.errors = dict(fleet.errors)
+        rows, assignments = [], []
+        for ip, user in self.credentials:
+            bridge = fleet.bridges.get(ip)
+            if bridge is None:
+                continue
+            kinds = {}
+            for kind in self.kinds:
+                for item in getattr(bridge, kind):
+                    item_id = bridge._item_id(item)
+                    data = item._cache or {}
+                    kinds.setdefault(kind, []).append((item_id, len(rows)))
+                    rows.append((ip, kind, item_id, data.get("name")))
+            assignments.append((ip, user, kinds))
+        return rows, assignments
+
+    def start(self):
+        rows, assignments = self._inventory()
+        self.table = StateTable.create(rows, self.name)
+        count = self.processes or min(len(assignments),
+                                      os.cpu_count() or 1)
+        groups = [assignments[i::count] for i in range(count)]
+        self._stop = self._context.Event()
+        for number, group in enumerate(groups):
+            worker = self._context.Process(
+                target=_poll_worker, name="phuey-poller-{}".format(number),
+                args=(self.table.name, group, self.kinds, self.interval,
+                      self._stop, self.transport), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.logger.info("Polling %d rows of %d bridge(s) in %d process(es)",
+                         len(rows), len(assignments), len(self.workers))
+        return self
+
+    def stop(self, timeout=5):
+        if self._stop is not None:
+            self._stop.set()
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        if self.table is not None:
+            self.table.close()
+            self.table.unlink()
+            self.table = None
+
+    def wait_for_data(self, timeout=10):
+        """Block until every row was written once, True if they were"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(not math.isnan(self.table.read(row)["updated"])
+                   for row in range(len(self.table))):
+                return True
+            time.sleep(self.interval / 10.0)
+        return False
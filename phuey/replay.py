@@ -0,0 +1,247 @@
+"""Record bridge traffic to a log and replay it without a bridge
+
+While recording, every request sent to a bridge address and the response
+it got are appended to a log, one compact JSON line each.  Replaying
+serves those responses back from the log instead of the network, with
+the recorded latency scaled by speed, or as fast as possible:
+
+    with record("192.168.1.2", "evening.log"):
+        run_automation(Bridge("192.168.1.2", user))
+
+    with replay("192.168.1.2", "evening.log", speed=None):
+        run_automation(Bridge("192.168.1.2", user, rate_limit=False))
+
+Both hook into a ConnectionPool, so keep-alive, retries and
+instrumentation behave exactly as they do against a real bridge.  Given
+an address they hook the pool shared by objects built without a
+transport; a Bridge with its own transport, such as transport="https"
+or "pipelined", must be passed itself, or its transport:
+
+    bridge = Bridge("192.168.1.2", user, transport="pipelined")
+    with record(bridge, "evening.log"):
+        run_automation(bridge)
+
+Pipelined GETs are recorded and replayed one by one.  Transports without
+connections to hook, like MemoryTransport, raise ValueError.  A
+replayed request is answered with the responses recorded for the same
+method, URL and body, in order, the last one repeating once they run out;
+a request that was never recorded gets a 404.
+"""
+import collections
+import contextlib
+import json
+import logging
+import threading
+import time
+
+from phuey import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class _Response:
+    """The parts of HTTPResponse phuey reads, from recorded data"""
+    def __init__(self, status, reason, data, headers=(), will_close=False):
+        self.status = status
+        self.reason = reason
+        self.will_close = will_close
+        self._data = data
+        self._headers = list(headers)
+
+    def read(self):
+        return self._data
+
+    def getheaders(self):
+        return self._headers
+
+
+def _text(data):
+    if data is None:
+        return None
+    return data.decode("utf-8") if isinstance(data, bytes) else data
+
+
+class Recorder:
+    """Append-only traffic log, one JSON line per exchange
+
+    Lines hold the method m, url u, request body b, status s, reason r,
+    response body d, latency e in seconds and the offset t since the
+    recorder was opened.
+    """
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__ + ".Recorder")
+        self.path = path
+        self.count = 0
+        self._start = time.monotonic()
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, meth, url, body, status, reason, data, elapsed):
+        line = json.dumps({"m": meth, "u": url, "b": _text(body),
+                           "s": status, "r": reason, "d": _text(data),
+                           "e": round(elapsed, 6),
+                           "t": round(time.monotonic() - self._start, 6)},
+                          separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class TrafficLog:
+    """A recorded log loaded for replay"""
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        with open(path, encoding="utf-8") as log:
+            for line in log:
+                if line.strip():
+                    self.entries.append(json.loads(line))
+        self._responses = {}
+        for entry in self.entries:
+            key = (entry["m"], entry["u"], entry["b"])
+            self._responses.setdefault(key, collections.deque()).append(entry)
+        self.served = 0
+        self.missed = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, meth, url, body):
+        """Return the next entry recorded for a request, None if unknown"""
+        with self._lock:
+            recorded = self._responses.get((meth, url, _text(body)))
+            if not recorded:
+                self.missed += 1
+                return None
+            self.served += 1
+            if len(recorded) > 1:
+                return recorded.popleft()
+            return recorded[0]
+
+
+class RecordingConnection:
+    """Wraps an HTTPConnection, logging every exchange to a Recorder"""
+    def __init__(self, recorder, connection):
+        self.recorder = recorder
+        self.connection = connection
+        self._request = None
+
+    @property
+    def timeout(self):
+        return self.connection.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self.connection.timeout = timeout
+
+    @property
+    def sock(self):
+        return self.connection.sock
+
+    def request(self, meth, url, body=None, headers=None):
+        self._request = (meth, url, body, time.perf_counter())
+        self.connection.request(meth, url, body, headers or {})
+
+    def getresponse(self):
+        response = self.connection.getresponse()
+        data = response.read()
+        meth, url, body, start = self._request
+        self.recorder.write(meth, url, body, response.status,
+                            response.reason, data,
+                            time.perf_counter() - start)
+        return _Response(response.status, response.reason, data,
+                         response.getheaders(), response.will_close)
+
+    def close(self):
+        self.connection.close()
+
+
+class ReplayConnection:
+    """Answers requests from a TrafficLog instead of the network
+
+    speed scales the recorded latency, 2.0 replays twice as fast, and None
+    does not wait at all.
+    """
+    def __init__(self, log, speed=None, timeout=None, sleep=time.sleep):
+        self.log = log
+        self.speed = speed
+        self.timeout = timeout
+        self.sleep = sleep
+        self._request = None
+
+    def request(self, meth, url, body=None, headers=None):
+        self._request = (meth, url, body)
+
+    def getresponse(self):
+        entry = self.log.lookup(*self._request)
+        if entry is None:
+            return _Response(404, "Not recorded", b"")
+        if self.speed:
+            self.sleep(entry["e"] / self.speed)
+        data = entry["d"]
+        return _Response(entry["s"], entry["r"],
+                         b"" if data is None else data.encode("utf-8"))
+
+    def close(self):
+        pass
+
+
+def _pool(target):
+    """The ConnectionPool an address, HueObject or transport talks through
+    """
+    if isinstance(target, str):
+        return ConnectionPool.for_bridge(target)
+    transport = getattr(target, "transport", target)
+    if not isinstance(transport, ConnectionPool):
+        raise ValueError("Cannot hook traffic of {!r}, only of a "
+                         "ConnectionPool".format(transport))
+    return transport
+
+
+@contextlib.contextmanager
+def _installed(pool, factory):
+    previous = pool.connection_factory
+    pool.close()
+    pool.connection_factory = factory
+    try:
+        yield pool
+    finally:
+        pool.connection_factory = previous
+        pool.close()
+
+
+@contextlib.contextmanager
+def record(target, path):
+    """Log all traffic of target to path while in the block
+
+    target is a bridge address, a Bridge or other HueObject, or a
+    ConnectionPool.
+    """
+    pool = _pool(target)
+    recorder = Recorder(path)
+
+    def factory(host, port=None, timeout=None):
+        return RecordingConnection(recorder, pool._new_connection())
+    try:
+        with _installed(pool, factory):
+            yield recorder
+    finally:
+        recorder.close()
+
+
+@contextlib.contextmanager
+def replay(target, path, speed=None):
+    """Serve requests of target from the log at path, see record"""
+    pool = _pool(target)
+    log = TrafficLog(path)
+
+    def factory(host, port=None, timeout=None):
+        return ReplayConnection(log, speed, timeout)
+    with _installed(pool, factory):
+        yield log
@@ -0,0 +1,57 @@
+"""JSON encoding and decoding of bridge traffic
+
+orjson is used when it is installed, then ujson, then the standard
+library's json module.  Request bodies are encoded straight to bytes and
+responses are parsed from the bytes read off the socket without decoding
+them to str first.  The backend can be forced with the PHUEY_JSON
+environment variable or at run time:
+
+    from phuey import serializer
+    serializer.use("json")
+
+Every backend raises a ValueError subclass for malformed documents.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# backends in order of preference, each an (encode, decode) pair
+BACKENDS = {}
+if orjson is not None:
+    BACKENDS["orjson"] = (orjson.dumps, orjson.loads)
+if ujson is not None:
+    BACKENDS["ujson"] = (
+        lambda obj: ujson.dumps(obj, ensure_ascii=False).encode("utf-8"),
+        ujson.loads)
+BACKENDS["json"] = (
+    lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8"),
+    json.loads)
+
+backend = None
+dumps = None
+loads = None
+
+
+def use(name=None):
+    """Select a backend by name, the fastest installed one by default"""
+    global backend, dumps, loads
+    if name is None:
+        name = next(iter(BACKENDS))
+    if name not in BACKENDS:
+        raise ValueError("JSON backend {} is not available, choose from "
+                         "{}".format(name, ", ".join(BACKENDS)))
+    backend = name
+    dumps, loads = BACKENDS[name]
+    return name
+
+
+use(os.environ.get("PHUEY_JSON") or None)
@@ -0,0 +1,246 @@
+"""Transports besides the default keep-alive ConnectionPool
+
+A Bridge hands its transport to every light, group and resource it
+builds, so one argument picks how all of them talk to the bridge:
+
+    Bridge(ip, user, transport="https")
+    Bridge(ip, user, transport=HTTPSTransport(ip, fingerprint=pinned))
+    Bridge("fake", user, transport=FakeBridge(config).transport())
+
+HTTPSTransport talks TLS to bridges that serve the API on port 443 and
+pins the bridge's certificate.  PipelinedTransport writes a batch of GETs
+to one connection before reading any response, see HueObject._get_many.
+MemoryTransport answers from a function instead of the network.
+"""
+import hashlib
+import logging
+import ssl
+import threading
+
+from phuey import _STALE_ERRORS, ConnectionPool, Transport, http_client
+
+DEFAULT_PIPELINE_DEPTH = 16
+
+logger = logging.getLogger(__name__)
+
+
+class CertificateMismatchError(ssl.SSLCertVerificationError):
+    """The bridge presented a certificate other than the pinned one"""
+
+
+class _PinnedHTTPSConnection(http_client.HTTPSConnection):
+
+    def __init__(self, transport, host, port=None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.transport = transport
+
+    def connect(self):
+        super().connect()
+        try:
+            self.transport.check_certificate(
+                self.sock.getpeercert(binary_form=True))
+        except CertificateMismatchError:
+            self.close()
+            raise
+
+
+class HTTPSTransport(ConnectionPool):
+    """Keep-alive HTTPS connections with the bridge's certificate pinned
+
+    Bridges sign their own certificate and name it after the bridge id,
+    so the address is not checked against it.  fingerprint is the SHA-256
+    of the certificate, as hex with or without colons; without one the
+    first certificate seen is pinned, read it back from fingerprint to
+    pin it next time.  cafile additionally verifies the certificate chain.
+    A certificate that fails either check raises as it is, without retries.
+    """
+    fatal_errors = (ssl.SSLCertVerificationError,)
+
+    def __init__(self, ip, port=None, fingerprint=None, cafile=None,
+                 **kwargs):
+        super().__init__(ip, port, **kwargs)
+        if fingerprint is not None:
+            fingerprint = fingerprint.replace(":", "").lower()
+        self.fingerprint = fingerprint
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        if cafile is None:
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            context.load_verify_locations(cafile)
+        self.ssl_context = context
+        self._pin_lock = threading.Lock()
+
+    def _new_connection(self):
+        return _PinnedHTTPSConnection(self, self.ip, self.port,
+                                      timeout=self.timeout,
+                                      context=self.ssl_context)
+
+    def check_certificate(self, certificate):
+        """Raise CertificateMismatchError unless the DER bytes are pinned"""
+        seen = hashlib.sha256(certificate).hexdigest()
+        with self._pin_lock:
+            if self.fingerprint is None:
+                self.fingerprint = seen
+                self.logger.info("Pinned certificate %s of %s", seen,
+                                 self.ip)
+                return
+        if seen != self.fingerprint:
+            raise CertificateMismatchError(
+                "Certificate {} of {} does not match the pinned {}".format(
+                    seen, self.ip, self.fingerprint))
+
+
+class _SharedReader:
+    """Gives every HTTPResponse of a pipeline the same buffered reader"""
+    def __init__(self, reader):
+        self._reader = reader
+
+    def makefile(self, mode):
+        return self
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+
+class PipelinedTransport(ConnectionPool):
+    """Keep-alive connections that pipeline batches of GETs
+
+    exchange_many writes up to depth GET requests back to back on one
+    connection and then reads the responses in order, saving a round trip
+    per request.  Batches with other methods, whose effects could not be
+    told apart once a connection fails, are sent one by one.
+    """
+    pipelining = True
+
+    def __init__(self, ip, port=None, depth=DEFAULT_PIPELINE_DEPTH,
+                 **kwargs):
+        super().__init__(ip, port, **kwargs)
+        self.depth = depth
+
+    def exchange_many(self, requests, headers=None, timeout=None):
+        if any(meth != "GET" for meth, url, body in requests):
+            return super().exchange_many(requests, headers, timeout)
+        results = []
+        for start in range(0, len(requests), self.depth):
+            results.extend(self._pipeline(requests[start:start + self.depth],
+                                          headers, timeout))
+        return results
+
+    def _pipeline(self, requests, headers, timeout):
+        while True:
+            connection, reused = self.acquire()
+            if not isinstance(connection, http_client.HTTPConnection):
+                # stand-ins from a connection_factory, as in phuey.replay
+                self.release(connection)
+                return Transport.exchange_many(self, requests, headers,
+                                               timeout)
+            self._set_timeout(connection, self.timeout if timeout is None
+                              else timeout)
+            try:
+                return self._send_pipelined(connection, requests, headers,
+                                            timeout)
+            except _STALE_ERRORS:
+                connection.close()
+                if not reused:
+                    raise
+                self.reconnects += 1
+                self.logger.debug("Stale connection to %s, reconnecting",
+                                  self.ip)
+            except Exception:
+                connection.close()
+                raise
+
+    @staticmethod
+    def _encode(connection, meth, url, body, headers):
+        host = connection.host
+        if ":" in host:
+            host = "[{}]".format(host)
+        if connection.port != connection.default_port:
+            host = "{}:{}".format(host, connection.port)
+        lines = ["{} {} HTTP/1.1".format(meth, url), "Host: " + host,
+                 "Accept-Encoding: identity"]
+        lines.extend("{}: {}".format(key, value)
+                     for key, value in (headers or {}).items())
+        if body is not None:
+            lines.append("Content-Length: {}".format(len(body)))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + \
+            (body or b"")
+
+    def _send_pipelined(self, connection, requests, headers, timeout):
+        if connection.sock is None:
+            connection.connect()
+        connection.sock.sendall(b"".join(
+            self._encode(connection, meth, url, body, headers)
+            for meth, url, body in requests))
+        reader = _SharedReader(connection.sock.makefile("rb"))
+        results = []
+        try:
+            for index, (meth, url, body) in enumerate(requests):
+                response = http_client.HTTPResponse(reader, method=meth)
+                response.begin()
+                data = response.read()
+                results.append((response.status, response.reason,
+                                None if response.status >= 400 else data))
+                if response.will_close:
+                    # the bridge dropped the rest, send it again
+                    connection.close()
+                    rest = requests[index + 1:]
+                    if rest:
+                        results.extend(self._pipeline(rest, headers,
+                                                      timeout))
+                    return results
+        finally:
+            reader._reader.close()
+        self.release(connection)
+        return results
+
+
+class PipelinedHTTPSTransport(PipelinedTransport, HTTPSTransport):
+    """Pipelined GETs over pinned HTTPS connections"""
+
+
+class MemoryTransport(Transport):
+    """Answers requests without a network by calling handler
+
+    handler(meth, url, body) returns the (status, body bytes) of the
+    response; FakeBridge.transport builds one around a fake bridge.
+    requests lists every (meth, url, body) exchanged.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+
+    def exchange(self, meth, url, body=None, headers=None, timeout=None):
+        self.requests.append((meth, url, body))
+        status, data = self.handler(meth, url, body)
+        reason = http_client.responses.get(status, "")
+        if status >= 400:
+            return status, reason, None
+        return status, reason, data
+
+    def stats(self):
+        return {"requests": len(self.requests)}
+
+
+TRANSPORTS = {"http": ConnectionPool, "https": HTTPSTransport,
+              "pipelined": PipelinedTransport,
+              "https+pipelined": PipelinedHTTPSTransport}
+
+
+def create_transport(name, ip, **options):
+    """Build the transport called name in TRANSPORTS for the bridge at ip
+
+    "http" without options is the pool shared by all objects of ip.
+    """
+    if name == "http" and not options:
+        return ConnectionPool.for_bridge(ip)
+    try:
+        cls = TRANSPORTS[name]
+    except KeyError:
+        raise ValueError("Unknown transport {}, choose from {}".format(
+            name, ", ".join(TRANSPORTS)))
+    return cls(ip, **options)
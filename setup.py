@@ -11,16 +11,23 @@ setup(name='phuey',
       license='MIT',
       description='A python library to control Philips™ Hue Devices',
       packages=['phuey'],
+      python_requires='>=3.8',
+      extras_require={'numpy': ['numpy'], 'orjson': ['orjson'],
+                      'ujson': ['ujson']},
+      entry_points={'console_scripts': [
+          'phuey-light = phuey.light_cli:main',
+          'phuey-daemon = phuey.daemon:main']},
       classifiers=['Development Status :: 5 - Production/Stable',
                    'Intended Audience :: Developers',
                    'Topic :: Software Development :: Home Automation',
                    'License :: OSI Approved :: MIT License',
-                   'Programming Language :: Python :: 2.7',
                    'Programming Language :: Python :: 3',
-                   'Programming Language :: Python :: 3.2',
-                   'Programming Language :: Python :: 3.3',
-                   'Programming Language :: Python :: 3.4',
-                   'Programming Language :: Python :: 3.5',
+                   'Programming Language :: Python :: 3 :: Only',
+                   'Programming Language :: Python :: 3.8',
+                   'Programming Language :: Python :: 3.9',
+                   'Programming Language :: Python :: 3.10',
+                   'Programming Language :: Python :: 3.11',
+                   'Programming Language :: Python :: 3.12',
                    ],
       keywords = 'development, automation',
       )
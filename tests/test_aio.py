@@ -0,0 +1,145 @@
+'''
+Tests for the asyncio client
+'''
+import asyncio
+import json
+import unittest
+
+import phuey
+from phuey.aio import AsyncBridge, StreamTransport
+
+
+class FakeTransport:
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, meth, url, body=None):
+        self.calls.append((meth, url, body and json.loads(body.decode())))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        status, payload = self.responses(meth, url)
+        return status, "OK", payload.encode()
+
+    async def close(self):
+        pass
+
+
+class AsyncBridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        with open('full_bridge_response.json') as fbr:
+            self.full_bridge_response = fbr.read()
+
+    def respond(self, meth, url):
+        if url == '/api/user':
+            return 200, self.full_bridge_response
+        return 200, '[{"success": {}}]'
+
+    def test_load_seeds_lights(self):
+        transport = FakeTransport(self.respond)
+
+        async def run():
+            bridge = await AsyncBridge('ip', 'user', transport).load()
+            names = await asyncio.gather(*(l.get('name')
+                                           for l in bridge.lights))
+            return bridge, names
+        bridge, names = asyncio.run(run())
+        self.assertEqual(bridge.name, "Huey")
+        self.assertIn("living bloom", names)
+        self.assertEqual(len(transport.calls), 1)
+
+    def test_fan_out_respects_concurrency(self):
+        transport = FakeTransport(self.respond)
+
+        async def run():
+            bridge = AsyncBridge('ip', 'user', transport, concurrency=3)
+            lights = [bridge.light(i) for i in range(20)]
+            await bridge.set_many(dict((l, {"on": True, "bri": 10})
+                                       for l in lights))
+        asyncio.run(run())
+        self.assertEqual(len(transport.calls), 20)
+        self.assertEqual(transport.max_in_flight, 3)
+        self.assertEqual(transport.calls[0][2], {"on": True, "bri": 10})
+
+    def test_bridge_built_outside_the_loop(self):
+        transport = FakeTransport(self.respond)
+        bridge = AsyncBridge('ip', 'user', transport, concurrency=2)
+        self.assertIsNone(bridge._semaphore)
+        asyncio.run(bridge.set_many(dict(
+            (bridge.light(i), {"on": True}) for i in range(4))))
+        self.assertEqual(len(transport.calls), 4)
+        self.assertEqual(transport.max_in_flight, 2)
+
+    def test_bridge_error_raises_attribute_error(self):
+        transport = FakeTransport(
+            lambda m, u: (200, '[{"error": {"description": "bad"}}]'))
+
+        async def run():
+            await AsyncBridge('ip', 'baduser', transport).load()
+        with self.assertRaises(AttributeError):
+            asyncio.run(run())
+
+    def test_bad_status_raises_runtime_error(self):
+        transport = FakeTransport(lambda m, u: (404, ''))
+
+        async def run():
+            await AsyncBridge('ip', 'user', transport).light(1).refresh()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(run())
+
+    def test_busy_bridge_raises_rate_limit_error(self):
+        for status in (429, 503):
+            transport = FakeTransport(lambda m, u: (status, ''))
+
+            async def run():
+                await AsyncBridge('ip', 'user', transport).light(1).refresh()
+            with self.assertRaises(phuey.RateLimitError):
+                asyncio.run(run())
+
+    def test_stream_transport_keep_alive(self):
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header == b"\r\n":
+                        break
+                    if header.lower().startswith(b"content-length"):
+                        length = int(header.split(b":")[1])
+                await reader.readexactly(length)
+                body = b'{"state": {"on": true}}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: " +
+                             str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            transport = StreamTransport('127.0.0.1', port)
+            bridge = AsyncBridge('127.0.0.1', 'user', transport)
+            light = bridge.light(1)
+            first = await light.get('on')
+            light.invalidate()
+            second = await light.get('on')
+            await bridge.close()
+            server.close()
+            await server.wait_closed()
+            return first, second
+        self.assertEqual(asyncio.run(run()), (True, True))
+        self.assertEqual(len(connections), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+'''
+Tests of the on-disk bridge config cache
+'''
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import phuey
+from phuey.cache import ConfigCache, fingerprint
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class ConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.now = 1000.0
+        self.cache = ConfigCache(self.directory, clock=lambda: self.now)
+        self.config = make_config(lights=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.assertEqual(self.cache.lookup("1.2.3.4", "me"), (None, None))
+        self.assertTrue(self.cache.store("1.2.3.4", "me", self.config))
+        self.now += 5
+        config, age = self.cache.lookup("1.2.3.4", "me")
+        self.assertEqual(config, self.config)
+        self.assertEqual(age, 5)
+        self.assertEqual(self.cache.lookup("1.2.3.4", "you"), (None, None))
+        mode = os.stat(self.cache.path("1.2.3.4", "me")).st_mode
+        self.assertEqual(mode & 0o077, 0)
+
+    def test_unchanged_config_is_not_rewritten(self):
+        self.cache.store("1.2.3.4", "me", self.config)
+        self.now += 60
+        self.config['config']['UTC'] = "2016-06-01T00:01:00"
+        self.assertFalse(self.cache.store("1.2.3.4", "me", self.config))
+        self.assertEqual(self.cache.lookup("1.2.3.4", "me")[1], 0)
+        self.config['lights']['1']['state']['on'] = True
+        self.assertTrue(self.cache.store("1.2.3.4", "me", self.config))
+
+    def test_too_stale(self):
+        self.cache.store("1.2.3.4", "me", self.config)
+        self.now += self.cache.max_stale + 1
+        self.assertEqual(self.cache.lookup("1.2.3.4", "me"), (None, None))
+
+    def test_corrupt_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.cache.path("1.2.3.4", "me"), "w") as broken:
+            broken.write("{not json")
+        self.assertEqual(self.cache.lookup("1.2.3.4", "me"), (None, None))
+
+    def test_fingerprint_ignores_clock(self):
+        other = make_config(lights=2)
+        other['config']['localtime'] = "later"
+        self.assertEqual(fingerprint(self.config), fingerprint(other))
+
+
+class CachedBridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ConfigCache(self.directory)
+        self.fake = FakeBridge(make_config(lights=4)).start()
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+        shutil.rmtree(self.directory)
+
+    def test_start_from_cache_and_revalidate(self):
+        phuey.Bridge(self.fake.address, self.fake.user,
+                     config_cache=self.cache)
+        self.assertEqual(self.fake.requests["GET"], 1)
+        self.fake.config['lights']['5'] = dict(self.fake.config['lights']['1'])
+        released = threading.Event()
+        respond = self.fake.respond
+
+        def held_respond(meth, path, body):
+            released.wait(5)
+            return respond(meth, path, body)
+
+        self.fake.respond = held_respond
+        b = phuey.Bridge(self.fake.address, self.fake.user,
+                         config_cache=self.cache)
+        self.assertEqual(len(b), 4)
+        released.set()
+        b.revalidation.join(5)
+        self.assertEqual(self.fake.requests["GET"], 2)
+        self.assertEqual(len(b), 5)
+        config, age = self.cache.lookup(self.fake.address, self.fake.user)
+        self.assertIn('5', config['lights'])
+
+    def test_fresh_cache_skips_the_bridge(self):
+        self.cache.max_age = 60
+        phuey.Bridge(self.fake.address, self.fake.user,
+                     config_cache=self.cache)
+        b = phuey.Bridge(self.fake.address, self.fake.user,
+                         config_cache=self.cache)
+        self.assertIsNone(b.revalidation)
+        self.assertEqual(self.fake.requests["GET"], 1)
+        self.assertEqual(len(b), 4)
+
+    def test_failed_revalidation_keeps_cached_objects(self):
+        phuey.Bridge(self.fake.address, self.fake.user,
+                     config_cache=self.cache)
+        self.fake.error_rate = 1.0
+        b = phuey.Bridge(self.fake.address, self.fake.user,
+                         config_cache=self.cache)
+        b.revalidation.join(5)
+        self.assertEqual(len(b), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+'''
+Tests for the color conversions
+'''
+import unittest
+from unittest import mock
+
+import phuey
+from phuey import color
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class ColorTest(unittest.TestCase):
+
+    def test_rgb_to_xy(self):
+        points, bri = color.rgb_to_xy([(255, 255, 255), (0, 0, 0),
+                                       (255, 0, 0)])
+        self.assertAlmostEqual(points[0][0], 0.3227, places=2)
+        self.assertAlmostEqual(points[0][1], 0.329, places=2)
+        self.assertEqual(tuple(points[1]), color.WHITE_POINT)
+        self.assertEqual((bri[0], bri[1]), (254, 0))
+        self.assertGreater(points[2][0], 0.65)
+
+    def test_gamut_clamping(self):
+        gamut = color.gamut_for_model("LCT001")
+        self.assertIs(gamut, color.GAMUT_B)
+        points, _ = color.rgb_to_xy([(0, 255, 0), (255, 200, 150)], gamut)
+        self.assertEqual(color.clamp_xy(tuple(points[0]), gamut),
+                         tuple(points[0]))
+        self.assertAlmostEqual(points[0][0], 0.409, places=2)
+        self.assertEqual(color.clamp_xy((0.4, 0.4), gamut), (0.4, 0.4))
+        self.assertIsNone(color.gamut_for_model("LWB004"))
+
+    def test_kelvin_and_hsv(self):
+        self.assertEqual(list(color.kelvin_to_ct([2700, 6500, 1000])),
+                         [370, 154, 500])
+        self.assertEqual(color.hsv_to_hue_sat([(180, 1, 0.5)]),
+                         [{"hue": 32768, "sat": 254, "bri": 127}])
+
+    def test_round_trip(self):
+        points, bri = color.rgb_to_xy([(255, 128, 0)])
+        r, g, b = color.xy_to_rgb(points, bri)[0]
+        self.assertEqual(r, 255)
+        self.assertTrue(abs(g - 128) < 10 and b < 10)
+
+    @unittest.skipIf(color.numpy is None, "NumPy is not installed")
+    def test_numpy_matches_plain_python(self):
+        points = [(0.7, 0.29), (0.3227, 0.329), (0.17, 0.7), (0.4, 0.0),
+                  (0.153, 0.048)]
+        levels = [254, 128, 1, 200, 60]
+        cts = [153, 370, 500]
+        fast = (color.xy_to_rgb(points, levels),
+                color.xy_to_rgb(points[:2]), list(color.ct_to_kelvin(cts)))
+        with mock.patch.object(color, 'numpy', None):
+            slow = (color.xy_to_rgb(points, levels),
+                    color.xy_to_rgb(points[:2]), color.ct_to_kelvin(cts))
+        self.assertEqual(fast, slow)
+
+    def test_rgb_states_per_model(self):
+        states = color.rgb_states(["LCT001", "LLC011", "LCT015"],
+                                   [(0, 255, 0)] * 3)
+        self.assertEqual(len(set(tuple(s["xy"]) for s in states)), 3)
+        white = color.rgb_states(["LCT001", "LWB004"], [(255, 0, 0)] * 2)
+        self.assertEqual(white[1], {"bri": white[0]["bri"]})
+
+    def test_narrowest_gamut(self):
+        self.assertIs(color.narrowest_gamut(["LCT015", "LCT001", "LWB004"]),
+                      color.GAMUT_B)
+        self.assertIs(color.narrowest_gamut(["LCT015"]), color.GAMUT_C)
+        self.assertIsNone(color.narrowest_gamut(["LWB004"]))
+
+
+class LightColorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=2)).start()
+        self.bridge = phuey.Bridge(self.fake.address, self.fake.user,
+                                   rate_limit=False)
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_light_rgb_and_kelvin(self):
+        light = self.bridge.lights[0]
+        light.rgb = (0, 255, 0)
+        state = self.fake.config['lights']['1']['state']
+        self.assertEqual(state['xy'], [0.409, 0.518])
+        light.kelvin = 2700
+        self.assertEqual(state['ct'], 370)
+        self.assertEqual(light.kelvin, 2703)
+        self.assertEqual(light.rgb[1], max(light.rgb))
+
+    def test_group_rgb_in_batch(self):
+        group = self.bridge.groups[0]
+        with group.batch():
+            group.on = True
+            group.rgb = (255, 0, 0)
+        self.assertEqual(self.fake.requests["PUT"], 1)
+        self.assertTrue(self.fake.config['groups']['1']['action']['on'])
+
+    def test_white_light_has_no_color(self):
+        light = self.bridge.lights[1]
+        self.assertIsNone(light.gamut)
+        self.assertIsNone(light.rgb)
+        self.assertIsNone(light.kelvin)
+        light.rgb = (128, 128, 128)
+        state = self.fake.config['lights']['2']['state']
+        self.assertNotIn('xy', state)
+        self.assertEqual(state['bri'], 55)
+
+    def test_group_rgb_clamped_to_members(self):
+        self.fake.config['lights']['2']['modelid'] = "LCT015"
+        self.bridge.refresh()
+        reads = self.fake.requests["GET"]
+        group = self.bridge.groups[0]
+        self.assertIs(group.gamut, color.GAMUT_B)
+        with group.batch():
+            group.rgb = (255, 0, 0)
+        group.rgb = (255, 0, 0)
+        expected = color.rgb_states(["LCT001"], [(255, 0, 0)])[0]
+        self.assertEqual(self.fake.config['groups']['1']['action']['xy'],
+                         expected['xy'])
+        self.assertEqual(self.fake.requests["GET"], reads)
+
+    def test_standalone_group_reads_models_once(self):
+        self.fake.config['lights']['2']['modelid'] = "LCT015"
+        group = phuey.Group(self.fake.address, self.fake.user, 1)
+        reads = self.fake.requests["GET"]
+        for _ in range(3):
+            group.rgb = (255, 0, 0)
+        self.assertIs(group.gamut, color.GAMUT_B)
+        self.assertEqual(self.fake.requests["GET"], reads + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
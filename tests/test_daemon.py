@@ -0,0 +1,95 @@
+'''
+Tests of the local command daemon and its client
+'''
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+import phuey
+from phuey import light_cli
+from phuey.daemon import CommandDaemon, DaemonClient
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=4, groups=1)).start()
+        self.bridge = phuey.Bridge(self.fake.address, self.fake.user,
+                                   cache_ttl=60)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "phuey.sock")
+        self.daemon = CommandDaemon(self.bridge, self.path).start()
+
+    def tearDown(self):
+        self.daemon.stop()
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+        shutil.rmtree(self.directory)
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o077, 0)
+
+    def test_reads_come_from_the_cache(self):
+        with DaemonClient(self.path) as client:
+            self.assertEqual(client.get("light", 1, "bri"), 254)
+            self.assertEqual(client.get("light", 2)["name"], "light 2")
+            self.assertEqual(client.list(), {"1": "light 1", "2": "light 2",
+                                             "3": "light 3", "4": "light 4"})
+        self.assertEqual(self.fake.requests["GET"], 1)
+
+    def test_set(self):
+        with DaemonClient(self.path) as client:
+            state = client.set("light", 3, on=True, bri=12)
+            self.assertEqual((state["on"], state["bri"]), (True, 12))
+            client.set("group", 1, alert="select")
+        self.assertEqual(self.fake.config['lights']['3']['state']['bri'], 12)
+        self.assertEqual(self.fake.requests["PUT"], 2)
+
+    def test_errors(self):
+        with DaemonClient(self.path) as client:
+            with self.assertRaises(RuntimeError):
+                client.get("light", 99)
+            with self.assertRaises(RuntimeError):
+                client.get("light", 1, "_ctx")
+            with self.assertRaises(RuntimeError):
+                client.request("explode")
+            self.assertEqual(client.stats()["errors"], 3)
+
+    def test_many_clients_share_the_scheduler(self):
+        def writer(light_id):
+            with DaemonClient(self.path) as client:
+                client.set("light", light_id, on=True)
+        threads = [threading.Thread(target=writer, args=(i,))
+                   for i in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with DaemonClient(self.path) as client:
+            stats = client.stats()
+        self.assertEqual(stats["scheduler"]["submitted"], 4)
+        self.assertEqual(stats["requests"]["set"], 4)
+
+    def test_second_daemon_refused(self):
+        with self.assertRaises(RuntimeError):
+            CommandDaemon(self.bridge, self.path).start()
+
+    def test_cli_through_daemon(self):
+        code = light_cli.main(['--socket', self.path, '-l', '1', '-l', '2',
+                               '-c', 'bri=33'])
+        self.assertEqual(code, 0)
+        self.assertEqual(self.fake.config['lights']['2']['state']['bri'], 33)
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            code = light_cli.main(['--socket', self.path + ".missing",
+                                   '-l', '1', '-c', 'on=true'])
+        self.assertEqual(code, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+'''
+Tests for precomputed effects
+'''
+import time
+import unittest
+
+import phuey
+from phuey.effects import EffectEngine, Timeline
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class EffectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=4, groups=1)).start()
+        self.bridge = phuey.Bridge(self.fake.address, self.fake.user,
+                                   rate_limit=False)
+        self.clock = FakeClock()
+        self.engine = EffectEngine(self.bridge, clock=self.clock,
+                                   sleep=self.clock.sleep)
+        for bucket in self.engine.buckets.values():
+            bucket.rate = 1e6
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_fade_folds_into_group(self):
+        timeline = Timeline.fade(self.bridge.lights, 2, 2, 0, 254)
+        self.assertEqual(len(timeline), 4)
+        self.assertEqual([v[2] for v in timeline.frame(3)], [254] * 4)
+        report = self.engine.play(timeline, groups=self.bridge.groups)
+        self.assertEqual((report.played, report.group_commands,
+                          report.light_commands), (4, 4, 0))
+        action = self.fake.config['groups']['1']['action']
+        self.assertEqual((action['bri'], action['transitiontime']), (254, 5))
+        self.assertNotIn('xy', action)
+
+    def test_play_sends_no_reads(self):
+        bridge = phuey.Bridge(self.fake.address, self.fake.user,
+                              rate_limit=False, cache_ttl=0.01)
+        engine = EffectEngine(bridge, clock=self.clock,
+                              sleep=self.clock.sleep)
+        for bucket in engine.buckets.values():
+            bucket.rate = 1e6
+        time.sleep(0.05)
+        reads = self.fake.requests["GET"]
+        timeline = Timeline.fade(bridge.lights, 2, 2, 0, 254)
+        report = engine.play(timeline, groups=bridge.groups)
+        self.assertEqual(report.group_commands, 4)
+        self.assertEqual(self.fake.requests["GET"], reads)
+
+    def test_color_loop_sends_each_light(self):
+        timeline = Timeline.color_loop(self.bridge.lights, 1, 4)
+        first = timeline.frame(0)
+        self.assertEqual(len(set(first)), 4)
+        report = self.engine.play(timeline, groups=self.bridge.groups)
+        self.assertEqual((report.group_commands, report.light_commands),
+                         (0, 16))
+        x, y = self.fake.config['lights']['1']['state']['xy']
+        self.assertAlmostEqual(x, timeline.frame(3)[0][0])
+
+    def test_budget_and_dropped_frames(self):
+        self.engine.buckets['lights'].rate = 1e-9
+        self.engine.buckets['lights'].capacity = 2
+        self.engine.buckets['lights'].tokens = 2
+        timeline = Timeline.color_loop(self.bridge.lights, 1, 4)
+        real_frame = timeline.frame
+
+        def slow_frame(index):
+            if index == 1:
+                self.clock.now += 1
+            return real_frame(index)
+        timeline.frame = slow_frame
+        report = self.engine.play(timeline)
+        self.assertEqual(report.light_commands, 2)
+        self.assertEqual(report.dropped, 2)
+        self.assertEqual(report.played, 2)
+        self.assertEqual(report.skipped_commands, 6)
+
+    def test_unchanged_frames_send_nothing(self):
+        timeline = Timeline.from_function(self.bridge.lights[:2], 1, 4,
+                                          lambda t, i: (0.3, 0.3, 100))
+        report = self.engine.play(timeline)
+        self.assertEqual(report.light_commands, 2)
+        self.assertEqual(self.fake.requests["PUT"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
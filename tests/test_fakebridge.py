@@ -0,0 +1,172 @@
+'''
+End to end tests of phuey against the bundled fake bridge
+'''
+import threading
+import time
+import unittest
+
+import phuey
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class FakeBridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=6, groups=2)).start()
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_bridge_inventory(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user)
+        self.assertEqual(len(b), 6)
+        self.assertEqual(len(b.groups), 2)
+        self.assertEqual(b.name, "Fake bridge")
+        self.assertEqual(self.fake.requests["GET"], 1)
+
+    def test_light_round_trip(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user, cache_ttl=0)
+        light = b.lights[0]
+        with light.batch():
+            light.on = True
+            light.bri = 10
+        self.assertEqual((light.on, light.bri), (True, 10))
+        self.assertEqual(self.fake.requests["PUT"], 1)
+        self.assertTrue(self.fake.config['lights']['1']['state']['on'])
+
+    def test_group_action_updates_members(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user, cache_ttl=0)
+        group = b.groups[0]
+        group.on = True
+        members = self.fake.config['groups'][group.group_id]['lights']
+        self.assertTrue(all(self.fake.config['lights'][m]['state']['on']
+                            for m in members))
+
+    def test_batch_folding_sends_no_reads(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user,
+                         rate_limit=False, cache_ttl=0.01)
+        time.sleep(0.05)
+        with phuey.Batch(b.lights[0], b.lights[1], groups=b.groups) as batch:
+            b.lights[0].on = True
+            b.lights[1].on = True
+        self.assertEqual(batch.requests, 2)
+        self.assertEqual(self.fake.requests["GET"], 1)
+        self.assertEqual(self.fake.requests["PUT"], 2)
+
+    def test_batch_folds_per_bridge(self):
+        other = FakeBridge(make_config(lights=6, groups=2)).start()
+        self.addCleanup(other.stop)
+        a = phuey.Bridge(self.fake.address, self.fake.user, rate_limit=False)
+        b = phuey.Bridge(other.address, other.user, rate_limit=False)
+        lights = [a.light(2), a.light(4), a.light(6),
+                  b.light(2), b.light(4), b.light(6)]
+        with phuey.Batch(*lights, groups=a.groups) as batch:
+            for light in lights:
+                light.on = True
+        self.assertEqual(batch.requests, 4)
+        self.assertEqual(self.fake.requests["PUT"], 1)
+        self.assertEqual(other.requests["PUT"], 3)
+        for light_id in ('2', '4', '6'):
+            self.assertTrue(other.config['lights'][light_id]['state']['on'])
+
+    def test_find(self):
+        self.fake.config['lights']['3']['state']['reachable'] = False
+        self.fake.config['groups']['1']['name'] = "Kitchen"
+        b = phuey.Bridge(self.fake.address, self.fake.user)
+        ids = lambda items: [str(item.light_id) for item in items]
+        self.assertEqual(ids(b.find(model="LCT001")), ['1', '3', '5'])
+        self.assertEqual(ids(b.find(room="Kitchen")), ['1', '3', '5'])
+        self.assertEqual(ids(b.find(model="LCT001", room="Kitchen",
+                                    reachable=True)), ['1', '5'])
+        self.assertEqual(ids(b.find(reachable=False)), ['3'])
+        self.assertEqual(ids(b.find(group=2, name="light 4")), ['4'])
+        self.assertEqual(b.find(name="nope"), [])
+        self.assertEqual(b.find('groups', name="Kitchen"), [b.group(1)])
+        self.assertIs(b.light(2), b.lights[1])
+        self.assertEqual(len(b.find('sensors', model="SML001",
+                                    reachable=True)), 1)
+        with self.assertRaises(ValueError):
+            b.find('groups', room="Kitchen")
+        self.assertEqual(self.fake.requests["GET"], 1)
+
+    def test_indexes_follow_refresh(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user)
+        self.fake.config['lights']['2']['name'] = "desk"
+        self.fake.config['lights']['2']['state']['reachable'] = False
+        b.refresh()
+        self.assertEqual(b.find(name="desk"), [b.light(2)])
+        self.assertEqual(b.find(name="light 2"), [])
+        self.assertEqual(b.find(reachable=False), [b.light(2)])
+
+    def test_merged_writes_update_every_cache(self):
+        first = phuey.Light(self.fake.address, self.fake.user, 1)
+        second = phuey.Light(self.fake.address, self.fake.user, 1)
+        first.refresh()
+        second.refresh()
+        first.scheduler.buckets['lights'].rate = 2
+        first.on = True
+        threads = [threading.Thread(target=setattr, args=(first, 'bri', 10)),
+                   threading.Thread(target=setattr,
+                                    args=(second, 'on', False))]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(first.scheduler.stats()['coalesced'], 1)
+        self.assertEqual(self.fake.requests["PUT"], 2)
+        state = self.fake.config['lights']['1']['state']
+        for light in (first, second):
+            cached = light._cache['state']
+            self.assertEqual((cached['on'], cached['bri']),
+                             (state['on'], state['bri']))
+        self.assertEqual((state['on'], state['bri']), (False, 10))
+
+    def test_indexes_follow_writes(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user)
+        light = b.light(2)
+        light.name = "kitchen"
+        self.assertEqual(b.find(name="kitchen"), [light])
+        self.assertEqual(b.find(name="light 2"), [])
+        self.fake.config['lights']['2']['state']['reachable'] = False
+        light.refresh()
+        self.assertEqual(b.find(reachable=False), [light])
+        self.assertEqual(self.fake.requests["GET"], 2)
+
+    def test_unknown_user(self):
+        with self.assertRaises(AttributeError):
+            phuey.Bridge(self.fake.address, 'nobody')
+
+    def test_injected_errors(self):
+        self.fake.error_rate = 1.0
+        with self.assertRaises(phuey.RateLimitError):
+            phuey.Light(self.fake.address, self.fake.user, 1).refresh()
+
+    def test_rate_limit(self):
+        self.fake.rate_limit = True
+        lights = [phuey.Light(self.fake.address, self.fake.user, i)
+                  for i in range(1, 7)]
+        lights[0].scheduler.buckets['lights'].rate = 1000
+        lights[0]._ctx.retry = phuey.RetryPolicy(attempts=1)
+        with self.assertRaises(phuey.RateLimitError):
+            for _ in range(3):
+                for light in lights:
+                    light.on = True
+        self.assertEqual(self.fake.rejected, 1)
+
+    def test_rate_limited_writes_are_retried(self):
+        self.fake.rate_limit = True
+        lights = [phuey.Light(self.fake.address, self.fake.user, i)
+                  for i in range(1, 7)]
+        lights[0].scheduler.buckets['lights'].rate = 1000
+        lights[0]._ctx.retry = phuey.RetryPolicy(attempts=20, backoff=0.05,
+                                                 max_backoff=0.2)
+        for light in lights * 2:
+            light.on = True
+        self.assertGreater(self.fake.rejected, 0)
+        self.assertEqual(lights[0]._ctx.breaker.retries, self.fake.rejected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+'''
+Tests for loading several bridges as one fleet
+'''
+import time
+import unittest
+
+import phuey
+from phuey.fleet import BridgeFleet
+from phuey.transport import MemoryTransport
+
+
+class BridgeFleetTest(unittest.TestCase):
+
+    def setUp(self):
+        with open('full_bridge_response.json') as fbr:
+            self.full_bridge_response = bytes(fbr.read(), 'utf-8')
+
+    def tearDown(self):
+        phuey.BridgeContext.reset_all()
+
+    def respond(self, meth, url, body):
+        return 200, self.full_bridge_response
+
+    def refuse(self, meth, url, body):
+        raise ConnectionRefusedError
+
+    def respond_slowly(self, meth, url, body):
+        time.sleep(0.2)
+        return self.respond(meth, url, body)
+
+    def fleet(self, bridges):
+        transports = {}
+        for ip, user in bridges:
+            if ip == 'down':
+                handler = self.refuse
+            elif ip.startswith('slow'):
+                handler = self.respond_slowly
+            else:
+                handler = self.respond
+            transports[ip] = MemoryTransport(handler)
+        return BridgeFleet(bridges, transports=transports)
+
+    def test_failing_bridge_does_not_block_others(self):
+        fleet = self.fleet([('a', 'user'), ('down', 'user'), ('b', 'user')])
+        self.assertEqual(sorted(b.ip for b in fleet), ['a', 'b'])
+        self.assertIsInstance(fleet.errors['down'], ConnectionRefusedError)
+
+    def test_bridges_load_in_parallel(self):
+        start = time.monotonic()
+        fleet = self.fleet([('slow{}'.format(i), 'user') for i in range(6)])
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(len(fleet), 6)
+
+    def test_lookups_span_bridges(self):
+        fleet = self.fleet([('a', 'user'), ('b', 'user')])
+        bloom = fleet.lights_named("living bloom")
+        self.assertEqual(sorted(l.ip for l in bloom), ['a', 'b'])
+        self.assertEqual(len(fleet.lights_by_model("LLC011")), 4)
+        self.assertEqual(fleet.light('b', 17).ip, 'b')
+        self.assertEqual(fleet.groups_named("bathroom")[0].group_id, "1")
+        self.assertEqual(len(fleet.sensors_by_model("PHDL00")), 2)
+        with self.assertRaises(KeyError):
+            fleet.light('c', 17)
+
+    def test_transports_per_bridge(self):
+        fleet = self.fleet([('a', 'user'), ('b', 'user')])
+        self.assertIs(fleet.bridges['a'].transport, fleet.transports['a'])
+        self.assertEqual(fleet.transports['b'].requests,
+                         [("GET", "/api/user", None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
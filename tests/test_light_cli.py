@@ -0,0 +1,58 @@
+'''
+Tests of the light command line entry point
+'''
+import io
+import unittest
+from contextlib import redirect_stderr
+
+import phuey
+from phuey import light_cli
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class LightCliTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=3)).start()
+        self.base = ['-b', self.fake.address, '-u', self.fake.user]
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def state(self, light_id):
+        return self.fake.config['lights'][str(light_id)]['state']
+
+    def test_command_interpreter(self):
+        self.assertEqual(light_cli.command_interpreter("on=true,bri=10,"
+                                                      "alert=select"),
+                         {"on": True, "bri": 10, "alert": "select"})
+
+    def test_pairs(self):
+        code = light_cli.main(self.base + ['-l', '1', '-c', 'bri=5',
+                                           '-l', '2', '-c', 'on=true'])
+        self.assertEqual(code, 0)
+        self.assertEqual(self.state(1)['bri'], 5)
+        self.assertTrue(self.state(2)['on'])
+        self.assertEqual(self.fake.requests["PUT"], 2)
+
+    def test_one_command_for_all(self):
+        light_cli.main(self.base + ['-l', '1', '-l', '3', '-c', 'bri=9'])
+        self.assertEqual([self.state(i)['bri'] for i in (1, 2, 3)],
+                         [9, 254, 9])
+
+    def test_mismatched_pairs(self):
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            light_cli.main(self.base + ['-l', '1', '-l', '2', '-l', '3',
+                                        '-c', 'on=true', '-c', 'on=false'])
+
+    def test_failure_exit_code(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            code = light_cli.main(self.base + ['-l', '42', '-c', 'on=true'])
+        self.assertEqual(code, 1)
+        self.assertIn("light 42", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
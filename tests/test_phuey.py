@@ -5,11 +5,15 @@ Created on Jan 31, 2016
 '''
 import unittest
 import logging
+import socket
 import sys
 import phuey
 # import json
 
-from unittest.mock import patch
+import threading
+import time
+
+from unittest.mock import create_autospec
 
 __updated__ = "2016-06-01"
 
@@ -28,14 +32,20 @@ class PhueyTest(unittest.TestCase):
     def setUp(self):
         self.ip = 'ip'
         self.user = 'user'
-        self.patcher = patch('phuey.http_client.HTTPConnection', autospec=True)
-        inst = self.patcher.start()
-        self.mock = inst.return_value.getresponse
+        # scripted connections for the bridge's pool, nothing is patched
+        self.connection_cls = create_autospec(phuey.http_client.HTTPConnection)
+        self.use_fake_connections(self.ip)
+        self.mock = self.connection_cls.return_value.getresponse
         with open('full_bridge_response.json') as fbr:
             self.full_bridge_response = bytes(fbr.read(), 'utf-8')
 
+    def use_fake_connections(self, ip):
+        phuey.ConnectionPool.for_bridge(ip).connection_factory = self.connection_cls
+
     def tearDown(self):
-        self.patcher.stop()
+        phuey.BridgeContext.reset_all()
+        phuey.instrumentation.disable()
+        phuey.instrumentation.reset()
 
     def test_use_existing_group_without_id_in_use(self):
         """initialize a group using an id not in use"""
@@ -79,6 +89,7 @@ class PhueyTest(unittest.TestCase):
     def test_create_bridge_with_bad_ip(self):
         """Create a new bridge that fails without the proper address"""
         self.mock.side_effect = ConnectionRefusedError
+        self.use_fake_connections('existing_ip_on_subnet_but_not_bridge_ip')
         with self.assertRaises(ConnectionRefusedError) as ae:
             phuey.Bridge('existing_ip_on_subnet_but_not_bridge_ip', self.user)
         self.mock.assert_any_call()
@@ -103,8 +114,8 @@ class PhueyTest(unittest.TestCase):
         with self.assertRaises(AttributeError):
             phuey.Group(self.ip, self.user, attributes=attrs)
 
-        self.mock.assert_any_call()
-
+        self.mock.assert_any_call()
+
     def test_bad_request(self):
         self.mock.return_value.status = 666
         self.mock.return_value.read = None
@@ -133,6 +144,14 @@ class PhueyTest(unittest.TestCase):
         l.name = "Bedroom Light"
         self.mock.assert_any_call()
 
+    def test_light_identity_includes_bridge(self):
+        a = phuey.Light(self.ip, self.user, 1)
+        self.assertEqual(a, phuey.Light(self.ip, self.user, 1))
+        self.assertNotEqual(a, phuey.Light('10.0.0.2', self.user, 1))
+        self.assertNotEqual(a, phuey.Light(self.ip, 'other', 1))
+        self.assertEqual(len({a, phuey.Light(self.ip, self.user, 1),
+                              phuey.Light('10.0.0.2', self.user, 1)}), 2)
+
     def test_change_light_state(self):
         self.mock.return_value.status = 200
         self.mock.return_value.read.return_value = bytes('[{"success": {"/lights/17/state/sat": 254}}]', 'utf-8')
@@ -140,5 +159,282 @@ class PhueyTest(unittest.TestCase):
         l.state = {"sat": 254}
         self.mock.assert_any_call()
 
+    def test_connection_reused_between_objects(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.will_close = False
+        self.mock.return_value.read.return_value = bytes('[{"success": {"/lights/17/state/on": true}}]', 'utf-8')
+        phuey.Light(self.ip, self.user, 17).on = True
+        phuey.Light(self.ip, self.user, 18).on = True
+        self.assertEqual(self.connection_cls.call_count, 1)
+        stats = phuey.ConnectionPool.for_bridge(self.ip).stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_stale_connection_reconnects(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.will_close = False
+        self.mock.return_value.read.return_value = bytes('[{"success": {"/lights/17/state/on": true}}]', 'utf-8')
+        l = phuey.Light(self.ip, self.user, 17)
+        l.on = True
+        self.mock.side_effect = [ConnectionResetError, self.mock.return_value]
+        l.on = False
+        self.assertEqual(self.connection_cls.call_count, 2)
+        self.assertEqual(phuey.ConnectionPool.for_bridge(self.ip).reconnects, 1)
+
+    def test_pool_size_is_configurable(self):
+        pool = phuey.ConnectionPool.for_bridge(self.ip, maxsize=1)
+        pool.release(self.connection_cls(self.ip))
+        pool.release(self.connection_cls(self.ip))
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_light_attributes_read_from_one_snapshot(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('{"state": {"on": true, "bri": 200, "hue": 1000}, "name": "desk", "modelid": "LCT001"}', 'utf-8')
+        l = phuey.Light(self.ip, self.user, 17)
+        self.assertEqual((l.on, l.bri, l.hue, l.name), (True, 200, 1000, "desk"))
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_light_cache_updated_by_set(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('{"state": {"on": true, "bri": 200}, "name": "desk"}', 'utf-8')
+        l = phuey.Light(self.ip, self.user, 17)
+        l.cache_ttl = None
+        l.refresh()
+        self.mock.return_value.read.return_value = bytes('[{"success": {"/lights/17/state/bri": 10}}]', 'utf-8')
+        l.bri = 10
+        l.name = "lamp"
+        self.assertEqual((l.bri, l.name), (10, "lamp"))
+        self.assertEqual(self.mock.call_count, 3)
+
+    def test_light_invalidate_forces_get(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('{"state": {"on": true}, "name": "desk"}', 'utf-8')
+        l = phuey.Light(self.ip, self.user, 17)
+        l.cache_ttl = None
+        self.assertTrue(l.on)
+        l.invalidate()
+        self.assertTrue(l.on)
+        self.assertEqual(self.mock.call_count, 2)
+
+    def test_group_reads_action(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('{"name": "bathroom", "lights": ["18"], "action": {"on": false, "bri": 254}}', 'utf-8')
+        g = phuey.Group(self.ip, self.user, 1)
+        self.assertEqual((g.on, g.bri), (False, 254))
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_bridge_children_hydrated_from_config(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = self.full_bridge_response
+        b = phuey.Bridge(self.ip, self.user, cache_ttl=None)
+        names = [light.name for light in b.lights]
+        self.assertIn("living bloom", names)
+        self.assertEqual({l.modelid for l in b.lights if l.light_id == 17}, {"LLC011"})
+        self.assertEqual(b.groups[0].bri, 254)
+        self.assertEqual(b.sensors[0]['name'], "Daylight")
+        self.assertIsNone(b.sensors[0]['daylight'])
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_light_batch_sends_one_put(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('[{"success": {"/lights/17/state/on": true}}]', 'utf-8')
+        l = phuey.Light(self.ip, self.user, 17)
+        with l.batch():
+            l.on = True
+            l.bri = 200
+            l.hue = 1000
+        self.assertEqual(self.mock.call_count, 1)
+        connection = self.connection_cls.return_value
+        args = connection.request.call_args[0]
+        self.assertEqual(args[1], '/api/user/lights/17/state')
+        self.assertEqual(phuey.json.loads(args[2].decode()),
+                         {"on": True, "bri": 200, "hue": 1000})
+
+    def test_batch_discarded_on_error(self):
+        l = phuey.Light(self.ip, self.user, 17)
+        with self.assertRaises(ValueError):
+            with l.batch():
+                l.on = True
+                raise ValueError
+        self.assertEqual(self.mock.call_count, 0)
+
+    def test_batch_folds_lights_into_group(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = self.full_bridge_response
+        b = phuey.Bridge(self.ip, self.user)
+        self.mock.return_value.read.return_value = bytes('[{"success": {}}]', 'utf-8')
+        bathroom = [l for l in b.lights if l.light_id in (18, 19, 24)]
+        others = [l for l in b.lights if l.light_id in (17, 20)]
+        with phuey.Batch(*(bathroom + others), groups=b.groups) as batch:
+            for light in bathroom + others:
+                light.on = True
+                light.bri = 100
+        self.assertEqual(batch.requests, 3)
+        urls = [c[0][1] for c in self.connection_cls.return_value.request.call_args_list[1:]]
+        self.assertIn('/api/user/groups/1/action', urls)
+        self.assertNotIn('/api/user/lights/18/state', urls)
+
+    def test_scheduler_paces_group_writes(self):
+        scheduler = phuey.WriteScheduler(self.ip, group_rate=20)
+        sent = []
+        send = lambda url, payload, meth: sent.append(time.monotonic())
+        for i in range(3):
+            scheduler.submit(send, '/api/user/groups/{}/action'.format(i), {"on": True})
+        self.assertGreaterEqual(sent[-1] - sent[0], 0.09)
+        self.assertEqual(scheduler.stats()['sent'], 3)
+
+    def test_scheduler_coalesces_and_prioritises(self):
+        scheduler = phuey.WriteScheduler(self.ip, group_rate=10)
+        sent = []
+        send = lambda url, payload, meth: sent.append((url, payload))
+        scheduler.submit(send, '/api/user/groups/0/action', {"on": True})
+        threads = [threading.Thread(target=scheduler.submit, args=args)
+                   for args in [(send, '/api/user/groups/1/action', {"on": True}, phuey.BULK),
+                                (send, '/api/user/groups/1/action', {"bri": 5}, phuey.BULK),
+                                (send, '/api/user/groups/2/action', {"on": False})]]
+        for t in threads:
+            t.start()
+            time.sleep(0.01)
+        for t in threads:
+            t.join()
+        self.assertEqual(sent[1:], [('/api/user/groups/2/action', {"on": False}),
+                                    ('/api/user/groups/1/action', {"on": True, "bri": 5})])
+        stats = scheduler.stats()
+        self.assertEqual((stats['submitted'], stats['coalesced'], stats['sent']), (4, 1, 3))
+        self.assertGreater(stats['wait_max'], 0)
+
+    def test_busy_bridge_raises_rate_limit_error(self):
+        self.mock.return_value.status = 503
+        l = phuey.Light(self.ip, self.user, 17)
+        with self.assertRaises(phuey.RateLimitError):
+            l.on = True
+
+    def test_transient_errors_are_retried(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('[{"success": {"/lights/17/state/on": true}}]', 'utf-8')
+        l = phuey.Light(self.ip, self.user, 17)
+        l._ctx.retry = phuey.RetryPolicy(backoff=0)
+        self.mock.side_effect = [socket.timeout, self.mock.return_value]
+        l.on = True
+        self.assertEqual(self.mock.call_count, 2)
+        self.assertEqual(l._ctx.breaker.stats()['retries'], 1)
+        self.assertIn('phuey_retries_total{bridge="ip"} 1',
+                      phuey.instrumentation.to_prometheus())
+
+    def test_post_is_not_retried(self):
+        self.mock.side_effect = socket.timeout
+        with self.assertRaises(RuntimeError):
+            phuey.Group(self.ip, self.user, attributes={"lights": ["1"]})
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_deadline_stops_retries(self):
+        self.mock.side_effect = socket.timeout
+        l = phuey.Light(self.ip, self.user, 17)
+        l._ctx.retry = phuey.RetryPolicy(attempts=10, backoff=10,
+                                         deadline=0.05, seed=1)
+        start = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            l.refresh()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.mock.call_count, 1)
+
+    def test_circuit_breaker_fails_fast(self):
+        self.mock.side_effect = socket.timeout
+        l = phuey.Light(self.ip, self.user, 17)
+        l._ctx.retry = phuey.RetryPolicy(attempts=1)
+        breaker = l._ctx.breaker
+        now = [100.0]
+        breaker.clock = lambda: now[0]
+        for _ in range(phuey.BREAKER_THRESHOLD):
+            with self.assertRaises(RuntimeError):
+                l.refresh()
+        with self.assertRaises(phuey.BridgeUnavailableError):
+            l.refresh()
+        self.assertEqual(self.mock.call_count, phuey.BREAKER_THRESHOLD)
+        self.assertEqual(breaker.stats()['state'], breaker.OPEN)
+        now[0] += phuey.BREAKER_RESET_TIMEOUT
+        self.mock.side_effect = None
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('{"state": {"on": true}}', 'utf-8')
+        self.assertTrue(l.on)
+        stats = breaker.stats()
+        self.assertEqual((stats['state'], stats['trips'], stats['rejected']),
+                         (breaker.CLOSED, 1, 1))
+
+    def test_watch_yields_changed_fields(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = self.full_bridge_response
+        b = phuey.Bridge(self.ip, self.user)
+        light = [l for l in b.lights if l.light_id == 17][0]
+        config = phuey.json.loads(self.full_bridge_response.decode())
+        config['lights']['17']['state']['on'] = True
+        config['lights']['17']['name'] = "bloom"
+        config['sensors']['2'] = {"state": {"presence": True}, "name": "motion"}
+        del config['lights']['18']
+        self.mock.return_value.read.return_value = bytes(phuey.json.dumps(config), 'utf-8')
+        events = []
+        for change in b.watch(interval=0):
+            events.append(change)
+            if len(events) == 4:
+                break
+        fields = set((c.kind, c.item_id, c.field) for c in events)
+        self.assertEqual(fields, {('lights', '17', 'state.on'), ('lights', '17', 'name'),
+                                  ('lights', '18', None), ('sensors', '2', None)})
+        on = [c for c in events if c.field == 'state.on'][0]
+        self.assertEqual((on.old, on.new), (False, True))
+        self.assertIs(on.item, light)
+        self.assertTrue(light.on)
+        self.assertNotIn(18, [l.light_id for l in b.lights])
+        self.assertEqual(b.sensors[-1]['presence'], True)
+
+    def test_handles_are_slotted_and_share_context(self):
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = self.full_bridge_response
+        b = phuey.Bridge(self.ip, self.user, cache_ttl=30)
+        self.assertFalse(hasattr(b.lights[0], '__dict__'))
+        self.assertIs(b.lights[0]._ctx, b.groups[0]._ctx)
+        self.assertEqual(b.lights[0].cache_ttl, 30)
+        self.assertEqual(b.groups[0].state_uri, '/api/user/groups/1/action')
+        l = phuey.Light(self.ip, self.user, 3)
+        self.assertIs(l._ctx, phuey.Light(self.ip, self.user, 4)._ctx)
+        self.assertEqual(l.cache_ttl, phuey.DEFAULT_CACHE_TTL)
+
+    def test_instrumentation_records_endpoints(self):
+        phuey.instrumentation.enable()
+        self.mock.return_value.status = 200
+        self.mock.return_value.read.return_value = bytes('{"state": {"on": true}}', 'utf-8')
+        phuey.Light(self.ip, self.user, 17).refresh()
+        phuey.Light(self.ip, self.user, 18).refresh()
+        self.mock.return_value.read.return_value = bytes('[{"error": {"description": "resource not available"}}]', 'utf-8')
+        with self.assertRaises(AttributeError):
+            phuey.Light(self.ip, self.user, 99).refresh()
+        series = dict(((s['endpoint'], s['error']), s) for s in phuey.instrumentation.snapshot())
+        ok = series[('/api/<user>/lights/<id>', None)]
+        self.assertEqual((ok['count'], ok['status'], ok['method']), (2, 200, 'GET'))
+        self.assertEqual(ok['buckets'][5.0], 2)
+        self.assertEqual(series[('/api/<user>/lights/<id>', 'resource not available')]['count'], 1)
+        text = phuey.instrumentation.to_prometheus()
+        self.assertIn('phuey_requests_total{bridge="ip",method="GET",endpoint="/api/<user>/lights/<id>",status="200",error=""} 2', text)
+        self.assertIn('le="+Inf"} 2', text)
+
+    def test_instrumentation_hooks(self):
+        calls = []
+        pre = lambda *args: calls.append(('pre',) + args)
+        post = lambda *args: calls.append(('post',) + args[:5])
+        phuey.instrumentation.add_pre_hook(pre)
+        phuey.instrumentation.add_post_hook(post)
+        self.mock.return_value.status = 404
+        self.mock.return_value.reason = 'Not Found'
+        try:
+            with self.assertRaises(RuntimeError):
+                phuey.Light(self.ip, self.user, 17).refresh()
+        finally:
+            phuey.instrumentation.remove_hook(pre)
+            phuey.instrumentation.remove_hook(post)
+        self.assertEqual(calls, [('pre', 'ip', 'GET', '/api/user/lights/17', None),
+                                 ('post', 'ip', 'GET', '/api/user/lights/17', 404, 'RuntimeError')])
+        self.assertEqual(phuey.instrumentation.snapshot(), [])
+        self.assertFalse(phuey.instrumentation.active)
+
 if __name__ == "__main__":
     unittest.main()
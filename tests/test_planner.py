@@ -0,0 +1,91 @@
+'''
+Tests of the group-aware command planner against the fake bridge
+'''
+import time
+import unittest
+
+import phuey
+from phuey.fakebridge import FakeBridge, make_config
+from phuey.planner import CommandPlanner, plan
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        # group 1 holds the odd lights, group 2 the even ones
+        self.fake = FakeBridge(make_config(lights=8, groups=2)).start()
+        self.bridge = phuey.Bridge(self.fake.address, self.fake.user,
+                                   rate_limit=False)
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def light_state(self, light_id):
+        return self.fake.config['lights'][str(light_id)]['state']
+
+    def test_everything_uses_group_zero(self):
+        result = CommandPlanner(self.bridge).apply(
+            dict((i, {"on": True, "bri": 7}) for i in range(1, 9)))
+        self.assertEqual(result.requests, 1)
+        self.assertEqual(result.saved, 7)
+        self.assertEqual(self.fake.requests["PUT"], 1)
+        self.assertTrue(all(self.light_state(i)["bri"] == 7
+                            for i in range(1, 9)))
+        self.assertEqual(self.bridge.lights[0].bri, 7)
+
+    def test_existing_groups(self):
+        desired = dict((i, {"bri": 10 if i % 2 else 20})
+                       for i in range(1, 9))
+        result = CommandPlanner(self.bridge).apply(desired)
+        self.assertEqual(len(result.group_steps), 2)
+        self.assertEqual(result.light_steps, [])
+        self.assertEqual(self.fake.requests["PUT"], 2)
+        self.assertEqual([self.light_state(i)["bri"] for i in (1, 2)],
+                         [10, 20])
+
+    def test_partial_group_falls_back_to_lights(self):
+        desired = {1: {"on": True}, 3: {"on": True}, 2: {"on": False}}
+        result = CommandPlanner(self.bridge).plan(desired)
+        self.assertEqual(result.group_steps, [])
+        self.assertEqual(result.requests, 3)
+        self.assertEqual(result.saved, 0)
+
+    def test_temporary_group(self):
+        desired = dict((i, {"alert": "select"}) for i in range(1, 6))
+        planner = CommandPlanner(self.bridge, temporary=True)
+        result = planner.apply(desired)
+        self.assertEqual(result.temporary, [(['1', '2', '3', '4', '5'],
+                                             {"alert": "select"})])
+        self.assertEqual(result.sent, 3)
+        self.assertEqual(result.errors, [])
+        self.assertEqual(sorted(self.fake.config['groups']), ['1', '2'])
+        self.assertTrue(all(self.light_state(i).get("alert") == "select"
+                            for i in range(1, 6)))
+        self.assertEqual(self.light_state(6)["alert"], "none")
+
+    def test_planning_sends_no_reads(self):
+        fake = FakeBridge(make_config(lights=20, groups=10)).start()
+        self.addCleanup(fake.stop)
+        bridge = phuey.Bridge(fake.address, fake.user, rate_limit=False,
+                              cache_ttl=0.01)
+        time.sleep(0.05)
+        reads = fake.requests["GET"]
+        result = CommandPlanner(bridge).apply(
+            dict((i, {"on": True}) for i in range(1, 21)))
+        self.assertEqual((result.requests, result.saved), (1, 19))
+        self.assertEqual(fake.requests["GET"], reads)
+        self.assertEqual(fake.requests["PUT"], 1)
+
+    def test_unknown_light(self):
+        with self.assertRaises(KeyError):
+            CommandPlanner(self.bridge).plan({99: {"on": True}})
+
+    def test_plan_without_groups(self):
+        result = plan({1: {"on": True}, 2: {}})
+        self.assertEqual(result.light_steps, [('1', {"on": True})])
+        self.assertEqual(result.baseline, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
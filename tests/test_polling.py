@@ -0,0 +1,115 @@
+'''
+Tests of the shared-memory state table and the multi-process poller
+'''
+import math
+import time
+import unittest
+
+import phuey
+from phuey import polling
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class StateTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = polling.StateTable.create(
+            [("10.0.0.1", "sensors", "1", "hall"),
+             ("10.0.0.1", "lights", "1", "lamp")])
+        self.attached = polling.StateTable.attach(self.table.name)
+
+    def tearDown(self):
+        self.attached.close()
+        self.table.close()
+        self.table.unlink()
+
+    def test_rows_are_shared(self):
+        self.assertEqual(self.attached.rows, self.table.rows)
+        row = self.attached.find("10.0.0.1", "lights", 1)
+        self.assertEqual(row, 1)
+        self.assertTrue(math.isnan(self.table.read(row)["updated"]))
+        self.table.write(row, {"on": 1.0, "bri": 200.0})
+        values = self.attached.read(row)
+        self.assertEqual(values["version"], 2)
+        self.assertEqual((values["on"], values["bri"]), (1.0, 200.0))
+        self.assertTrue(math.isnan(values["presence"]))
+        view = self.attached.array()
+        self.assertEqual(view[1, polling.COLUMNS.index("bri")], 200.0)
+        del view
+
+    def test_read_waits_for_writer(self):
+        self.table._flat[0] = 1
+        with self.assertRaises(RuntimeError):
+            self.attached.read(0, retries=3)
+        self.table._flat[0] = 2
+        self.assertEqual(self.attached.read(0)["version"], 2)
+
+    def test_unknown_block(self):
+        with self.assertRaises(KeyError):
+            self.table.find("10.0.0.2", "lights", "1")
+
+    def test_normalize(self):
+        values = polling.normalize("sensors", {
+            "state": {"temperature": 2150, "lightlevel": 10001,
+                      "dark": False, "lastupdated": "1970-01-01T00:01:00"},
+            "config": {"on": True, "reachable": True, "battery": 90}})
+        self.assertEqual(values["temperature"], 21.5)
+        self.assertAlmostEqual(values["lux"], 10.0)
+        self.assertEqual((values["dark"], values["on"]), (0.0, 1.0))
+        self.assertEqual(values["lastupdated"], 60.0)
+        self.assertTrue(math.isnan(values["presence"]))
+        lights = polling.normalize("lights", {"state": {"on": False}})
+        self.assertEqual(lights["on"], 0.0)
+        self.assertTrue(math.isnan(lights["bri"]))
+
+
+class SensorPollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=2, sensors=2)).start()
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_poll(self):
+        bridges = [(self.fake.address, self.fake.user)]
+        with polling.SensorPoller(bridges, interval=0.05,
+                                  processes=1) as poller:
+            self.assertEqual(len(poller.workers), 1)
+            self.assertEqual(len(poller.table), 4)
+            self.assertTrue(poller.wait_for_data())
+            self.fake.config["sensors"]["2"]["state"]["presence"] = True
+            consumer = polling.StateTable.attach(poller.table.name)
+            row = consumer.find(self.fake.address, "sensors", "2")
+            self.assertEqual(consumer.rows[row][3], "sensor 2")
+            for _ in range(100):
+                if consumer.read(row)["presence"] == 1.0:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(consumer.read(row)["presence"], 1.0)
+            light = consumer.read(consumer.find(self.fake.address,
+                                                "lights", 1))
+            self.assertEqual(light["reachable"], 1.0)
+            consumer.close()
+        self.assertIsNone(poller.table)
+        self.assertEqual(poller.workers, [])
+
+    def test_poll_pipelined(self):
+        bridges = [(self.fake.address, self.fake.user)]
+        with polling.SensorPoller(bridges, interval=0.05, processes=1,
+                                  transport="pipelined") as poller:
+            self.assertTrue(poller.wait_for_data())
+
+    def test_failed_bridge_is_left_out(self):
+        bridges = [(self.fake.address, self.fake.user),
+                   ("127.0.0.1:9", "nobody")]
+        poller = polling.SensorPoller(bridges, processes=1)
+        rows, assignments = poller._inventory()
+        self.assertEqual(len(assignments), 1)
+        self.assertIn("127.0.0.1:9", poller.errors)
+        self.assertEqual(len(rows), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Tests of recording bridge traffic and replaying it without a bridge
+'''
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import phuey
+from phuey import replay
+from phuey.fakebridge import FakeBridge, make_config
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "traffic.log")
+        self.fake = FakeBridge(make_config(lights=3)).start()
+        self.address, self.user = self.fake.address, self.fake.user
+        with replay.record(self.address, self.path) as recorder:
+            b = phuey.Bridge(self.address, self.user, rate_limit=False)
+            b.lights[0].on = True
+            b.refresh()
+        self.recorded = recorder.count
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def tearDown(self):
+        phuey.BridgeContext.reset_all()
+        shutil.rmtree(self.directory)
+
+    def test_log_format(self):
+        with open(self.path) as log:
+            entries = [json.loads(line) for line in log]
+        self.assertEqual(self.recorded, 3)
+        self.assertEqual([(e["m"], e["s"]) for e in entries],
+                         [("GET", 200), ("PUT", 200), ("GET", 200)])
+        self.assertEqual(json.loads(entries[1]["b"]), {"on": True})
+        self.assertTrue(all(e["e"] >= 0 for e in entries))
+
+    def test_replay_without_a_bridge(self):
+        with replay.replay(self.address, self.path) as log:
+            b = phuey.Bridge(self.address, self.user, rate_limit=False)
+            self.assertEqual(len(b), 3)
+            b.lights[0].on = True
+            b.refresh()
+            self.assertTrue(b.lights[0].on)
+            for _ in range(5):
+                b.refresh()
+        self.assertEqual((log.served, log.missed), (8, 0))
+        self.assertIsNone(
+            phuey.ConnectionPool.for_bridge(self.address).connection_factory)
+
+    def test_unrecorded_request(self):
+        with replay.replay(self.address, self.path) as log:
+            with self.assertRaises(RuntimeError):
+                phuey.Light(self.address, self.user, 2).refresh()
+        self.assertEqual(log.missed, 1)
+
+    def test_bridge_with_own_transport(self):
+        with FakeBridge(make_config(lights=3)) as fake:
+            b = phuey.Bridge(fake.address, fake.user, rate_limit=False,
+                             transport="pipelined")
+            path = os.path.join(self.directory, "pipelined.log")
+            with replay.record(b, path) as recorder:
+                b.lights[0].on = True
+                b._get_many([b.base_uri + "/lights", b.base_uri + "/groups"])
+        self.assertEqual(recorder.count, 3)
+        with replay.replay(b, path) as log:
+            lights, groups = b._get_many([b.base_uri + "/lights",
+                                          b.base_uri + "/groups"])
+        self.assertTrue(lights["1"]["state"]["on"])
+        self.assertEqual((log.served, log.missed), (2, 0))
+        self.assertIsNone(b.transport.connection_factory)
+
+    def test_transport_without_connections(self):
+        memory = FakeBridge(make_config(lights=1)).transport()
+        with self.assertRaises(ValueError):
+            with replay.record(memory, self.path):
+                pass
+
+    def test_original_timing(self):
+        log = replay.TrafficLog(self.path)
+        waits = []
+        connection = replay.ReplayConnection(log, speed=2.0,
+                                             sleep=waits.append)
+        connection.request("GET", "/api/{}".format(self.user))
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(waits, [log.entries[0]["e"] / 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
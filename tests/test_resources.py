@@ -0,0 +1,107 @@
+'''
+Tests of scenes, rules, schedules and sensors and their bulk operations
+'''
+import unittest
+
+import phuey
+from phuey.fakebridge import FakeBridge, make_config
+
+
+def rule(name, bri=100, status="enabled"):
+    return {"name": name, "status": status,
+            "conditions": [{"address": "/sensors/1/state/presence",
+                            "operator": "eq", "value": "true"}],
+            "actions": [{"address": "/groups/1/action", "method": "PUT",
+                         "body": {"bri": bri}}]}
+
+
+class ResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        config = make_config(lights=2)
+        config['rules'] = {"1": rule("hall on"), "2": rule("hall off", 0)}
+        config['schedules'] = {"1": {"name": "wake up",
+                                     "localtime": "W124/T07:00:00"}}
+        config['scenes'] = {"OFr8i5Ji8tGhf4N": {"name": "Relax",
+                                                "lights": ["1", "2"]}}
+        self.fake = FakeBridge(config).start()
+        self.bridge = phuey.Bridge(self.fake.address, self.fake.user)
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_items_are_backed_by_the_config(self):
+        scene = self.bridge.scenes[0]
+        self.assertEqual((scene.scene_id, scene.name), ("OFr8i5Ji8tGhf4N",
+                                                        "Relax"))
+        self.assertEqual(scene['lights'], ["1", "2"])
+        schedule = self.bridge.schedules[0]
+        self.assertIsInstance(schedule, phuey.Schedule)
+        self.assertEqual(schedule['localtime'], "W124/T07:00:00")
+        self.assertEqual([r.name for r in self.bridge.rules],
+                         ["hall on", "hall off"])
+        self.assertEqual(self.bridge.sensors[0]['presence'], False)
+        self.assertEqual(self.fake.requests["GET"], 1)
+
+    def test_single_item_crud(self):
+        created = phuey.Rule.create(self.fake.address, self.fake.user,
+                                    rule("new"))
+        self.assertEqual(created.rule_id, "3")
+        created.update({"status": "disabled"})
+        self.assertEqual(self.fake.config['rules']['3']['status'], "disabled")
+        created.name = "renamed"
+        self.assertEqual(self.fake.config['rules']['3']['name'], "renamed")
+        created.remove()
+        self.assertNotIn('3', self.fake.config['rules'])
+
+    def test_bulk(self):
+        results = self.bridge.bulk('rules', [
+            ("create", None, rule("a")),
+            ("update", 1, {"status": "disabled"}),
+            ("delete", 2, None),
+            ("delete", 42, None),
+            ("explode", 1, None)])
+        self.assertEqual([r.ok for r in results],
+                         [True, True, True, False, False])
+        self.assertEqual(results[0].item_id, "3")
+        self.assertIsInstance(results[3].error, KeyError)
+        self.assertEqual(sorted(self.fake.config['rules']), ['1', '3'])
+        self.assertEqual([r.rule_id for r in self.bridge.rules], ['1', '3'])
+        self.assertEqual(self.bridge.rules[0]['status'], "disabled")
+
+    def test_bridge_errors_are_reported_per_item(self):
+        results = self.bridge.bulk('schedules', [
+            ("update", 1, {"name": "later"})])
+        self.assertTrue(results[0].ok)
+        self.fake.config['schedules'].clear()
+        results = self.bridge.bulk('schedules', [
+            ("update", 1, {"name": "never"})])
+        self.assertIsInstance(results[0].error, AttributeError)
+
+    def test_sync_only_sends_changes(self):
+        desired = [rule("hall on"), rule("hall off", 50), rule("night")]
+        results = self.bridge.sync('rules', desired)
+        self.assertEqual([(r.op, r.item_id) for r in results],
+                         [("update", "2"), ("create", "3")])
+        self.assertEqual(self.fake.config['rules']['2']['actions'][0]
+                         ['body'], {"bri": 50})
+        puts, posts = self.fake.requests["PUT"], self.fake.requests["POST"]
+        self.assertEqual(self.bridge.sync('rules', desired), [])
+        self.assertEqual((self.fake.requests["PUT"],
+                          self.fake.requests["POST"]), (puts, posts))
+        results = self.bridge.sync('rules', [rule("night")], prune=True)
+        self.assertEqual(sorted(r.item_id for r in results), ["1", "2"])
+        self.assertEqual(list(self.fake.config['rules']), ['3'])
+
+    def test_refresh_reconciles_every_collection(self):
+        self.fake.config['rules']['9'] = rule("added")
+        del self.fake.config['scenes']['OFr8i5Ji8tGhf4N']
+        self.bridge.refresh()
+        self.assertEqual([r.rule_id for r in self.bridge.rules],
+                         ['1', '2', '9'])
+        self.assertEqual(self.bridge.scenes, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
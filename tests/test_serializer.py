@@ -0,0 +1,48 @@
+'''
+Tests of the pluggable JSON layer
+'''
+import unittest
+
+import phuey
+from phuey import serializer
+from phuey.fakebridge import make_config
+
+
+class SerializerTest(unittest.TestCase):
+
+    def tearDown(self):
+        serializer.use()
+
+    def test_every_backend_round_trips(self):
+        config = make_config(lights=3)
+        config['config']['name'] = "Küche"
+        for name in serializer.BACKENDS:
+            serializer.use(name)
+            data = serializer.dumps(config)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(serializer.loads(data), config)
+            self.assertEqual(serializer.loads(data.decode("utf-8")), config)
+
+    def test_fastest_backend_is_the_default(self):
+        self.assertEqual(serializer.use(), next(iter(serializer.BACKENDS)))
+        self.assertEqual(serializer.backend, next(iter(serializer.BACKENDS)))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            serializer.use("pickle")
+
+    def test_malformed_documents_raise_value_error(self):
+        for name in serializer.BACKENDS:
+            serializer.use(name)
+            with self.assertRaises(ValueError):
+                serializer.loads(b'{"on": tru')
+
+    def test_error_check_response_takes_bytes(self):
+        self.assertEqual(phuey.error_check_response(b'[]'), [])
+        with self.assertRaises(AttributeError):
+            phuey.error_check_response(
+                b'[{"error": {"type": 1, "description": "unauthorized"}}]')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+'''
+Tests of the transports a Bridge talks to its lights and groups through
+'''
+import os
+import ssl
+import unittest
+
+import phuey
+from phuey import transport
+from phuey.fakebridge import FakeBridge, make_config
+
+CERTIFICATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "fake_bridge.pem")
+
+
+class MemoryTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=3))
+        self.transport = self.fake.transport()
+
+    def tearDown(self):
+        phuey.BridgeContext.reset_all()
+
+    def test_bridge_in_memory(self):
+        b = phuey.Bridge("fake", self.fake.user, rate_limit=False,
+                         transport=self.transport)
+        self.assertEqual(len(b), 3)
+        self.assertIs(b.lights[0].transport, self.transport)
+        self.assertIs(b.groups[0].pool, self.transport)
+        b.lights[0].on = True
+        self.assertTrue(self.fake.config["lights"]["1"]["state"]["on"])
+        self.assertEqual(self.transport.requests[-1][:2],
+                         ("PUT", "/api/phuey/lights/1/state"))
+        self.assertEqual(self.fake.requests["PUT"], 1)
+        # nothing went through the shared pool of the address
+        self.assertEqual(phuey.ConnectionPool.for_bridge("fake").misses, 0)
+
+    def test_error_status(self):
+        self.fake.error_rate = 1.0
+        light = phuey.Light("fake", self.fake.user, 1, phuey.BridgeContext(
+            "fake", self.fake.user, rate_limit=False,
+            retry=phuey.RetryPolicy(attempts=1), transport=self.transport))
+        with self.assertRaises(phuey.RateLimitError):
+            light.on = True
+
+    def test_bridge_errors(self):
+        with self.assertRaises(AttributeError):
+            phuey.Bridge("fake", "nobody", transport=self.transport)
+
+    def test_create_transport(self):
+        self.assertIs(transport.create_transport("http", "10.0.0.1"),
+                      phuey.ConnectionPool.for_bridge("10.0.0.1"))
+        pipelined = transport.create_transport("pipelined", "10.0.0.1",
+                                               depth=4)
+        self.assertEqual(pipelined.depth, 4)
+        with self.assertRaises(ValueError):
+            transport.create_transport("carrier pigeon", "10.0.0.1")
+
+
+class PipelinedTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeBridge(make_config(lights=10, sensors=2)).start()
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_exchange_many(self):
+        pipelined = transport.PipelinedTransport(self.fake.address, depth=4)
+        urls = ["/api/phuey/lights/{}".format(i) for i in range(1, 11)]
+        results = pipelined.exchange_many([("GET", url, None)
+                                           for url in urls])
+        self.assertEqual([status for status, reason, data in results],
+                         [200] * 10)
+        self.assertEqual([phuey.json.loads(data)["name"]
+                          for status, reason, data in results],
+                         ["light {}".format(i) for i in range(1, 11)])
+        self.assertEqual(self.fake.requests["GET"], 10)
+        stats = pipelined.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 2))
+        missing = pipelined.exchange_many([("GET", "/nothing", None),
+                                           ("GET", urls[0], None)])
+        self.assertEqual([(status, data is None)
+                          for status, reason, data in missing],
+                         [(404, True), (200, False)])
+
+    def test_bridge_get_many(self):
+        b = phuey.Bridge(self.fake.address, self.fake.user,
+                         transport="pipelined")
+        self.assertIsInstance(b.lights[0].transport,
+                              transport.PipelinedTransport)
+        lights, sensors = b._get_many([b.base_uri + "/lights",
+                                       b.base_uri + "/sensors"])
+        self.assertEqual((len(lights), len(sensors)), (10, 2))
+        with self.assertRaises(AttributeError):
+            b._get_many([b.base_uri + "/lights", b.base_uri + "/nothing"])
+
+    def test_writes_are_not_pipelined(self):
+        pipelined = transport.PipelinedTransport(self.fake.address)
+        body = b'{"on": true}'
+        pipelined.exchange_many([
+            ("PUT", "/api/phuey/lights/{}/state".format(i), body)
+            for i in (1, 2)], {"Content-type": "application/json"})
+        self.assertTrue(self.fake.config["lights"]["2"]["state"]["on"])
+        self.assertEqual(pipelined.stats()["hits"], 1)
+
+
+class HTTPSTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(CERTIFICATE)
+        self.fake = FakeBridge(make_config(lights=2),
+                               ssl_context=context).start()
+
+    def tearDown(self):
+        self.fake.stop()
+        phuey.BridgeContext.reset_all()
+
+    def test_pins_first_certificate(self):
+        https = transport.HTTPSTransport(self.fake.address)
+        b = phuey.Bridge(self.fake.address, self.fake.user,
+                         transport=https)
+        self.assertEqual(len(b), 2)
+        self.assertEqual(len(https.fingerprint), 64)
+        pinned = transport.HTTPSTransport(self.fake.address,
+                                          fingerprint=https.fingerprint)
+        status, reason, data = pinned.exchange("GET", "/api/phuey/lights")
+        self.assertEqual(status, 200)
+
+    def test_rejects_other_certificate(self):
+        https = transport.HTTPSTransport(self.fake.address,
+                                         fingerprint="00:" * 31 + "00")
+        with self.assertRaises(transport.CertificateMismatchError):
+            https.exchange("GET", "/api/phuey/lights")
+        with self.assertRaises(transport.CertificateMismatchError):
+            phuey.Bridge(self.fake.address, self.fake.user,
+                         transport=https)
+        # never retried, and not taken as the bridge being down
+        self.assertEqual(self.fake.requests["GET"], 0)
+        stats = phuey.CircuitBreaker.for_bridge(self.fake.address).stats()
+        self.assertEqual((stats["retries"], stats["failures"]), (0, 0))
+        pipelined = transport.PipelinedHTTPSTransport(
+            self.fake.address, fingerprint=https.fingerprint)
+        light = phuey.Light(self.fake.address, self.fake.user, 1,
+                            phuey.BridgeContext(self.fake.address,
+                                                self.fake.user,
+                                                transport=pipelined))
+        with self.assertRaises(transport.CertificateMismatchError):
+            light._get_many([light.name_uri, light.state_uri])
+
+
+if __name__ == '__main__':
+    unittest.main()